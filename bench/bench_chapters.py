@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+"""Chapter file benchmark
+
+Generates synthetic chapter files, cue lists of one timestamped line out
+of two, then times the parsing of each of them by read_chapters_txt(),
+which streams the file, and by extract_chapters_txt(), which is given the
+whole text. The results are written as JSON, e.g.:
+
+    python bench/bench_chapters.py --lines 100000,1000000 \\
+        --output bench.json
+"""
+from __future__ import unicode_literals
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# Allow direct execution
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chapter_split import util
+
+PARSERS = ["stream", "text"]
+
+# Last time point of the generated files, the time points of a chapter file
+# having at most two digits of hours
+LAST_SECOND = 99 * 3600 + 59 * 60 + 59
+
+
+def _commasep_list(cast):
+    def parse(string):
+        try:
+            return [cast(val) for val in string.split(",")]
+        except ValueError:
+            msg = "invalid list '{}'".format(string)
+            raise argparse.ArgumentTypeError(msg)
+
+    return parse
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark the parsing of chapter files."
+    )
+    parser.add_argument(
+        "--lines",
+        type=_commasep_list(int),
+        default=[10000, 100000, 1000000],
+        metavar="LIST",
+        help="""Comma separated numbers of lines, one chapter file is
+        generated for each. [Default: 10000,100000,1000000]""",
+    )
+    parser.add_argument(
+        "--parsers",
+        type=_commasep_list(str),
+        default=PARSERS,
+        metavar="LIST",
+        help="""Comma separated parsers among "stream" (read_chapters_txt)
+        and "text" (extract_chapters_txt). [Default: stream,text]""",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=3,
+        metavar="N",
+        help="""Number of runs of each case, the median one is reported.
+        [Default: 3]""",
+    )
+    parser.add_argument(
+        "--workdir",
+        default=None,
+        metavar="DIR",
+        help="""Where the chapter files are written. It is kept, so that
+        the files are only generated once. [Default: a temporary directory,
+        removed afterwards]""",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        default=None,
+        metavar="FILE",
+        help="Write the JSON report to FILE instead of the standard output.",
+    )
+    args = parser.parse_args(argv)
+    for name in args.parsers:
+        if name not in PARSERS:
+            parser.error("unknown parser '{}'".format(name))
+    if args.repeat < 1 or min(args.lines) < 1:
+        parser.error("--repeat and --lines should be positive")
+    return args
+
+
+def generate_chapters(workdir, nb_lines):
+    """Returns the path of a chapter file of NB_LINES lines, generating it
+    in WORKDIR unless it is already there. Every other line is a comment,
+    the others giving increasing time points up to LAST_SECOND."""
+    path = os.path.join(workdir, "chapters-{}.txt".format(nb_lines))
+    if os.path.exists(path):
+        return path
+    nb_timed = (nb_lines + 1) // 2
+    with open(path + ".part", "w") as f:
+        for i in range(nb_lines):
+            if i % 2:
+                f.write("REM comment of the chapter {}\n".format(i // 2))
+                continue
+            second = LAST_SECOND * (i // 2) // max(1, nb_timed - 1)
+            f.write(
+                "{}:{:02d}:{:02d} - Track {} <a href='#'>link</a>\n".format(
+                    second // 3600, second // 60 % 60, second % 60, i // 2
+                )
+            )
+    os.replace(path + ".part", path)
+    return path
+
+
+def parse(path, parser):
+    with open(path) as f:
+        if parser == "stream":
+            return util.read_chapters_txt(f, LAST_SECOND)
+        return util.extract_chapters_txt(f.read(), LAST_SECOND)
+
+
+def bench_case(path, parser, repeat):
+    walls = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        chapters = parse(path, parser)
+        walls += [time.perf_counter() - start]
+    # The peak memory is measured apart, tracing slowing the parsing down
+    tracemalloc.start()
+    parse(path, parser)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    wall = statistics.median_low(walls)
+    return {
+        "wall": wall,
+        "chapters": len(chapters),
+        "peak_memory": peak,
+        "runs": walls,
+    }
+
+
+def bench(args, workdir):
+    results = []
+    for nb_lines in args.lines:
+        path = generate_chapters(workdir, nb_lines)
+        for parser in args.parsers:
+            result = {"parser": parser, "lines": nb_lines}
+            result["size"] = os.path.getsize(path)
+            result.update(bench_case(path, parser, args.repeat))
+            result["lines_per_second"] = (
+                nb_lines / result["wall"] if result["wall"] else None
+            )
+            print(
+                "{parser:6} {lines:8d} lines: {wall:8.3f}s "
+                "{peak_memory:12d} bytes peak".format(**result),
+                file=sys.stderr,
+            )
+            results += [result]
+    return {
+        "repeat": args.repeat,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.workdir:
+        os.makedirs(args.workdir, exist_ok=True)
+        report = bench(args, args.workdir)
+    else:
+        with tempfile.TemporaryDirectory(prefix="chaps-bench-") as workdir:
+            report = bench(args, workdir)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
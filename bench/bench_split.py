@@ -0,0 +1,277 @@
+#!/usr/bin/env python
+"""Split benchmark
+
+Generates synthetic media with ffmpeg's lavfi sources, then times
+split_file_on_chapters on them for every combination of mode (stream
+copy or re-encode), number of chapters and number of jobs. The results
+are written as JSON, e.g.:
+
+    python bench/bench_split.py --duration 600 --chapters 8,32 \\
+        --jobs 1,2,4 --output bench.json
+"""
+from __future__ import unicode_literals
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess as sp
+import sys
+import tempfile
+import time
+
+# Allow direct execution
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from multiprocessing import cpu_count
+
+from chapter_split import ffmpeg
+from chapter_split.options import parse_args as chaps_parse_args
+
+MODES = ["copy", "encode"]
+
+
+def _commasep_list(cast):
+    def parse(string):
+        try:
+            return [cast(val) for val in string.split(",")]
+        except ValueError:
+            msg = "invalid list '{}'".format(string)
+            raise argparse.ArgumentTypeError(msg)
+
+    return parse
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark the chapter split pipeline."
+    )
+    parser.add_argument(
+        "--duration",
+        type=float,
+        default=300,
+        metavar="SECONDS",
+        help="Duration of the generated media. [Default: 300]",
+    )
+    parser.add_argument(
+        "--chapters",
+        type=_commasep_list(int),
+        default=[4, 16],
+        metavar="LIST",
+        help="""Comma separated numbers of chapters, one media is generated
+        for each. [Default: 4,16]""",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=_commasep_list(int),
+        default=sorted({1, 2, cpu_count()}),
+        metavar="LIST",
+        help="""Comma separated values of --jobs. The scaling efficiency
+        is computed relatively to the smallest one.
+        [Default: 1,2,<number of cores>]""",
+    )
+    parser.add_argument(
+        "--modes",
+        type=_commasep_list(str),
+        default=MODES,
+        metavar="LIST",
+        help="""Comma separated modes among "copy" (--copy) and "encode".
+        [Default: copy,encode]""",
+    )
+    parser.add_argument(
+        "--size",
+        default="320x240",
+        help="Size of the generated video. [Default: 320x240]",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=3,
+        metavar="N",
+        help="""Number of runs of each case, the median one is reported.
+        [Default: 3]""",
+    )
+    parser.add_argument(
+        "--workdir",
+        default=None,
+        metavar="DIR",
+        help="""Where the media and the chapters are written. It is kept,
+        so that the media are only generated once. [Default: a temporary
+        directory, removed afterwards]""",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        default=None,
+        metavar="FILE",
+        help="Write the JSON report to FILE instead of the standard output.",
+    )
+    args = parser.parse_args(argv)
+    for mode in args.modes:
+        if mode not in MODES:
+            parser.error("unknown mode '{}'".format(mode))
+    if args.repeat < 1 or min(args.jobs) < 1 or min(args.chapters) < 1:
+        parser.error("--repeat, --jobs and --chapters should be positive")
+    return args
+
+
+def ffmpeg_version():
+    out = sp.check_output(["ffmpeg", "-version"], universal_newlines=True)
+    return out.splitlines()[0]
+
+
+def write_ffmetadata(path, duration, nb_chapters):
+    """Writes an FFMETADATA file splitting DURATION seconds in NB_CHAPTERS
+    chapters of equal length."""
+    total = int(duration * 1000)
+    with open(path, "w") as f:
+        f.write(";FFMETADATA1\ntitle=Bench\n")
+        for i in range(nb_chapters):
+            f.write("[CHAPTER]\nTIMEBASE=1/1000\n")
+            f.write("START={}\n".format(total * i // nb_chapters))
+            f.write("END={}\n".format(total * (i + 1) // nb_chapters))
+            f.write("title=Chapter {}\n".format(i + 1))
+
+
+def generate_media(workdir, duration, size, nb_chapters):
+    """Returns the path of a DURATION seconds long video with NB_CHAPTERS
+    chapters, generating it in WORKDIR unless it is already there."""
+    name = "bench-{:g}s-{}-{}ch.mkv".format(duration, size, nb_chapters)
+    path = os.path.join(workdir, name)
+    if os.path.exists(path):
+        return path
+    metadata = os.path.join(workdir, "bench-{}ch.txt".format(nb_chapters))
+    write_ffmetadata(metadata, duration, nb_chapters)
+    video = "testsrc=duration={:g}:size={}:rate=25".format(duration, size)
+    audio = "sine=frequency=440:duration={:g}".format(duration)
+    cmd = ["ffmpeg", "-y", "-loglevel", "error"]
+    cmd += ["-f", "lavfi", "-i", video, "-f", "lavfi", "-i", audio]
+    cmd += ["-i", metadata, "-map", "0:v", "-map", "1:a"]
+    cmd += ["-map_metadata", "2", "-map_chapters", "2"]
+    # One keyframe every 2 seconds, as most encoders do by default
+    cmd += ["-codec:v", "mpeg4", "-q:v", "5", "-g", "50", "-codec:a", "aac"]
+    sp.check_call(cmd + [path + ".part.mkv"], stdout=sp.DEVNULL)
+    os.replace(path + ".part.mkv", path)
+    return path
+
+
+def cpu_times():
+    """Returns the user and system times of this process and of its
+    waited for children, which include ffmpeg and the pool workers."""
+    times = os.times()
+    return times[0] + times[2], times[1] + times[3]
+
+
+def run_case(media, outdir, mode, njobs):
+    """Splits MEDIA in OUTDIR and returns the wall, user and system times
+    of the split, the probe being done beforehand."""
+    argv = [media, "-q", "--no-probe-cache", "-j", str(njobs)]
+    argv += ["-o", os.path.join(outdir, "%(chapter-index)s.%(ext)s")]
+    if mode == "copy":
+        argv += ["-c"]
+    chaps_parse_args(argv)
+    jinfos = ffmpeg.get_infos(media)
+    user, system = cpu_times()
+    start = time.perf_counter()
+    ffmpeg.split_file_on_chapters(media, jinfos)
+    wall = time.perf_counter() - start
+    end_user, end_system = cpu_times()
+    for name in os.listdir(outdir):
+        os.remove(os.path.join(outdir, name))
+    return wall, end_user - user, end_system - system
+
+
+def bench_case(media, outdir, mode, njobs, repeat):
+    runs = []
+    for _ in range(repeat):
+        wall, user, system = run_case(media, outdir, mode, njobs)
+        runs += [{"wall": wall, "user": user, "system": system}]
+    median = statistics.median_low([run["wall"] for run in runs])
+    median_run = next(run for run in runs if run["wall"] == median)
+    return {
+        "wall": median_run["wall"],
+        "cpu": median_run["user"] + median_run["system"],
+        "user": median_run["user"],
+        "system": median_run["system"],
+        "runs": runs,
+    }
+
+
+def add_efficiency(results):
+    """Sets the scaling efficiency of each result, i.e. the speedup over
+    the smallest number of jobs of the same mode and chapters divided by
+    the increase of the number of jobs."""
+    for result in results:
+        base = min(
+            (
+                r
+                for r in results
+                if r["mode"] == result["mode"]
+                and r["chapters"] == result["chapters"]
+            ),
+            key=lambda r: r["jobs"],
+        )
+        speedup = base["wall"] / result["wall"] if result["wall"] else None
+        result["speedup"] = speedup
+        result["efficiency"] = (
+            speedup * base["jobs"] / result["jobs"] if speedup else None
+        )
+
+
+def bench(args, workdir):
+    outdir = os.path.join(workdir, "out")
+    os.makedirs(outdir, exist_ok=True)
+    results = []
+    for nb_chapters in args.chapters:
+        media = generate_media(workdir, args.duration, args.size, nb_chapters)
+        for mode in args.modes:
+            for njobs in args.jobs:
+                result = {"mode": mode, "chapters": nb_chapters}
+                result["jobs"] = njobs
+                result.update(
+                    bench_case(media, outdir, mode, njobs, args.repeat)
+                )
+                print(
+                    "{mode:6} {chapters:4d} chapters {jobs:3d} jobs: "
+                    "{wall:8.3f}s wall {cpu:8.3f}s cpu".format(**result),
+                    file=sys.stderr,
+                )
+                results += [result]
+    add_efficiency(results)
+    return {
+        "media": {"duration": args.duration, "size": args.size},
+        "repeat": args.repeat,
+        "cpu_count": cpu_count(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "ffmpeg": ffmpeg_version(),
+        "results": results,
+    }
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    for program in ("ffmpeg", "ffprobe"):
+        if shutil.which(program) is None:
+            print("{} is required".format(program), file=sys.stderr)
+            return 1
+    if args.workdir:
+        os.makedirs(args.workdir, exist_ok=True)
+        report = bench(args, args.workdir)
+    else:
+        with tempfile.TemporaryDirectory(prefix="chaps-bench-") as workdir:
+            report = bench(args, workdir)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -8,18 +8,26 @@ from .verbosity import (
     vprint,
     vvprint,
     vvvprint,
+    err,
     set_level as verbosity_set_level,
     VERBOSE_LEVEL,
     VVERBOSE_LEVEL,
     VVVERBOSE_LEVEL,
 )
 
-from . import ffmpeg
+from . import ffmpeg, trace, daemon
 
-from .util import sec_to_hour, extract_chapters_txt
+from .api import SplitOptions, probe, plan, split
+
+from .command import process
 
 
 def main():
+    command = sys.argv[1] if len(sys.argv) > 1 else None
+    if command == "--serve":
+        sys.exit(daemon.serve(sys.argv[2:]))
+    if command == "--submit":
+        sys.exit(daemon.submit(sys.argv[2:]))
     args = parse_args()
     # Setup the verbose functions
     v = args.verbose
@@ -29,22 +37,15 @@ def main():
         verbosity_set_level(VVERBOSE_LEVEL, debug=args.debug)
     elif v == 3:
         verbosity_set_level(VVVERBOSE_LEVEL, debug=args.debug)
-    vvprint("Given file is {}".format(args.file))
-    if args.chapter_file:
-        infos = ffmpeg.get_infos(args.file)
-        duration = float(infos["format"]["duration"])
-
-        with open(args.chapter_file) as f:
-            text = f.read()
-            chapters = extract_chapters_txt(text, duration)
-            ffmpeg.split_file_on_chapters(
-                args.file, ffmpeg.get_infos(args.file), chapters=chapters
-            )
-        sys.exit(0)
-    if args.printchapters:
-        ffmpeg.print_chapters(args.file, ffmpeg.get_infos(args.file))
-        sys.exit(0)
-    ffmpeg.split_file_on_chapters(args.file, ffmpeg.get_infos(args.file))
+    if args.trace:
+        trace.start_trace(args.trace)
+    profiler = trace.start_profile() if args.profile else None
+    try:
+        process(args)
+    finally:
+        if profiler is not None:
+            trace.stop_profile(profiler, args.profile)
+        trace.stop_trace()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,164 @@
+"""Asyncio module
+
+Runs ffmpeg commands as asyncio subprocesses, so that several chapters
+can be extracted concurrently from a single Python process."""
+import asyncio
+import collections
+import functools
+import subprocess as sp
+import time
+
+from .verbosity import vvprint
+
+from . import trace
+
+from .report import ProgressStats, process_stats, wait_rusage
+
+from .util import (
+    shell_quote,
+    parse_duration,
+    parse_progress_line,
+    FFmpegException,
+)
+
+
+async def _drain(stream, lines):
+    while True:
+        line = await stream.readline()
+        if not line:
+            break
+        lines.append(line.decode("utf-8", "replace"))
+
+
+async def _read_pipe(pipe):
+    """Returns a StreamReader reading the file object PIPE, along with
+    the transport to close once done."""
+    loop = asyncio.get_event_loop()
+    reader = asyncio.StreamReader()
+    transport, _ = await loop.connect_read_pipe(
+        lambda: asyncio.StreamReaderProtocol(reader), pipe
+    )
+    return reader, transport
+
+
+async def run_ffmpeg(cmd, duration=None, on_progress=None, tid=None):
+    """Runs the ffmpeg command CMD, which must write its progress on
+    stdout, calling ON_PROGRESS with the fraction of DURATION already
+    processed each time ffmpeg reports it. Its trace spans are recorded
+    on TID. Returns the statistics of the process."""
+    vvprint("[debug] ffmpeg command line: {}".format(shell_quote(cmd)))
+    loop = asyncio.get_event_loop()
+    command_trace = trace.CommandTrace(cmd[-1], tid)
+    start = time.perf_counter()
+    # ffmpeg is not a child of the event loop, whose child watcher would
+    # reap it without its resource usage, it is waited for by a thread
+    proc = sp.Popen(cmd, stdin=sp.DEVNULL, stdout=sp.PIPE, stderr=sp.PIPE)
+    command_trace.spawned()
+    transports = []
+    stderr = collections.deque(maxlen=16)
+    progress = ProgressStats()
+    try:
+        stdout, transport = await _read_pipe(proc.stdout)
+        transports += [transport]
+        reader, transport = await _read_pipe(proc.stderr)
+        transports += [transport]
+        drain = asyncio.ensure_future(_drain(reader, stderr))
+        while True:
+            line = await stdout.readline()
+            if not line:
+                break
+            line = line.decode("utf-8", "replace")
+            key, value = parse_progress_line(line)
+            progress.feed(key, value)
+            if key == "out_time":
+                command_trace.progress()
+            if key == "out_time" and on_progress and duration:
+                current = parse_duration(value)
+                if current is not None:
+                    on_progress(current / duration)
+        command_trace.closed()
+        await drain
+        rusage = await loop.run_in_executor(None, wait_rusage, proc)
+        command_trace.exited()
+    except BaseException:
+        if proc.returncode is None:
+            proc.kill()
+            await loop.run_in_executor(None, proc.wait)
+        raise
+    finally:
+        for transport in transports:
+            transport.close()
+    if proc.returncode != 0:
+        message = stderr[-1].strip() if stderr else "ffmpeg failed"
+        raise FFmpegException(cmd, proc.returncode, message)
+    return process_stats(start, progress, rusage, duration)
+
+
+async def split(
+    commands,
+    njobs=1,
+    on_start=None,
+    on_progress=None,
+    on_done=None,
+    order=None,
+    prepare=None,
+):
+    """Runs every (cmd, duration) pair of COMMANDS, at most NJOBS at a
+    time, starting them in the ORDER of their indexes if given. ON_START,
+    ON_PROGRESS and ON_DONE are called with the index of the command in
+    COMMANDS (and the processed fraction for ON_PROGRESS, the statistics
+    of the command for ON_DONE).
+
+    PREPARE, if given, is called as PREPARE(index, cmd, running, waiting)
+    right before a command starts, with the numbers of running (itself
+    included) and not yet started commands, and returns the command to
+    run."""
+    semaphore = asyncio.Semaphore(njobs)
+    counters = {"started": 0, "finished": 0}
+
+    async def run_one(index, cmd, duration):
+        async with semaphore:
+            counters["started"] += 1
+            if prepare:
+                running = counters["started"] - counters["finished"]
+                waiting = len(commands) - counters["started"]
+                cmd = prepare(index, cmd, running, waiting)
+            if on_start:
+                on_start(index)
+            progress = None
+            if on_progress:
+                progress = functools.partial(on_progress, index)
+            # Concurrent commands are traced on their own row
+            try:
+                with trace.span("chapter", cat="job", tid=index + 1):
+                    stats = await run_ffmpeg(
+                        cmd, duration, progress, index + 1
+                    )
+            finally:
+                counters["finished"] += 1
+            if on_done:
+                on_done(index, stats)
+
+    if order is None:
+        order = range(len(commands))
+    # The semaphore is acquired in the order the tasks are created
+    tasks = [
+        asyncio.ensure_future(run_one(index, *commands[index]))
+        for index in order
+    ]
+    try:
+        await asyncio.gather(*tasks)
+    except Exception:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+
+def run(coroutine):
+    """Runs COROUTINE to completion in a new event loop."""
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
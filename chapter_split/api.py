@@ -0,0 +1,112 @@
+"""API module
+
+Probes and splits media files from Python, with explicit options instead
+of a command line, e.g.:
+
+    from chapter_split import SplitOptions, probe, split
+
+    options = SplitOptions(copy=True, jobs=4, output="%(title)s.%(ext)s")
+    infos = probe("book.m4b", options)
+    outputs = split("book.m4b", options, infos=infos)
+
+The --jobs workers are given the options explicitly, so that they also
+work with the "spawn" and "forkserver" start methods. The options are
+still those of the whole process while a call runs, so calls must not
+run concurrently in threads of a same process."""
+import copy
+
+from . import ffmpeg
+
+from .options import option_actions, default_args, set_args
+
+
+class SplitOptions:
+    """Options of probe() and split().
+
+    Options are given as keyword arguments named after the long command
+    line options, the dashes being replaced by underscores, e.g.
+    SplitOptions(copy=True, jobs=4, no_native=True). Options without a
+    value take a boolean, and the other ones take their parsed value,
+    e.g. only_chapters=[1, 2, 5].
+
+    START_METHOD is the multiprocessing start method of the --jobs
+    workers, the default one of the platform if None."""
+
+    def __init__(self, start_method=None, **options):
+        self._args = default_args()
+        self._args.startmethod = start_method
+        for name, value in options.items():
+            self.set(name, value)
+
+    @classmethod
+    def from_args(cls, args):
+        """Returns the options of ARGS, as returned by parse_args()."""
+        options = cls()
+        options._args = copy.copy(args)
+        if not hasattr(args, "startmethod"):
+            options._args.startmethod = None
+        return options
+
+    def _action(self, name):
+        try:
+            return option_actions()[name]
+        except KeyError:
+            raise TypeError("unknown option '{}'".format(name))
+
+    def set(self, name, value):
+        action = self._action(name)
+        if action.const is False and isinstance(value, bool):
+            # --no-xxx flags
+            value = not value
+        setattr(self._args, action.dest, value)
+
+    def get(self, name):
+        action = self._action(name)
+        value = getattr(self._args, action.dest)
+        if action.const is False and isinstance(value, bool):
+            value = not value
+        return value
+
+    def get_args(self):
+        """Returns the options as the argparse namespace get_args() gives."""
+        return copy.copy(self._args)
+
+    def __repr__(self):
+        return "SplitOptions({!r})".format(vars(self._args))
+
+
+def _use(options):
+    set_args((options or SplitOptions()).get_args())
+
+
+def probe(filename, options=None):
+    """Returns ffprobe's chapters, format and streams infos of FILENAME,
+    the dict split() takes as INFOS."""
+    _use(options)
+    return ffmpeg.get_infos(filename)
+
+
+def _files(files, infos):
+    if isinstance(files, str):
+        files = [files]
+        if infos is not None:
+            infos = [infos]
+    if infos is None:
+        infos = [ffmpeg.get_infos(filename) for filename in files]
+    return list(zip(files, infos))
+
+
+def plan(files, options=None, chapters=None, infos=None):
+    """Returns the plan of split(), as printed by --dry-run, without
+    running anything."""
+    _use(options)
+    return ffmpeg.plan_files(_files(files, infos), chapters=chapters)
+
+
+def split(files, options=None, chapters=None, infos=None):
+    """Splits FILES, a filename or a list of them, on their chapters with
+    OPTIONS and returns the outputs written. CHAPTERS overrides the
+    chapters of the files, as --chapter-file does. INFOS gives what probe()
+    returned for each file, they are probed otherwise."""
+    _use(options)
+    return ffmpeg.split_files(_files(files, infos), chapters=chapters)
@@ -0,0 +1,81 @@
+"""Archive module
+
+Adds the chapters to a tar or zip archive as soon as they are finished,
+instead of leaving them in place. Each chapter is removed once archived,
+so that only the chapters being extracted are ever on disk."""
+import os
+import sys
+import tarfile
+import zipfile
+
+from .verbosity import vvprint
+
+STDOUT = "-"
+
+TAR_COMPRESSIONS = {
+    ".gz": "gz",
+    ".tgz": "gz",
+    ".bz2": "bz2",
+    ".tbz2": "bz2",
+    ".xz": "xz",
+    ".txz": "xz",
+}
+
+
+def archive_format(path, fmt=None):
+    """Returns the (format, compression) of the archive written to PATH.
+    FMT forces the format, which is otherwise guessed from the extension
+    of PATH, tar being the default. Only tar archives are compressed,
+    according to the extension of PATH."""
+    ext = os.path.splitext(path.lower())[1]
+    if fmt is None:
+        fmt = "zip" if ext == ".zip" else "tar"
+    compression = TAR_COMPRESSIONS.get(ext, "") if fmt == "tar" else ""
+    return fmt, compression
+
+
+class Archive:
+    """Tar or zip archive written to PATH, or to the standard output when
+    PATH is "-".
+
+    Both are written sequentially, without ever seeking back, so that they
+    can be piped. Zip entries are stored without compression, as media
+    files hardly compress."""
+
+    def __init__(self, path, fmt=None):
+        self._path = path
+        self._format, compression = archive_format(path, fmt)
+        fileobj = sys.stdout.buffer if path == STDOUT else None
+        if self._format == "zip":
+            self._archive = zipfile.ZipFile(
+                fileobj or path, "w", zipfile.ZIP_STORED, allowZip64=True
+            )
+        elif fileobj is not None:
+            self._archive = tarfile.open(
+                mode="w|" + compression, fileobj=fileobj
+            )
+        else:
+            self._archive = tarfile.open(path, "w|" + compression)
+
+    def get_path(self):
+        return self._path
+
+    def add(self, filename, arcname):
+        """Appends FILENAME to the archive as ARCNAME, then removes it."""
+        if self._format == "zip":
+            self._archive.write(filename, arcname)
+        else:
+            self._archive.add(filename, arcname, recursive=False)
+        os.remove(filename)
+        vvprint("[chaps] Archived {}".format(arcname))
+
+    def close(self):
+        self._archive.close()
+        if self._path == STDOUT:
+            sys.stdout.buffer.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
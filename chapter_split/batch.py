@@ -0,0 +1,90 @@
+"""Batch module"""
+import glob
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from .verbosity import vprint, vvprint
+
+from . import ffmpeg
+
+from .options import bind_args
+
+from .util import STDIN
+
+MEDIA_EXTENSIONS = {
+    ".aac",
+    ".avi",
+    ".flac",
+    ".m4a",
+    ".m4b",
+    ".m4v",
+    ".mka",
+    ".mkv",
+    ".mov",
+    ".mp3",
+    ".mp4",
+    ".oga",
+    ".ogg",
+    ".ogv",
+    ".opus",
+    ".wav",
+    ".webm",
+    ".wma",
+    ".wmv",
+}
+
+
+class BatchException(Exception):
+    pass
+
+
+def _media_files(directory):
+    files = []
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        ext = os.path.splitext(name)[1].lower()
+        if os.path.isfile(path) and ext in MEDIA_EXTENSIONS:
+            files += [path]
+    return files
+
+
+def expand_inputs(inputs):
+    """Expands the files, directories and glob patterns of INPUTS into a
+    list of files. Directories are expanded to the media files they
+    directly contain."""
+    files = []
+    for entry in inputs:
+        if entry == STDIN:
+            found = [entry]
+        elif os.path.isdir(entry):
+            found = _media_files(entry)
+        elif os.path.exists(entry):
+            found = [entry]
+        else:
+            found = []
+            for path in sorted(glob.glob(entry)):
+                if os.path.isdir(path):
+                    found += _media_files(path)
+                else:
+                    found += [path]
+            if not found:
+                raise BatchException("file {} not found".format(entry))
+        for path in found:
+            if path not in files:
+                files += [path]
+    vvprint("Given files are {}".format(", ".join(files)))
+    return files
+
+
+def probe_files(files, njobs=1, chapters_only=False):
+    """Returns the infos of every file of FILES, probing up to NJOBS files
+    concurrently. With CHAPTERS_ONLY, the infos may only give the chapters
+    of the files."""
+    if len(files) > 1:
+        vprint("[chaps] Probing {} files...".format(len(files)))
+    probe = ffmpeg.get_chapter_infos if chapters_only else ffmpeg.get_infos
+    if njobs <= 1 or len(files) <= 1:
+        # Probed in this thread, no pool is needed
+        return [probe(filename) for filename in files]
+    with ThreadPoolExecutor(max_workers=max(1, njobs)) as executor:
+        return list(executor.map(bind_args(probe), files))
@@ -0,0 +1,175 @@
+"""Probe cache module"""
+import collections
+import hashlib
+import json
+import os
+import threading
+import time
+
+from .verbosity import vvprint, vvvprint
+
+CACHE_VERSION = 1
+MAX_ENTRIES = 4096
+MAX_AGE = 30 * 24 * 60 * 60
+# Files whose probes a process keeps in memory
+MEMO_ENTRIES = 256
+
+
+def get_cache_dir():
+    base = os.environ.get("XDG_CACHE_HOME")
+    if not base:
+        base = os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "chaps", "probe")
+
+
+def file_stamp(filename):
+    """Returns what identifies a given version of FILENAME: its absolute
+    path, size, modification time and inode."""
+    st = os.stat(filename)
+    return [os.path.abspath(filename), st.st_size, st.st_mtime_ns, st.st_ino]
+
+
+def memo_key(filename):
+    """Returns the key of FILENAME in the memos of a process, which
+    changes along with the file, so that a long running process notices
+    the modified files."""
+    try:
+        return tuple(file_stamp(filename))
+    except OSError:
+        return (os.path.abspath(filename),)
+
+
+class Memo:
+    """In-memory memo of the probes of a process, keyed on memo_key().
+
+    Only the MAX_ENTRIES most recently used entries are kept, so that a
+    long running process does not grow with every file it sees."""
+
+    def __init__(self, max_entries=MEMO_ENTRIES):
+        self._max_entries = max_entries
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._entries.pop(key)
+            except KeyError:
+                return default
+            self._entries[key] = value
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = value
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class ProbeCache:
+    """On-disk cache of probe results.
+
+    Entries are JSON files keyed by the stamp of the probed file, so a
+    modified or replaced file is probed again. Reading an entry refreshes
+    its modification time, entries are evicted least recently used first
+    once there are more than MAX_ENTRIES of them, unless read with TOUCH
+    false, and entries older than MAX_AGE seconds are dropped."""
+
+    def __init__(
+        self, directory=None, max_entries=MAX_ENTRIES, max_age=MAX_AGE
+    ):
+        self._directory = directory or get_cache_dir()
+        self._max_entries = max_entries
+        self._max_age = max_age
+        self._evicted = False
+
+    def get_directory(self):
+        return self._directory
+
+    def _entry_path(self, stamp, namespace):
+        key = json.dumps([CACHE_VERSION, namespace] + stamp)
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        return os.path.join(self._directory, digest + ".json")
+
+    def get(self, filename, namespace="probe", touch=True):
+        try:
+            stamp = file_stamp(filename)
+        except OSError:
+            return None
+        path = self._entry_path(stamp, namespace)
+        try:
+            with open(path) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if entry.get("stamp") != stamp:
+            return None
+        if touch:
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+        vvprint("[chaps] Probe cache hit for {}".format(filename))
+        return entry["data"]
+
+    def set(self, filename, data, namespace="probe"):
+        try:
+            stamp = file_stamp(filename)
+            os.makedirs(self._directory, exist_ok=True)
+        except OSError:
+            return
+        path = self._entry_path(stamp, namespace)
+        tmp = "{}.{}.tmp".format(path, os.getpid())
+        try:
+            with open(tmp, "w") as f:
+                json.dump({"stamp": stamp, "data": data}, f)
+            os.replace(tmp, path)
+        except OSError:
+            return
+        if not self._evicted:
+            self.evict()
+
+    def evict(self, max_entries=None):
+        if max_entries is None:
+            max_entries = self._max_entries
+        self._evicted = True
+        try:
+            names = os.listdir(self._directory)
+        except OSError:
+            return
+        entries = []
+        now = time.time()
+        for name in names:
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self._directory, name)
+            try:
+                mtime = os.stat(path).st_mtime
+            except OSError:
+                continue
+            if now - mtime > self._max_age:
+                self._remove(path)
+            else:
+                entries += [(mtime, path)]
+        entries.sort(reverse=True)
+        for _, path in entries[max_entries:]:
+            self._remove(path)
+
+    def _remove(self, path):
+        vvvprint("[chaps] Evicting probe cache entry {}".format(path))
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def clear(self):
+        self.evict(max_entries=0)
@@ -0,0 +1,160 @@
+"""Chapters module
+
+Keeps the chapters of a file in a ChapterTable, a few arrays rather than
+one ffprobe dictionary per chapter, so that files with tens of thousands
+of chapters stay cheap to hold, to format and to hand over to the pool
+workers, which get each table once and then only chapter indexes."""
+import math
+import sys
+from array import array
+from fractions import Fraction
+
+from .util import msec_to_hour
+
+# End of a chapter running up to the end of a stream of unknown length
+NO_END = -1
+
+
+def _msec(value, time_base):
+    """Returns VALUE, in TIME_BASE units, in milliseconds."""
+    if time_base is None or time_base == "1/1000":
+        return int(value)
+    return int(round(Fraction(time_base) * int(value) * 1000))
+
+
+class Chapter:
+    """Chapter INDEX of TABLE, read with the keys of an ffprobe chapter.
+
+    It is pickled as a chapter of a table of its own, so that a chapter
+    sent on its own does not carry its whole table along."""
+
+    __slots__ = ("table", "index")
+
+    def __init__(self, table, index):
+        self.table = table
+        self.index = index
+
+    def __getitem__(self, key):
+        table, index = self.table, self.index
+        if key == "id":
+            return table.ids[index]
+        if key == "start":
+            return table.starts[index]
+        if key == "start_time":
+            return table.start_times[index]
+        if key == "tags":
+            return {"title": table.titles[index]}
+        if key == "end":
+            end = table.ends[index]
+            return None if end == NO_END else end
+        if key == "end_time":
+            end = table.ends[index]
+            return None if end == NO_END else table.end_times[index]
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    @property
+    def title(self):
+        return self.table.titles[self.index]
+
+    @property
+    def start_hour(self):
+        return self.table.start_hours()[self.index]
+
+    @property
+    def end_hour(self):
+        return self.table.end_hours()[self.index]
+
+    def to_dict(self):
+        return {
+            "id": self["id"],
+            "start": self["start"],
+            "start_time": self["start_time"],
+            "end": self["end"],
+            "end_time": self["end_time"],
+            "tags": self["tags"],
+        }
+
+    def __reduce__(self):
+        return _chapter, (self.to_dict(),)
+
+
+class ChapterTable:
+    """Chapters, in the ffprobe structure, of a file.
+
+    The ids, the start and end in milliseconds and the start and end times
+    in seconds are kept in arrays, and the titles are interned. Indexing
+    the table gives Chapter views of its rows."""
+
+    def __init__(self, chapters=()):
+        self.ids = array("q")
+        self.starts = array("q")
+        self.ends = array("q")
+        self.start_times = array("d")
+        self.end_times = array("d")
+        self.titles = []
+        self._hours = None
+        for chap in chapters:
+            self.append(chap)
+
+    def append(self, chap):
+        time_base = chap.get("time_base")
+        self.ids.append(chap["id"])
+        self.starts.append(_msec(chap["start"], time_base))
+        self.start_times.append(float(chap["start_time"]))
+        if chap["end"] is None:
+            self.ends.append(NO_END)
+            self.end_times.append(math.nan)
+        else:
+            self.ends.append(_msec(chap["end"], time_base))
+            self.end_times.append(float(chap["end_time"]))
+        self.titles.append(sys.intern(chap["tags"]["title"]))
+        self._hours = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, index):
+        if not -len(self) <= index < len(self):
+            raise IndexError("chapter index out of range")
+        return Chapter(self, index % len(self))
+
+    def __iter__(self):
+        return (Chapter(self, index) for index in range(len(self)))
+
+    def _format_hours(self):
+        # Formatted once for every chapter, on first use
+        if self._hours is None:
+            self._hours = (
+                [msec_to_hour(start) for start in self.starts],
+                [
+                    None if end == NO_END else msec_to_hour(end)
+                    for end in self.ends
+                ],
+            )
+        return self._hours
+
+    def start_hours(self):
+        """Returns the msec_to_hour() of the start of every chapter."""
+        return self._format_hours()[0]
+
+    def end_hours(self):
+        """Returns the msec_to_hour() of the end of every chapter, None for
+        the chapters without an end."""
+        return self._format_hours()[1]
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state["_hours"] = None
+        return state
+
+
+def _chapter(chap):
+    """Returns the Chapter of the ffprobe chapter CHAP, alone in its
+    table."""
+    return ChapterTable([chap])[0]
@@ -0,0 +1,95 @@
+"""Command module
+
+Runs a chaps command line, once parsed: probes the given files, then
+prints their chapters, prints the plan of their split or splits them."""
+import json
+import sys
+
+from .verbosity import err
+
+from . import ffmpeg, trace
+
+from .api import SplitOptions, plan, split
+
+from .batch import expand_inputs, probe_files, BatchException
+
+from .util import read_chapters_txt, FFmpegException, STDIN
+
+from .template import TemplateException
+
+from .plan import PlanException, check_space
+
+
+def process(args, out=None):
+    """Splits or prints the chapters of the files of ARGS, printing on OUT,
+    the standard output by default. Exits on errors."""
+    try:
+        files = expand_inputs(args.files)
+    except BatchException as e:
+        err(str(e))
+        sys.exit(1)
+    if args.chapter_file and len(files) != 1:
+        err("--chapter-file can only be used with a single input file")
+        sys.exit(1)
+    if args.smartrender and args.codeccopy:
+        err("--smart-render and --copy cannot be used together")
+        sys.exit(1)
+    if args.archive and args.resume:
+        err("--archive and --resume cannot be used together")
+        sys.exit(1)
+    if STDIN in files:
+        error = None
+        if not args.chapter_file:
+            error = "reading the standard input requires --chapter-file"
+        elif args.smartrender or args.resume:
+            error = "--smart-render and --resume can not read stdin"
+        if error:
+            err(error)
+            sys.exit(1)
+        infos = [ffmpeg.get_stdin_infos()]
+    else:
+        chapters_only = args.printchapters and not args.chapter_file
+        with trace.span("probe", files=len(files)):
+            infos = probe_files(
+                files, args.njobs, chapters_only=chapters_only
+            )
+    try:
+        with trace.span("split"):
+            run(args, files, infos, out)
+    except (FFmpegException, TemplateException, PlanException) as e:
+        err(str(e))
+        sys.exit(1)
+
+
+def run(args, files, infos, out=None):
+    options = SplitOptions.from_args(args)
+    if args.chapter_file:
+        duration = infos[0]["format"].get("duration")
+        if duration is not None:
+            duration = float(duration)
+
+        with open(args.chapter_file) as f:
+            chapters = read_chapters_txt(f, duration)
+        split_or_plan(args, files, options, chapters, infos, out)
+        return
+    if args.printchapters:
+        for i, (filename, jinfos) in enumerate(zip(files, infos)):
+            if len(files) > 1:
+                if i:
+                    print(file=out)
+                print("==> {} <==".format(filename), file=out)
+            ffmpeg.print_chapters(filename, jinfos, out)
+        return
+    split_or_plan(args, files, options, None, infos, out)
+
+
+def split_or_plan(args, files, options, chapters, infos, out=None):
+    """Splits FILES, or prints the plan of the split with --dry-run."""
+    if not args.dryrun:
+        split(files, options, chapters=chapters, infos=infos)
+        return
+    plan_ = plan(files, options, chapters=chapters, infos=infos)
+    json.dump(plan_, out or sys.stdout, indent=2)
+    print(file=out)
+    if args.spacecheck:
+        check_space(plan_["disk"])
@@ -0,0 +1,309 @@
+"""Daemon module
+
+"chaps --serve" keeps a process running which splits the files
+submitted by "chaps --submit" clients over a Unix socket. The interpreter, the
+probes of the files and the probe cache stay warm from one request to
+the next, and the ffmpeg processes of every client share a single limit
+of --jobs slots, given to the clients of highest priority first.
+
+A request is a line of JSON giving the options of a chaps run, already
+parsed by the client, which answers with a line of JSON giving the exit
+status of the run, what it printed and the messages it logged at the
+verbosity it asked for. These messages are not written by the daemon."""
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import socket
+import socketserver
+import sys
+import tempfile
+
+from multiprocessing import cpu_count
+
+from .verbosity import (
+    vprint,
+    err,
+    logger,
+    ch,
+    set_level,
+    VERBOSE_LEVEL,
+    VVERBOSE_LEVEL,
+    VVVERBOSE_LEVEL,
+)
+
+from .options import parse_args, get_args, set_thread_args
+
+from .command import process
+
+from .scheduler import SlotLimiter, available_cores
+
+from .util import STDIN
+
+from . import ffmpeg
+
+# Options which would act on the whole daemon
+UNSUPPORTED_OPTIONS = {"trace": "--trace", "profile": "--profile"}
+
+# Logging level of the -v count of a request
+_LEVELS = {1: VERBOSE_LEVEL, 2: VVERBOSE_LEVEL, 3: VVVERBOSE_LEVEL}
+
+
+def get_socket_path():
+    """Returns the default socket path, private to the user."""
+    directory = os.environ.get("XDG_RUNTIME_DIR") or tempfile.gettempdir()
+    return os.path.join(directory, "chaps-{}.sock".format(os.getuid()))
+
+
+def _request_log():
+    """Returns the (level, messages) log of the request the current thread
+    works for, or None."""
+    # Kept in the options, which the threads of a request are given
+    return getattr(get_args(), "request_log", None)
+
+
+class _RequestLogHandler(logging.Handler):
+    """Hands the messages logged while a request is processed over to its
+    client, according to the verbosity of the request."""
+
+    def emit(self, record):
+        log = _request_log()
+        if log is not None and record.levelno >= log[0]:
+            log[1].append(self.format(record))
+
+
+def _outside_requests(record):
+    # The messages of the requests only go to their clients
+    return _request_log() is None
+
+
+@contextlib.contextmanager
+def request_logging(level=logging.WARNING):
+    """Sends what the requests log to their clients while in the context,
+    the daemon itself only writing its own messages of at least LEVEL."""
+    handler = _RequestLogHandler()
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    previous_level = logger.level
+    # The handlers filter the messages by the level of their reader
+    set_level(min(_LEVELS.values()))
+    ch.setLevel(level)
+    ch.addFilter(_outside_requests)
+    logger.addHandler(handler)
+    try:
+        yield
+    finally:
+        logger.removeHandler(handler)
+        ch.removeFilter(_outside_requests)
+        ch.setLevel(logging.NOTSET)
+        set_level(previous_level)
+
+
+def _absolute(path, cwd):
+    return path if path == STDIN else os.path.join(cwd, path)
+
+
+def prepare_request(args, cwd, priority=0):
+    """Returns the request sending ARGS, parsed in the directory CWD, to
+    the daemon. Paths are made absolute and the outputs are written to
+    CWD, as the daemon runs elsewhere."""
+    options = dict(vars(args))
+    options["files"] = [_absolute(path, cwd) for path in args.files]
+    for name in ("chapter_file", "archive", "report"):
+        if options[name] and options[name] != STDIN:
+            options[name] = _absolute(options[name], cwd)
+    options["outdir"] = cwd
+    options["priority"] = priority
+    return {"options": options}
+
+
+def check_options(args):
+    """Returns why the daemon can not run ARGS, or None."""
+    if STDIN in args.files:
+        return "the daemon can not read the standard input of a client"
+    if args.archive == STDIN:
+        return "the daemon can not write to the standard output of a client"
+    for name, option in UNSUPPORTED_OPTIONS.items():
+        if getattr(args, name):
+            return "{} can not be used with the daemon".format(option)
+    return None
+
+
+def run_request(request, slots):
+    """Runs REQUEST in the current thread and returns the response.
+
+    The --jobs of a request are threads of the daemon, each of its ffmpeg
+    commands waiting for one of the SLOTS shared by every request."""
+    args = argparse.Namespace(**request["options"])
+    error = check_options(args)
+    if error:
+        return {"status": 1, "output": "", "log": [error]}
+    args.engine = "pool"
+    args.progress = False
+    if args.threads == "auto" and not args.codeccopy:
+        args.threads = max(1, available_cores() // slots)
+    out = io.StringIO()
+    messages = []
+    args.request_log = (_LEVELS.get(args.verbose, logging.WARNING), messages)
+    set_thread_args(args)
+    status = 0
+    try:
+        process(args, out)
+    except SystemExit as e:
+        status = e.code if isinstance(e.code, int) else 1
+    except Exception as e:
+        err("{}: {}".format(type(e).__name__, e))
+        status = 1
+    finally:
+        set_thread_args(None)
+    return {"status": status, "output": out.getvalue(), "log": messages}
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            return
+        try:
+            request = json.loads(line.decode("utf-8"))
+        except ValueError:
+            response = {"status": 1, "output": "", "log": ["bad request"]}
+        else:
+            files = request.get("options", {}).get("files", [])
+            vprint("[chaps] Request for {}".format(", ".join(files)))
+            response = run_request(request, self.server.slots)
+        self.wfile.write((json.dumps(response) + "\n").encode("utf-8"))
+
+
+class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, slots):
+        self.slots = slots
+        socketserver.UnixStreamServer.__init__(self, path, _RequestHandler)
+
+
+def _in_use(path):
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(path)
+    except OSError:
+        return False
+    finally:
+        client.close()
+    return True
+
+
+def parse_serve_args(argv):
+    parser = argparse.ArgumentParser(
+        prog="chaps --serve",
+        description="Split the files submitted by chaps --submit.",
+    )
+    parser.add_argument(
+        "--socket",
+        default=get_socket_path(),
+        metavar="PATH",
+        help="Unix socket to listen on. [Default: %(default)s]",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=cpu_count(),
+        dest="njobs",
+        metavar="JOBS",
+        help="""Number of ffmpeg processes running at a time, all clients
+        included. [Default: the number of cores]""",
+    )
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        action="store_true",
+        default=False,
+        help="Log the requests.",
+    )
+    return parser.parse_args(argv)
+
+
+def serve(argv):
+    """Runs the daemon until it is interrupted and returns its exit
+    status."""
+    args = parse_serve_args(argv)
+    if os.path.exists(args.socket):
+        if _in_use(args.socket):
+            err("a daemon already listens on {}".format(args.socket))
+            return 1
+        os.remove(args.socket)
+    ffmpeg.set_command_limiter(SlotLimiter(max(1, args.njobs)))
+    umask = os.umask(0o077)
+    try:
+        server = Server(args.socket, max(1, args.njobs))
+    finally:
+        os.umask(umask)
+    level = VERBOSE_LEVEL if args.verbose else logging.WARNING
+    try:
+        with request_logging(level):
+            vprint("[chaps] Listening on {}".format(args.socket))
+            server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(args.socket)
+        ffmpeg.set_command_limiter(None)
+    return 0
+
+
+def parse_submit_args(argv):
+    parser = argparse.ArgumentParser(
+        prog="chaps --submit",
+        description="""Have the chaps daemon run a command. Every other
+        argument is given to chaps, see chaps --help.""",
+        allow_abbrev=False,
+    )
+    parser.add_argument(
+        "--socket",
+        default=get_socket_path(),
+        metavar="PATH",
+        help="Unix socket of the daemon. [Default: %(default)s]",
+    )
+    parser.add_argument(
+        "--priority",
+        type=int,
+        default=0,
+        help="""Priority of the ffmpeg processes of the command, the ones
+        of highest priority being started first. [Default: 0]""",
+    )
+    return parser.parse_known_args(argv)
+
+
+def submit(argv):
+    """Sends the chaps command line ARGV to the daemon, relays what it
+    printed and returns its exit status."""
+    args, chaps_argv = parse_submit_args(argv)
+    # Parsed here, so that bad arguments are reported by the client
+    chaps_args = parse_args(chaps_argv)
+    error = check_options(chaps_args)
+    if error:
+        err(error)
+        return 1
+    request = prepare_request(chaps_args, os.getcwd(), args.priority)
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(args.socket)
+    except OSError as e:
+        err("can not reach the daemon on {}: {}".format(args.socket, e))
+        return 1
+    with client, client.makefile("rwb") as f:
+        f.write((json.dumps(request) + "\n").encode("utf-8"))
+        f.flush()
+        line = f.readline()
+    if not line:
+        err("the daemon closed the connection")
+        return 1
+    response = json.loads(line.decode("utf-8"))
+    for message in response["log"]:
+        print(message, file=sys.stderr)
+    sys.stdout.write(response["output"])
+    return response["status"]
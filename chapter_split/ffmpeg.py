@@ -7,25 +7,188 @@ import sys
 import math
 import os
 import multiprocessing as mp
+import collections
+import contextlib
+import copy
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from queue import Empty
 
-from .verbosity import vprint, vvprint, vvvprint, err
+from .verbosity import (
+    vprint,
+    vvprint,
+    vvvprint,
+    err,
+    warn,
+    get_level,
+    set_level as verbosity_set_level,
+)
 
 
 from .util import (
-    sanitize_filename,
-    gen_filename,
-    msec_to_hour,
-    sec_to_hour,
     shell_quote,
     parse_duration,
+    parse_progress_line,
+    FFmpegException,
+    STDIN,
+    sec_to_hour,
+)
+
+from .status import Status, Progress, Piecewise_Progress, Text, Renderer
+
+from .cache import ProbeCache, Memo, memo_key
+
+from .chapters import ChapterTable
+
+from .template import compile_template, find_collisions, TemplateException
+
+from .plan import (
+    OUTPUT_CODECS,
+    estimate_size,
+    estimate_cpu,
+    disk_needs,
+    filesystems,
+    check_space,
+)
+
+from .keyframes import align_chapters, get_keyframes
+
+from .smartrender import (
+    CONCAT_INPUT_OPTS,
+    plan_segments,
+    video_stream,
+    encode_options,
+    segment_options,
+    join_options,
+    segment_name,
+    concat_list_name,
+    write_concat_list,
 )
 
-from .status import Status, Progress, Piecewise_Progress, Text
+from .scheduler import (
+    schedule_jobs,
+    chapter_duration,
+    estimate_cost,
+    makespan,
+    makespan_bound,
+    available_cores,
+    thread_budget,
+    with_threads,
+)
+
+from .native import get_slicer, NativeException
 
-from .options import get_args
+from .readers import read_chapters
+
+from .journal import partial_name, command_hash, get_journal, clear_journals
+
+from .archive import Archive, STDOUT
+
+from .report import (
+    Report,
+    ProgressStats,
+    wait_rusage,
+    process_stats,
+    self_usage,
+    self_stats,
+    merge_stats,
+)
+
+from . import trace
+
+from .options import get_args, set_args, bind_args
+
+from . import aio
+
+
+_INFOS = Memo()
+_PROBE_CACHE = None
+_COMMAND_LIMITER = None
+
+
+def set_command_limiter(limiter):
+    """Makes every ffmpeg command wait for a slot of LIMITER, a
+    SlotLimiter, with the priority of its options."""
+    global _COMMAND_LIMITER
+    _COMMAND_LIMITER = limiter
+
+
+@contextlib.contextmanager
+def command_slot():
+    if _COMMAND_LIMITER is None:
+        yield
+        return
+    with _COMMAND_LIMITER.slot(getattr(get_args(), "priority", 0)):
+        yield
+
+
+def get_probe_cache():
+    global _PROBE_CACHE
+    if _PROBE_CACHE is None:
+        _PROBE_CACHE = ProbeCache()
+    return _PROBE_CACHE
 
 
 def get_infos(filename):
+    """Returns ffprobe's chapters, format and streams infos of FILENAME.
+
+    The infos of the files probed last are kept in memory, each version of
+    a file being probed once meanwhile, and unless --no-probe-cache is
+    given, the result is stored in the persistent probe cache. A dry run
+    only reads the cache, leaving it as it is."""
+    key = memo_key(filename)
+    infos = _INFOS.get(key)
+    if infos is not None:
+        return infos
+    args = get_args()
+    cache = get_probe_cache() if getattr(args, "probecache", True) else None
+    dryrun = getattr(args, "dryrun", False)
+    infos = cache.get(filename, touch=not dryrun) if cache else None
+    if infos is not None and "streams" not in infos:
+        # Cached before the streams were probed
+        infos = None
+    if infos is None:
+        with trace.span("ffprobe", cat="probe", file=filename):
+            infos = probe_file(filename)
+        if cache and not dryrun:
+            cache.set(filename, infos)
+    _INFOS.set(key, infos)
+    return infos
+
+
+def get_chapter_infos(filename):
+    """Returns infos of FILENAME giving at least its chapters. They are
+    read from the file itself when a native reader supports it, unless
+    --no-native is given, ffprobe being used otherwise."""
+    key = memo_key(filename)
+    if key not in _INFOS and getattr(get_args(), "nativeslice", True):
+        with trace.span("read chapters", cat="probe", file=filename):
+            chapters = read_chapters(filename)
+        if chapters is not None:
+            vprint("[chaps] Read chapters natively...")
+            return {"chapters": chapters}
+    return get_infos(filename)
+
+
+# Extensions of the outputs by ffmpeg format, when they differ
+FORMAT_EXTENSIONS = {"matroska": "mkv", "mpegts": "ts"}
+
+
+def get_stdin_infos():
+    """Returns the infos of the standard input, which can not be probed
+    without consuming it. It has no chapters, metadata nor duration, and
+    the format given by --input-format."""
+    fmt = get_args().inputformat or "matroska"
+    ext = FORMAT_EXTENSIONS.get(fmt, fmt)
+    return {
+        "chapters": [],
+        "format": {"filename": "stdin.{}".format(ext), "tags": {}},
+    }
+
+
+def probe_file(filename):
     vprint("[chaps] Getting infos from file...")
     vprint("[ffprobe] Getting json infos...")
     command = [
@@ -36,6 +199,7 @@ def get_infos(filename):
         "json",
         "-show_chapters",
         "-show_format",
+        "-show_streams",
         "-loglevel",
         "error",
     ]
@@ -85,48 +249,124 @@ def get_format_from_json(jinfos):
     return fmt
 
 
+def build_ffmpeg_command(input_path, outputs, input_opts=None, inputs=()):
+    """Build an ffmpeg command reading INPUT_PATH once and writing every
+    output of OUTPUTS, a list of (opts, out_path) pairs. INPUT_OPTS are
+    given to ffmpeg before the input. INPUTS are the (input_opts, path)
+    pairs of the other inputs, if any."""
+    cmd = ["ffmpeg", "-y"]
+    if input_opts:
+        cmd += input_opts
+    cmd += ["-i", input_path]
+    for opts, path in inputs:
+        cmd += opts + ["-i", path]
+    cmd += ["-loglevel", "repeat+info", "-progress", "/dev/stdout"]
+    for opts, out_path in outputs:
+        cmd += opts
+        cmd += [out_path]
+    return cmd
+
+
 def run_ffmpeg(
-    input_path, out_path, opts, duration=None, status=None,
+    input_path,
+    out_path,
+    opts,
+    duration=None,
+    on_progress=None,
+    input_opts=None,
 ):
-    args = get_args()
-    cmd = ["ffmpeg", "-y", "-i", input_path]
-    cmd += opts
-    cmd += ["-loglevel", "repeat+info", "-progress", "/dev/stdout"]
-    cmd += [out_path]
+    cmd = build_ffmpeg_command(
+        input_path, [(opts, out_path)], input_opts=input_opts
+    )
+    run_ffmpeg_command(cmd, duration=duration, on_progress=on_progress)
+
+
+def _drain(stream, lines):
+    for line in stream:
+        lines.append(line)
 
+
+def run_ffmpeg_command(cmd, duration=None, on_progress=None, stdin=sp.DEVNULL):
+    """Runs the ffmpeg command CMD, calling ON_PROGRESS with the fraction
+    of DURATION already processed each time ffmpeg reports it. STDIN is
+    given to ffmpeg, None passing the standard input on. Returns the
+    statistics of the process."""
     vvprint("[debug] ffmpeg command line: {}".format(shell_quote(cmd)))
 
-    if not args.dryrun:
-        p = sp.Popen(
-            cmd,
-            stdout=sp.PIPE,
-            stderr=sp.PIPE,
-            stdin=sp.PIPE,
-            universal_newlines=True,
-        )
-        if status and args.njobs == 1 and not args.codeccopy:
-            while True:
-                try:
-                    stdout, stderr = p.communicate(timeout=1)
-                    status.current_progress.set_value(1)
-                    sys.stdout.write("{}\r".format(status))
-                    break
-                except sp.TimeoutExpired:
-                    while True:
-                        p.stdout.flush()
-                        li = p.stdout.readline().strip()
-                        if "out_time=" in li[:9]:
-                            current_duration = parse_duration(li.split("=")[1])
-                            percentage = current_duration / duration
-                            status.current_progress.set_value(percentage)
-                            sys.stdout.write("{}\r".format(status))
-                            break
+    with command_slot():
+        return _run_ffmpeg_command(cmd, duration, on_progress, stdin)
+
+
+def _run_ffmpeg_command(cmd, duration, on_progress, stdin):
+    command_trace = trace.CommandTrace(cmd[-1])
+    start = time.perf_counter()
+    # Leaving the block closes the pipes, and waits for ffmpeg if the
+    # progress could not be read to the end
+    with sp.Popen(
+        cmd,
+        stdout=sp.PIPE,
+        stderr=sp.PIPE,
+        stdin=stdin,
+        universal_newlines=True,
+    ) as p:
+        command_trace.spawned()
+        # ffmpeg's log goes to stderr, it is drained by a thread so that
+        # ffmpeg never blocks on it while progress is read from stdout.
+        stderr = collections.deque(maxlen=16)
+        drain = threading.Thread(target=_drain, args=(p.stderr, stderr))
+        drain.daemon = True
+        drain.start()
+        progress = ProgressStats()
+        for line in p.stdout:
+            key, value = parse_progress_line(line)
+            progress.feed(key, value)
+            if key == "out_time":
+                command_trace.progress()
+            if key == "out_time" and on_progress and duration:
+                current = parse_duration(value)
+                if current is not None:
+                    on_progress(current / duration)
+        command_trace.closed()
+        drain.join()
+        rusage = wait_rusage(p)
+        command_trace.exited()
+    if p.returncode != 0:
+        message = stderr[-1].strip() if stderr else "ffmpeg failed"
+        raise FFmpegException(cmd, p.returncode, message)
+    if on_progress:
+        on_progress(1)
+    return process_stats(start, progress, rusage, duration)
+
+
+_RENDERER = None
+
+
+def get_renderer():
+    global _RENDERER
+    if _RENDERER is None:
+        # The standard output may be taken by the archive
+        if get_args().archive == STDOUT:
+            _RENDERER = Renderer(stream=sys.stderr)
         else:
-            stdout, stderr = p.communicate()
-        if p.returncode != 0:
-            stderr = stderr.decode("utf-8", "replace")
-            err(stderr.strip().split("\n")[-1])
-            sys.exit(1)
+            _RENDERER = Renderer()
+    return _RENDERER
+
+
+def close_renderer():
+    """Closes the renderer of the split, restoring the SIGWINCH handler it
+    replaced. The next split gets a new one."""
+    global _RENDERER
+    if _RENDERER is not None:
+        _RENDERER.close()
+        _RENDERER = None
+
+
+def render(status, final=False):
+    """Draws STATUS, FINAL being given for its last state."""
+    if final:
+        get_renderer().finish(status)
+    else:
+        get_renderer().update(status)
 
 
 def make_status_bar(chapters):
@@ -141,7 +381,7 @@ def make_status_bar(chapters):
         )
         p2 = Progress(name="chapters_progress")
         p3 = Text(name="chapters_percent")
-        s = Status(separator=" ", dynamic_width=True)
+        s = Status(width=get_renderer().get_width(), separator=" ")
         if not args.codeccopy:
             p3.set_fmt("({value:3d}%): Progress", value=0)
             p4 = Progress(name="current_progress")
@@ -163,135 +403,961 @@ def make_multi_status_bar(chapters):
             "Chapter {{chap:{0}d}}/{1}".format(len(str(nb_chaps)), nb_chaps),
             chap=0,
         )
-        p2 = Piecewise_Progress(name="chapters_progress", nb_pieces=nb_chaps)
+        weights = [
+            float(chap["end_time"]) - float(chap["start_time"])
+            for chap in chapters
+        ]
+        p2 = Piecewise_Progress(
+            name="chapters_progress", nb_pieces=nb_chaps, weights=weights
+        )
         p3 = Text(name="chapters_percent")
-        s = Status(separator=" ", dynamic_width=True)
+        s = Status(width=get_renderer().get_width(), separator=" ")
         p3.set_fmt("({value:3d}%)", value=0)
         s = s + p1 + p2 + p3
     return s
 
 
+class MultiProgress:
+    """Tracks the progress of concurrent chapter extractions on a status
+    bar made by make_multi_status_bar()."""
+
+    def __init__(self, status):
+        self._status = status
+        self._started = 0
+
+    def start(self, index):
+        if self._status:
+            self._started += 1
+            self._status.chapters.chap = self._started
+            self._render()
+
+    def progress(self, index, fraction):
+        if self._status:
+            self._status.chapters_progress.set_value(index, fraction)
+            self._render()
+
+    def done(self, index):
+        if self._status:
+            self._status.chapters_progress.set_value(index, True)
+            self._render()
+
+    def finish(self):
+        if self._status:
+            self._status.chapters_percent.value = 100
+            render(self._status, final=True)
+
+    def _render(self):
+        progress = self._status.chapters_progress.get_progress()
+        self._status.chapters_percent.value = math.floor(progress * 100)
+        render(self._status)
+
+
+def chapter_outfile(chap, metadata, fmt):
+    args = get_args()
+    template = compile_template(args.outtmpl)
+    outfile = template.format(chap, metadata, fmt, args.restrictfilenames)
+    outdir = getattr(args, "outdir", None)
+    return os.path.join(outdir, outfile) if outdir else outfile
+
+
+def seek_options(chap, mode="auto", codeccopy=False):
+    """Return the (input_opts, output_opts) pair selecting CHAP.
+
+    With the "output" mode, the seek is given after the input and ffmpeg
+    decodes and discards everything before the chapter start. The "input"
+    and "accurate" modes seek in the input before decoding, so the cost of
+    a chapter only depends on its length. "input" starts at the closest
+    keyframe whereas "accurate" decodes from it up to the exact position,
+    which is only possible when re-encoding. "auto" picks "accurate" when
+    re-encoding and "output" with --copy."""
+    if mode == "auto":
+        mode = "output" if codeccopy else "accurate"
+    if mode == "output":
+        return [], ["-ss", chap.start_hour, "-to", chap.end_hour]
+    if mode == "accurate":
+        input_opts = ["-accurate_seek"]
+    else:
+        input_opts = ["-noaccurate_seek"]
+    input_opts += ["-ss", chap.start_hour]
+    duration = (chap["end"] - chap["start"]) / 1000
+    return input_opts, ["-t", "{:.3f}".format(duration)]
+
+
+def chapter_command(chap, metadata, fmt, filename):
+    """Returns the ffmpeg command extracting CHAP from FILENAME along with
+    the chapter duration."""
+    args = get_args()
+    outfile = chapter_outfile(chap, metadata, fmt)
+    duration = float(chap["end_time"]) - float(chap["start_time"])
+    input_opts, opts = seek_options(chap, args.seek, args.codeccopy)
+    if args.codeccopy:
+        opts += ["-codec", "copy"]
+    cmd = build_ffmpeg_command(
+        filename, [(opts, partial_name(outfile))], input_opts
+    )
+    return cmd, duration
+
+
+@functools.lru_cache(maxsize=None)
+def warn_unmatched_stream(filename):
+    """Warns, once per file, that FILENAME can not be smart rendered."""
+    warn(
+        "the video stream of {} can not be re-encoded with the same "
+        "parameters, its chapters are re-encoded whole".format(filename)
+    )
+
+
+def smart_render_commands(chap, metadata, fmt, filename):
+    """Returns the (cmd, duration) ffmpeg commands smart rendering CHAP
+    from FILENAME, the last one joining the video segments written by the
+    others with the other streams of the chapter, along with the temporary
+    files they write."""
+    outfile = chapter_outfile(chap, metadata, fmt)
+    start = float(chap["start_time"])
+    end = float(chap["end_time"])
+    segments = plan_segments(start, end, get_keyframes(filename))
+    if len(segments) == 1 and not segments[0][0]:
+        # No whole GOP to copy, this is a plain re-encode
+        return [chapter_command(chap, metadata, fmt, filename)], []
+    stream = video_stream(get_infos(filename))
+    if stream is None:
+        return [chapter_command(chap, metadata, fmt, filename)], []
+    ext = os.path.splitext(outfile)[1].lower()
+    if encode_options(stream, ext) is None:
+        warn_unmatched_stream(filename)
+        return [chapter_command(chap, metadata, fmt, filename)], []
+    commands = []
+    names = []
+    for index, segment in enumerate(segments):
+        name = segment_name(outfile, index)
+        input_opts, opts = segment_options(segment, stream, ext)
+        cmd = build_ffmpeg_command(filename, [(opts, name)], input_opts)
+        commands += [(cmd, segment[2] - segment[1])]
+        names += [name]
+    concat = concat_list_name(outfile)
+    input_opts, opts = join_options(start, end)
+    cmd = build_ffmpeg_command(
+        concat,
+        [(opts, partial_name(outfile))],
+        CONCAT_INPUT_OPTS,
+        [(input_opts, filename)],
+    )
+    commands += [(cmd, None)]
+    return commands, names + [concat]
+
+
+def job_commands(job):
+    """Returns the (cmd, duration) ffmpeg commands of the extraction JOB,
+    to be run in order, along with the temporary files they write."""
+    if get_args().smartrender:
+        return smart_render_commands(*job)
+    return [chapter_command(*job)], []
+
+
+def job_hash(job):
+    """Returns the hash of the options the extraction JOB is made with."""
+    commands, _ = job_commands(job)
+    cmd = [arg for c, _ in commands[:-1] for arg in c] + commands[-1][0]
+    if is_native_job(job):
+        cmd = ["native"] + cmd
+    return command_hash(cmd, job[3])
+
+
+def is_native_job(job):
+    """Tells whether the extraction JOB can be done without ffmpeg."""
+    args = get_args()
+    if not args.codeccopy or not args.nativeslice:
+        return False
+    return get_slicer(job[2], job_outfile(job)) is not None
+
+
+def _job_progress(on_progress, done, duration, total, fraction):
+    # FRACTION of a command of DURATION, started once DONE seconds of the
+    # TOTAL of its job were processed
+    on_progress((done + fraction * duration) / total)
+
+
+def run_job_commands(commands, threads=None, on_progress=None):
+    """Runs the (cmd, duration) COMMANDS of a job in order, ON_PROGRESS
+    being called with the fraction of their total duration processed.
+    Returns the statistics of the whole job."""
+    total = sum(duration or 0 for _, duration in commands)
+    done = 0
+    stats = []
+    for cmd, duration in commands:
+        if threads:
+            cmd = with_threads(cmd, threads)
+        progress = None
+        if on_progress and total:
+            progress = functools.partial(
+                _job_progress, on_progress, done, duration or 0, total
+            )
+        stats += [
+            (
+                run_ffmpeg_command(
+                    cmd, duration=duration, on_progress=progress
+                ),
+                duration,
+            )
+        ]
+        done += duration or 0
+    if on_progress:
+        on_progress(1)
+    return merge_stats(stats)
+
+
+def job_outfile(job):
+    chap, metadata, fmt, _ = job
+    return chapter_outfile(chap, metadata, fmt)
+
+
+def finish_job(job, archive=None):
+    """Moves the output of the extraction JOB, which succeeded, in place
+    and journals it with --resume. With an ARCHIVE, the output is added to
+    it under its final name instead."""
+    args = get_args()
+    outfile = job_outfile(job)
+    if archive is not None:
+        archive.add(partial_name(outfile), outfile)
+        return
+    os.replace(partial_name(outfile), outfile)
+    if args.resume:
+        chap = job[0]
+        duration = float(chap["end_time"]) - float(chap["start_time"])
+        get_journal(outfile).record(outfile, duration, job_hash(job))
+
+
+def check_outputs(jobs):
+    """Raises a TemplateException if several jobs of JOBS would write the
+    same output, before any of them is run."""
+    collisions = find_collisions([job_outfile(job) for job in jobs])
+    if not collisions:
+        return
+    outfile, indexes = next(iter(collisions.items()))
+    chapters = [
+        '"{}" of {}'.format(jobs[i][0]["tags"]["title"], jobs[i][3])
+        for i in indexes
+    ]
+    more = ""
+    if len(collisions) > 1:
+        more = " (and {} other outputs)".format(len(collisions) - 1)
+    raise TemplateException(
+        "the output template gives {} to {}{}, which would overwrite each "
+        "other".format(outfile, ", ".join(chapters), more)
+    )
+
+
+def discard_job(job):
+    """Removes the partial output of the extraction JOB, if any."""
+    try:
+        os.remove(partial_name(job_outfile(job)))
+    except OSError:
+        pass
+
+
+def pending_jobs(jobs):
+    """Returns the jobs of JOBS whose output is not already valid
+    according to the journal of its directory."""
+    pending = []
+    for job in jobs:
+        outfile = job_outfile(job)
+        if get_journal(outfile).is_done(outfile, job_hash(job)):
+            vprint("[chaps] Skipping {}, already extracted".format(outfile))
+        else:
+            pending += [job]
+    return pending
+
+
+def job_threads(running, waiting):
+    """Returns the number of threads of a chapter job starting while
+    RUNNING jobs (itself included) are running and WAITING ones are still
+    to be started, or None to keep ffmpeg's default."""
+    args = get_args()
+    if args.codeccopy:
+        return None
+    if args.threads != "auto":
+        return args.threads
+    if args.njobs == 1:
+        return None
+    return thread_budget(available_cores(), args.njobs, running, waiting)
+
+
+def _render_progress(status, fraction):
+    status.current_progress.set_value(fraction)
+    render(status)
+
+
+def _queue_progress(index, fraction):
+    progress_queue.put(("progress", index, fraction))
+
+
 def extract_chapter(chap, metadata, fmt, filename, cur=0, tot=0, status=None):
     args = get_args()
-    sanitize = lambda v: sanitize_filename(v, args.restrictfilenames)
 
     vprint(
         '\033[K[chaps] Extracting chapter "{}"...'.format(
             chap["tags"]["title"]
         )
     )
+    on_progress = None
     if args.progress and args.njobs == 1:
         status.chapters.chap = cur
         status.chapters_progress.set_value((cur - 1) / tot)
         status.chapters_percent.value = math.ceil((cur - 1) / tot * 100)
-        sys.stdout.write("{}\r".format(status))
+        render(status)
+        if not args.codeccopy:
+            on_progress = functools.partial(_render_progress, status)
     elif args.progress:
-        with lock:
-            status = shared_status.get()
-            status.chapters.chap += 1
-            sys.stdout.write("{}\r".format(status))
-            shared_status.set(status)
-
-    outfile = gen_filename(args.outtmpl, chap, metadata, fmt)
-    outfile = sanitize(outfile)
-    start = msec_to_hour(int(chap["start"]))
-    end = msec_to_hour(int(chap["end"]))
-    duration = float(chap["end_time"]) - float(chap["start_time"])
-    command = [
-        "-ss",
-        start,
-        "-to",
-        end,
-    ]
-    if args.codeccopy:
-        command += ["-codec", "copy"]
-    run_ffmpeg(
-        filename, outfile, command, duration=duration, status=status,
-    )
+        progress_queue.put(("start", cur - 1))
+        on_progress = functools.partial(_queue_progress, cur - 1)
+
+    commands, temporaries = job_commands((chap, metadata, fmt, filename))
+    if args.njobs == 1:
+        threads = job_threads(1, 0)
+    else:
+        lock_start = trace.now()
+        with job_counters.get_lock():
+            trace.complete("counters lock", lock_start, cat="lock")
+            job_counters[0] += 1
+            running = job_counters[0] - job_counters[1]
+            waiting = tot - job_counters[0]
+        threads = job_threads(running, waiting)
+    try:
+        if temporaries:
+            write_concat_list(temporaries[-1], temporaries[:-1])
+        with trace.span("chapter", cat="job", title=chap["tags"]["title"]):
+            stats = run_job_commands(commands, threads, on_progress)
+    finally:
+        for name in temporaries:
+            try:
+                os.remove(name)
+            except OSError:
+                pass
+        if args.njobs != 1:
+            lock_start = trace.now()
+            with job_counters.get_lock():
+                trace.complete("counters lock", lock_start, cat="lock")
+                job_counters[1] += 1
     if args.progress and args.njobs != 1:
-        with lock:
-            status = shared_status.get()
-            status.chapters_progress.set_value((cur - 1), True)
-            nb = len([v for v in status.chapters_progress.get_value() if v])
-            status.chapters_percent.value = math.ceil(nb / tot * 100)
-            sys.stdout.write("{}\r".format(status))
-            shared_status.set(status)
+        progress_queue.put(("done", cur - 1))
+    return cur - 1, stats
 
 
-def init_child(lock_, shared_status_):
-    global lock
-    lock = lock_
-    global shared_status
-    shared_status = shared_status_
+def source_job(source, row):
+    """Returns the job of the chapter ROW of the source SOURCE, handed to
+    the worker by init_child()."""
+    table, metadata, fmt, filename = job_sources[source]
+    return table[row], metadata, fmt, filename
 
 
-def split_file_on_chapters(filename, jinfos, chapters=None):
-    if chapters is None:
-        chapters = get_chapter_from_json(jinfos)
-    metadata = get_metadatas_from_json(jinfos)
-    fmt = get_format_from_json(jinfos)
+def extract_chapter_args(vargs):
+    """Extracts the chapter ROW of the source SOURCE, VARGS being (source,
+    row, cur, tot)."""
+    source, row, cur, tot = vargs
+    return extract_chapter(*source_job(source, row), cur=cur, tot=tot)
+
+
+def single_pass_command(jobs):
+    """Returns the ffmpeg command extracting every chapter of JOBS, which
+    all read the same file, along with what it reads as its standard
+    input."""
+    args = get_args()
+    outputs = []
+    for job in jobs:
+        chap = job[0]
+        opts = ["-ss", chap.start_hour]
+        if chap["end"] is not None:
+            opts += ["-to", chap.end_hour]
+        if args.codeccopy:
+            opts += ["-codec", "copy"]
+        outputs += [(opts, partial_name(job_outfile(job)))]
+    filename = jobs[0][3]
+    input_opts = []
+    stdin = sp.DEVNULL
+    if filename == STDIN:
+        stdin = None
+        if args.inputformat:
+            input_opts = ["-f", args.inputformat]
+    return build_ffmpeg_command(filename, outputs, input_opts), stdin
+
+
+def split_file_single_pass(jobs, on_done=None):
+    """Extracts the chapters of JOBS, which all read the same file, with a
+    single ffmpeg process.
+
+    The input is opened and demuxed once, each chapter being written to
+    its own output with its own -ss/-to output options. This is how the
+    standard input is split, the chapter without an end running up to the
+    end of the stream."""
     args = get_args()
-    nb_chaps = len(args.onlychapters) if args.onlychapters else len(chapters)
+    nb_chaps = len(jobs)
+    status = make_status_bar([job[0] for job in jobs])
+    vprint(
+        "[chaps] Extracting {} chapters in a single pass...".format(nb_chaps)
+    )
+    if not jobs:
+        return
+    cmd, stdin = single_pass_command(jobs)
+    # Every chapter is made by the same process, they share its statistics
+    stats = run_ffmpeg_command(cmd, stdin=stdin)
+    if on_done:
+        for index in range(nb_chaps):
+            on_done(index, stats)
+    if args.progress:
+        status.chapters.chap = nb_chaps
+        status.chapters_progress.set_value(1)
+        status.chapters_percent.value = 100
+        render(status, final=True)
+
+
+def split_jobs_native(jobs, on_done=None):
+    """Slices the chapters of JOBS, which can all be sliced natively,
+    without ffmpeg. Each input is mapped once for all its chapters. The
+    jobs of an input its slicer can not handle are left to ffmpeg."""
+    args = get_args()
+    nb_chaps = len(jobs)
+    status = make_status_bar([job[0] for job in jobs])
+    vprint("[chaps] Slicing {} chapters natively...".format(nb_chaps))
+    slicer = None
+    unsupported = set()
+    try:
+        for index, job in enumerate(jobs):
+            chap, metadata, fmt, filename = job
+            if filename in unsupported:
+                continue
+            outfile = job_outfile(job)
+            if slicer is None or slicer.filename != filename:
+                if slicer is not None:
+                    slicer.close()
+                    slicer = None
+                try:
+                    slicer = get_slicer(fmt, outfile)(filename)
+                except NativeException as e:
+                    vprint(
+                        "[chaps] Can not slice {} natively ({}), using "
+                        "ffmpeg".format(filename, e)
+                    )
+                    unsupported.add(filename)
+                    continue
+            vprint(
+                '\033[K[chaps] Extracting chapter "{}"...'.format(
+                    chap["tags"]["title"]
+                )
+            )
+            if args.progress:
+                status.chapters.chap = index + 1
+                status.chapters_progress.set_value(index / nb_chaps)
+                status.chapters_percent.value = math.ceil(
+                    index / nb_chaps * 100
+                )
+                render(status)
+            start = float(chap["start_time"])
+            end = float(chap["end_time"])
+            vvprint(
+                "[debug] native slice: {} [{:.3f}, {:.3f}] > {}".format(
+                    filename, start, end, outfile
+                )
+            )
+            tags = {
+                "title": chap["tags"]["title"],
+                "track": str(chap["id"] + 1),
+            }
+            usage = self_usage()
+            start_time = time.perf_counter()
+            with trace.span("native slice", cat="job", output=outfile):
+                slicer.write(partial_name(outfile), start, end, tags)
+            stats = self_stats(start_time, usage, end - start)
+            if on_done:
+                on_done(index, stats)
+    finally:
+        if slicer is not None:
+            slicer.close()
+    if args.progress:
+        status.chapters_progress.set_value(1)
+        status.chapters_percent.value = 100
+        render(status, final=True)
+
 
-    oc = args.onlychapters
-    working_chapters = [
+def init_child(
+    progress_queue_, job_counters_, job_sources_, args, level, trace_path
+):
+    """Initializes a pool worker. The options, verbosity and trace are
+    given explicitly as spawned workers do not inherit them. The sources of
+    the jobs, from get_job_sources(), are handed over once for all the
+    jobs."""
+    global progress_queue
+    progress_queue = progress_queue_
+    # Numbers of started and finished jobs
+    global job_counters
+    job_counters = job_counters_
+    global job_sources
+    job_sources = job_sources_
+    set_args(args)
+    verbosity_set_level(level)
+    if trace_path and not trace.is_tracing():
+        trace.attach_trace(trace_path)
+
+
+def select_chapters(chapters):
+    oc = get_args().onlychapters
+    return [
         chap
         for chap in chapters
         if (oc and ((chap["id"] + 1) in oc)) or oc is None
     ]
 
+
+def make_jobs(filename, jinfos, chapters=None):
+    """Returns the (chap, metadata, fmt, filename) extraction jobs of the
+    selected chapters of FILENAME."""
+    if chapters is None:
+        chapters = get_chapter_from_json(jinfos)
+    metadata = get_metadatas_from_json(jinfos)
+    fmt = get_format_from_json(jinfos)
+    chapters = select_chapters(chapters)
+    args = get_args()
+    if args.codeccopy and args.keyframes != "off" and filename != STDIN:
+        try:
+            duration = float(fmt["duration"])
+        except (KeyError, TypeError, ValueError):
+            duration = None
+        chapters = align_chapters(filename, chapters, args.keyframes, duration)
+    table = ChapterTable(chapters)
+    return [(chap, metadata, fmt, filename) for chap in table]
+
+
+def get_job_sources(jobs):
+    """Returns the (table, metadata, fmt, filename) sources of JOBS, made
+    by make_jobs(), along with the (source, row) of each job in them."""
+    sources = []
+    refs = []
+    known = {}
+    for chap, metadata, fmt, filename in jobs:
+        key = id(chap.table)
+        if key not in known:
+            known[key] = len(sources)
+            sources += [(chap.table, metadata, fmt, filename)]
+        refs += [(known[key], chap.index)]
+    return sources, refs
+
+
+def schedule(jobs):
+    """Returns the indexes of JOBS in the order they should be started."""
+    args = get_args()
+    order = schedule_jobs(jobs, args.schedule)
+    costs = [estimate_cost(job[0], job[2]) for job in jobs]
+    bound = makespan_bound(costs, args.njobs)
+    if bound:
+        vvprint(
+            "[chaps] Scheduled {} jobs, estimated run time is {:.0f}% of "
+            "the ideal one".format(
+                len(jobs),
+                100 * makespan([costs[i] for i in order], args.njobs) / bound,
+            )
+        )
+    return order
+
+
+def split_jobs(jobs, on_done=None):
+    """Runs every extraction job of JOBS, possibly coming from several
+    files, on a single pool of --jobs workers. ON_DONE is called with the
+    index of each job and its statistics once it succeeded."""
+    args = get_args()
+    nb_chaps = len(jobs)
+
+    if args.njobs > 1 and _COMMAND_LIMITER is not None:
+        return split_jobs_threads(jobs, on_done)
+
     if args.njobs == 1:
         # Setup progress bar
-        status = make_status_bar(working_chapters)
-        for i, chap in enumerate(working_chapters, start=1):
-            extract_chapter(
+        status = make_status_bar(jobs)
+        for i, (chap, metadata, fmt, filename) in enumerate(jobs, start=1):
+            _, stats = extract_chapter(
                 chap, metadata, fmt, filename, i, nb_chaps, status=status
             )
-    else:
+            if on_done:
+                on_done(i - 1, stats)
+        if args.progress:
+            status.chapters_progress.set_value(1)
+            status.chapters_percent.value = 100
+            render(status, final=True)
+        return
+
+    vprint(
+        "[chaps] Extracting {} chapters with {} jobs".format(
+            nb_chaps, args.njobs
+        )
+    )
+    # Setup progress bar, workers report their progress through a queue
+    # which is consumed here.
+    progress = MultiProgress(make_multi_status_bar([j[0] for j in jobs]))
+    context = mp.get_context(getattr(args, "startmethod", None))
+    queue = context.Queue() if args.progress else None
+    counters = context.Array("i", 2)
+    # The workers get the chapter tables once, then chapter indexes
+    sources, refs = get_job_sources(jobs)
+    initargs = (
+        queue,
+        counters,
+        sources,
+        args,
+        get_level(),
+        trace.get_trace_path(),
+    )
+    with trace.span("pool startup", jobs=args.njobs):
+        pool = context.Pool(
+            args.njobs, initializer=init_child, initargs=initargs
+        )
+    with pool:
+        vargs = [
+            (source, row, i, nb_chaps)
+            for i, (source, row) in enumerate(refs, start=1)
+        ]
+        # Jobs are handed one by one to the workers, in the scheduled order
+        with trace.span("schedule"):
+            order = schedule(jobs)
+        vargs = [vargs[i] for i in order]
+        results = pool.imap_unordered(
+            extract_chapter_args, vargs, chunksize=1
+        )
+        while True:
+            while queue is not None:
+                try:
+                    message = queue.get_nowait()
+                except Empty:
+                    break
+                getattr(progress, message[0])(*message[1:])
+            try:
+                index, stats = results.next(timeout=0.1)
+            except mp.TimeoutError:
+                continue
+            except StopIteration:
+                break
+            if on_done:
+                on_done(index, stats)
+    progress.finish()
+
+
+def split_jobs_threads(jobs, on_done=None):
+    """Runs every extraction job of JOBS on --jobs threads, each one
+    extracting its chapters one at a time, so that their ffmpeg commands
+    wait for the slots of the command limiter. ON_DONE is called in this
+    thread with the index of each job and its statistics once it
+    succeeded."""
+    args = get_args()
+    nb_chaps = len(jobs)
+    vprint(
+        "[chaps] Extracting {} chapters with {} threads".format(
+            nb_chaps, args.njobs
+        )
+    )
+    thread_args = copy.copy(args)
+    thread_args.njobs = 1
+
+    def extract(index):
+        chap, metadata, fmt, filename = jobs[index]
+        _, stats = extract_chapter(
+            chap, metadata, fmt, filename, index + 1, nb_chaps
+        )
+        return index, stats
+
+    extract = bind_args(extract, thread_args)
+    with ThreadPoolExecutor(max_workers=args.njobs) as executor:
+        futures = [executor.submit(extract, i) for i in schedule(jobs)]
+        try:
+            for future in as_completed(futures):
+                index, stats = future.result()
+                if on_done:
+                    on_done(index, stats)
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+
+
+def split_jobs_async(jobs, on_done=None):
+    """Runs every extraction job of JOBS as ffmpeg children of an asyncio
+    event loop, at most --jobs at a time. ON_DONE is called with the index
+    of each job and its statistics once it succeeded."""
+    args = get_args()
+    nb_chaps = len(jobs)
+    vprint(
+        "[chaps] Extracting {} chapters with {} asyncio jobs".format(
+            nb_chaps, args.njobs
+        )
+    )
+    progress = MultiProgress(make_multi_status_bar([j[0] for j in jobs]))
+    commands = [
+        chapter_command(chap, metadata, fmt, filename)
+        for chap, metadata, fmt, filename in jobs
+    ]
+
+    def on_start(index):
         vprint(
-            "[chaps] Extracting {} chapters with {} jobs".format(
-                nb_chaps, args.njobs
+            '\033[K[chaps] Extracting chapter "{}"...'.format(
+                jobs[index][0]["tags"]["title"]
             )
         )
-        # Setup progress bar
-        status = make_multi_status_bar(working_chapters)
-        lock = mp.Lock()
-        manager = mp.Manager()
-        shared_status = manager.Value(Status, status)
-        with mp.Pool(
-            args.njobs, initializer=init_child, initargs=(lock, shared_status,)
-        ) as pool:
-            vargs = [
-                (chap, metadata, fmt, filename, i, nb_chaps)
-                for i, chap in enumerate(working_chapters, start=1)
-            ]
-            pool.starmap(extract_chapter, vargs)
+        progress.start(index)
 
-    if args.progress:
-        if args.njobs == 1:
-            status.chapters_progress.set_value(1)
-        else:
-            status = shared_status.get()
-        status.chapters_percent.value = 100
-        sys.stdout.write("{}\n".format(status))
+    def done(index, stats=None):
+        progress.done(index)
+        if on_done:
+            on_done(index, stats)
+
+    def prepare(index, cmd, running, waiting):
+        threads = job_threads(running, waiting)
+        return with_threads(cmd, threads) if threads else cmd
+
+    aio.run(
+        aio.split(
+            commands,
+            args.njobs,
+            on_start=on_start,
+            on_progress=progress.progress,
+            on_done=done,
+            order=schedule(jobs),
+            prepare=prepare,
+        )
+    )
+    progress.finish()
 
 
-def print_chapters(filename, jinfos):
-    chapters = get_chapter_from_json(jinfos)
+def split_file_on_chapters(filename, jinfos, chapters=None):
+    split_files([(filename, jinfos)], chapters=chapters)
+
+
+def make_split_jobs(files, chapters=None):
+    """Returns the extraction jobs of every (filename, jinfos) pair of
+    FILES, but the ones --resume skips. CHAPTERS, when given, overrides
+    the chapters of the files."""
+    args = get_args()
+    jobs = []
+    with trace.span("make jobs"):
+        for filename, jinfos in files:
+            jobs += make_jobs(filename, jinfos, chapters=chapters)
+        check_outputs(jobs)
+        if args.resume:
+            jobs = pending_jobs(jobs)
+    return jobs
+
+
+def ffmpeg_groups(files, jobs, indexes):
+    """Returns the (split, indexes, engine) groups the jobs of INDEXES in
+    JOBS are run by ffmpeg in, in order, SPLIT being the split_* function
+    running them."""
+    args = get_args()
+    groups = []
+    stdin = [i for i in indexes if jobs[i][3] == STDIN]
+    if stdin:
+        groups += [(split_file_single_pass, stdin, "single-pass")]
+        indexes = [i for i in indexes if i not in stdin]
+    if args.codeccopy and args.singlepass:
+        for filename, _ in files:
+            file_indexes = [i for i in indexes if jobs[i][3] == filename]
+            if file_indexes:
+                groups += [
+                    (split_file_single_pass, file_indexes, "single-pass")
+                ]
+    elif args.engine == "async" and args.smartrender:
+        warn("--smart-render is not supported by the async engine")
+        groups += [(split_jobs, indexes, "ffmpeg")]
+    elif args.engine == "async":
+        groups += [(split_jobs_async, indexes, "ffmpeg")]
+    else:
+        groups += [(split_jobs, indexes, "ffmpeg")]
+    return groups
+
+
+def disk_space(jobs):
+    """Returns the filesystems the outputs of JOBS are written to, along
+    with the space they need and have, see plan.filesystems()."""
+    args = get_args()
+    needs = disk_needs(
+        [job_outfile(job) for job in jobs],
+        [estimate_size(job[0], job[2]) for job in jobs],
+        args.njobs,
+        args.archive,
+        args.smartrender,
+    )
+    return filesystems(needs)
+
+
+def job_cpu(job, stream):
+    """Returns the estimated CPU time, in seconds, of the extraction JOB
+    from a file of video STREAM, see plan.estimate_cpu()."""
+    args = get_args()
+    chap, _, _, filename = job
+    if chap.get("end_time") is None:
+        return None
+    duration = chapter_duration(chap)
+    ext = os.path.splitext(job_outfile(job))[1].lower()
+    codec = OUTPUT_CODECS.get(ext, (stream or {}).get("codec_name"))
+    if args.codeccopy:
+        return estimate_cpu(duration, 0, codec, stream)
+    if (
+        not args.smartrender
+        or filename == STDIN
+        or stream is None
+        or encode_options(stream, ext) is None
+    ):
+        return estimate_cpu(duration, duration, codec, stream)
+    # Smart rendering only re-encodes the partial GOPs, to the codec of
+    # the input
+    start = float(chap["start_time"])
+    end = float(chap["end_time"])
+    segments = plan_segments(start, end, get_keyframes(filename))
+    encoded = sum(seg[2] - seg[1] for seg in segments if not seg[0])
+    return estimate_cpu(duration, encoded, stream.get("codec_name"), stream)
+
+
+def plan_files(files, chapters=None):
+    """Returns the plan of the split of FILES by split_files(), without
+    running anything: the chapters, with the estimated size of their
+    output and the CPU time extracting them takes, the ffmpeg commands
+    extracting them and the disk space they need."""
     args = get_args()
-    first = True
-    for chap in chapters:
-        if args.onlychapters and (chap["id"] + 1) not in args.onlychapters:
+    infos = dict(files)
+    jobs = make_split_jobs(files, chapters)
+    entries = []
+    for job in jobs:
+        chap, _, fmt, filename = job
+        end = chap.get("end_time")
+        duration = chapter_duration(chap) if end is not None else None
+        entries += [
+            {
+                "file": filename,
+                "chapter": chap["id"] + 1,
+                "title": chap["tags"]["title"],
+                "output": job_outfile(job),
+                "engine": None,
+                "duration": duration,
+                "size": estimate_size(chap, fmt),
+                "cpu_seconds": job_cpu(job, video_stream(infos[filename])),
+            }
+        ]
+    costs = [entry["cpu_seconds"] or 0 for entry in entries]
+    commands = []
+    # The native slices, then every group of ffmpeg jobs, run one after
+    # the other
+    native = [i for i, job in enumerate(jobs) if is_native_job(job)]
+    for index in native:
+        entries[index]["engine"] = "native"
+    order = list(native)
+    span = sum(costs[i] for i in native)
+    rest = [i for i in range(len(jobs)) if i not in native]
+    for split, indexes, engine in ffmpeg_groups(files, jobs, rest):
+        for index in indexes:
+            entries[index]["engine"] = engine
+        if split is split_file_single_pass:
+            cmd, _ = single_pass_command([jobs[i] for i in indexes])
+            commands += [{"chapters": indexes, "command": cmd}]
+            order += indexes
+            span += sum(costs[i] for i in indexes)
             continue
-        if not first:
-            print()
-        else:
-            first = False
-        title = chap["tags"]["title"]
+        for index in indexes:
+            for cmd, _ in job_commands(jobs[index])[0]:
+                commands += [{"chapters": [index], "command": cmd}]
+        scheduled = [indexes[i] for i in schedule([jobs[i] for i in indexes])]
+        order += scheduled
+        span += makespan([costs[i] for i in scheduled], args.njobs)
+    known = [entry["size"] for entry in entries if entry["size"] is not None]
+    forget_run()
+    return {
+        "jobs": args.njobs,
+        "chapters": entries,
+        "commands": commands,
+        "order": order,
+        "size": sum(known),
+        "unknown_sizes": len(entries) - len(known),
+        "cpu_seconds": sum(costs),
+        "makespan_seconds": span,
+        "disk": disk_space(jobs),
+    }
+
+
+def forget_run():
+    """Forgets what only holds for a run, once it is over: the journals,
+    whose files may change before the next run, and the files already
+    warned about."""
+    clear_journals()
+    warn_unmatched_stream.cache_clear()
+
+
+def split_files(files, chapters=None):
+    """Splits every (filename, jinfos) pair of FILES. CHAPTERS, when given,
+    overrides the chapters of the files. Returns the outputs written, in
+    the order of the chapters, or to be written with --dry-run, which
+    runs nothing. Raises a PlanException, before running anything, if the
+    outputs would not fit on disk."""
+    args = get_args()
+    jobs = make_split_jobs(files, chapters)
+    if args.dryrun:
+        forget_run()
+        return [job_outfile(job) for job in jobs]
+    if args.spacecheck:
+        check_space(disk_space(jobs))
+    finished = set()
+    archive = None
+    if args.archive:
+        archive = Archive(args.archive, args.archiveformat)
+    report = None
+    if args.report:
+        report = Report(args.report)
+
+    def on_done(index, stats, engine):
+        job = jobs[index]
+        outfile = job_outfile(job)
+        if report is not None:
+            size = os.path.getsize(partial_name(outfile))
+            report.add(job, outfile, engine, stats, size)
+        with trace.span("finish", output=outfile):
+            finish_job(job, archive)
+        finished.add(index)
+
+    def run(split, indexes, engine="ffmpeg"):
+        with trace.span(split.__name__, chapters=len(indexes)):
+            split(
+                [jobs[i] for i in indexes],
+                on_done=lambda index, stats=None: on_done(
+                    indexes[index], stats, engine
+                ),
+            )
+
+    try:
+        native = [i for i, job in enumerate(jobs) if is_native_job(job)]
+        if native:
+            run(split_jobs_native, native, "native")
+        rest = [i for i in range(len(jobs)) if i not in finished]
+        for split, indexes, engine in ffmpeg_groups(files, jobs, rest):
+            run(split, indexes, engine)
+    except BaseException:
+        for index, job in enumerate(jobs):
+            if index not in finished:
+                discard_job(job)
+        raise
+    finally:
+        close_renderer()
+        forget_run()
+        if archive is not None:
+            archive.close()
+        if report is not None:
+            report.write()
+    return [job_outfile(jobs[i]) for i in sorted(finished)]
+
+
+def print_chapters(filename, jinfos, out=None):
+    """Prints the selected chapters of FILENAME on OUT, the standard output
+    by default."""
+    table = ChapterTable(select_chapters(get_chapter_from_json(jinfos)))
+    starts = [sec_to_hour(start / 1000) for start in table.starts]
+    ends = [sec_to_hour(end / 1000) for end in table.ends]
+    for chap, start, end in zip(table, starts, ends):
+        if chap.index:
+            print(file=out)
+        title = chap.title
         id = chap["id"]
-        index = chap["id"] + 1
-        start = sec_to_hour(int(chap["start"]) / 1000)
-        end = sec_to_hour(int(chap["end"]) / 1000)
-        print("Title: {}".format(title))
-        print("id: {}, index: {}".format(id, index))
-        print("[{} - {}]".format(start, end))
+        index = id + 1
+        print("Title: {}".format(title), file=out)
+        print("id: {}, index: {}".format(id, index), file=out)
+        print("[{} - {}]".format(start, end), file=out)
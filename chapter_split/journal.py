@@ -0,0 +1,106 @@
+"""Journal module
+
+Keeps track of the chapters already extracted in a directory, so that an
+interrupted split can be resumed."""
+import hashlib
+import json
+import os
+
+from .verbosity import vvprint, warn
+
+from .cache import file_stamp
+
+JOURNAL_NAME = ".chaps-journal"
+
+
+def partial_name(outfile):
+    """Returns the temporary name OUTFILE is written to before being
+    renamed. The extension is kept so that ffmpeg guesses the same output
+    format."""
+    head, tail = os.path.split(outfile)
+    stem, ext = os.path.splitext(tail)
+    return os.path.join(head, ".{}.part{}".format(stem, ext))
+
+
+def command_hash(cmd, filename):
+    """Returns a hash of the ffmpeg command CMD reading FILENAME, without
+    its output path, along with the stamp of FILENAME."""
+    try:
+        stamp = file_stamp(filename)
+    except OSError:
+        stamp = None
+    key = json.dumps([cmd[:-1], stamp])
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+class Journal:
+    """Journal of the outputs written to a directory.
+
+    Each line of the journal file is a JSON object giving the output path,
+    the expected duration, the size of the output and the hash of the
+    options it was made with. The last line of an output wins."""
+
+    def __init__(self, directory="."):
+        self._path = os.path.join(directory, JOURNAL_NAME)
+        self._entries = {}
+        self._load()
+
+    def get_path(self):
+        return self._path
+
+    def _load(self):
+        try:
+            f = open(self._path)
+        except FileNotFoundError:
+            return
+        with f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                    self._entries[entry["output"]] = entry
+                except (ValueError, KeyError, TypeError):
+                    # Probably a line truncated by an interruption
+                    warn("Ignoring invalid line in {}".format(self._path))
+
+    def is_done(self, outfile, options):
+        """Tells whether OUTFILE was completely written with OPTIONS."""
+        entry = self._entries.get(outfile)
+        if entry is None or entry.get("options") != options:
+            return False
+        try:
+            size = os.path.getsize(outfile)
+        except OSError:
+            return False
+        return size == entry.get("size")
+
+    def record(self, outfile, duration, options):
+        entry = {
+            "output": outfile,
+            "duration": duration,
+            "size": os.path.getsize(outfile),
+            "options": options,
+        }
+        self._entries[outfile] = entry
+        with open(self._path, "a") as f:
+            f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        vvprint("[chaps] Journaled {}".format(outfile))
+
+
+_JOURNALS = {}
+
+
+def get_journal(outfile):
+    """Returns the journal of the directory of OUTFILE."""
+    directory = os.path.dirname(outfile) or "."
+    key = os.path.abspath(directory)
+    if key not in _JOURNALS:
+        _JOURNALS[key] = Journal(directory)
+    return _JOURNALS[key]
+
+
+def clear_journals():
+    """Forgets the journals read so far, which are read again from their
+    files when needed."""
+    _JOURNALS.clear()
@@ -0,0 +1,206 @@
+"""Keyframes module
+
+Builds an index of the keyframes of a media file, used to align the
+chapter cuts of stream copies on keyframes."""
+import bisect
+import math
+import os
+import subprocess as sp
+
+from .verbosity import vprint, vvprint, warn
+
+from .util import sec_to_hour
+
+from .options import get_args
+
+from .cache import Memo, memo_key
+
+from . import trace
+
+_KEYFRAMES = Memo()
+
+
+def probe_keyframes(filename):
+    """Returns the sorted timestamps, in seconds, of the keyframes of the
+    first video stream of FILENAME. ffprobe's packet list is streamed so
+    that it is never held in memory."""
+    vprint("[ffprobe] Getting keyframes...")
+    command = [
+        "ffprobe",
+        "-i",
+        filename,
+        "-select_streams",
+        "v:0",
+        "-show_entries",
+        "packet=pts_time,flags",
+        "-print_format",
+        "csv=print_section=0",
+        "-loglevel",
+        "error",
+    ]
+    vvprint("Command is {}".format(" ".join(command)))
+    keyframes = []
+    with sp.Popen(
+        command, stdout=sp.PIPE, stdin=sp.DEVNULL, universal_newlines=True
+    ) as p:
+        for line in p.stdout:
+            pts_time, _, flags = line.strip().partition(",")
+            if "K" not in flags:
+                continue
+            try:
+                keyframes += [float(pts_time)]
+            except ValueError:
+                continue
+    if p.returncode != 0:
+        raise sp.CalledProcessError(p.returncode, command)
+    keyframes.sort()
+    vvprint("Found {:d} keyframes".format(len(keyframes)))
+    return keyframes
+
+
+def get_keyframes(filename):
+    """Returns the keyframe index of FILENAME, probing each version of it
+    at most once per process and caching it in the probe cache, but for
+    a dry run."""
+    from .ffmpeg import get_probe_cache
+
+    key = memo_key(filename)
+    keyframes = _KEYFRAMES.get(key)
+    if keyframes is not None:
+        return keyframes
+    args = get_args()
+    cache = get_probe_cache() if getattr(args, "probecache", True) else None
+    dryrun = getattr(args, "dryrun", False)
+    keyframes = None
+    if cache:
+        keyframes = cache.get(filename, "keyframes", touch=not dryrun)
+    if keyframes is None:
+        with trace.span("keyframes", cat="probe", file=filename):
+            keyframes = probe_keyframes(filename)
+        if cache and not dryrun:
+            cache.set(filename, keyframes, namespace="keyframes")
+    _KEYFRAMES.set(key, keyframes)
+    return keyframes
+
+
+def previous_keyframe(keyframes, time):
+    """Returns the last keyframe at or before TIME, or None."""
+    i = bisect.bisect_right(keyframes, time)
+    return keyframes[i - 1] if i else None
+
+
+def nearest_keyframe(keyframes, time):
+    i = bisect.bisect_left(keyframes, time)
+    candidates = keyframes[max(i - 1, 0) : i + 1]
+    return min(candidates, key=lambda k: abs(k - time))
+
+
+def _clamp_short(chapters, bounds, index):
+    """Returns the bounds of the chapter of INDEX in CHAPTERS, too short to
+    be snapped, clamped to the snapped BOUNDS of its neighbours. It keeps
+    sharing the boundaries it shared with them."""
+    chap = chapters[index]
+    start = float(chap["start_time"])
+    end = float(chap["end_time"])
+    if index > 0:
+        previous = float(chapters[index - 1]["end_time"])
+        snapped = bounds[index - 1][1]
+        start = snapped if previous == start else max(start, snapped)
+    if index + 1 < len(chapters):
+        following = float(chapters[index + 1]["start_time"])
+        snapped = bounds[index + 1][0]
+        end = snapped if following == end else min(end, snapped)
+    return start, end
+
+
+def snap_chapters(chapters, keyframes, duration=None):
+    """Returns a copy of CHAPTERS whose boundaries are moved to the nearest
+    keyframe. Adjacent chapters sharing a boundary still share it after
+    snapping, so they neither overlap nor leave a gap. The end of the file,
+    DURATION, is kept as is.
+
+    A chapter collapsing to nothing is left unsnapped, within the snapped
+    bounds of its neighbours, or merged into them when they leave it no
+    room, that is when it lies within a GOP along with its boundaries."""
+    if not keyframes:
+        return chapters
+
+    def snap(time):
+        if duration is not None and time >= duration:
+            return time
+        return nearest_keyframe(keyframes, time)
+
+    bounds = [
+        (snap(float(chap["start_time"])), snap(float(chap["end_time"])))
+        for chap in chapters
+    ]
+    snapped = []
+    for index, chap in enumerate(chapters):
+        start, end = bounds[index]
+        if end <= start:
+            start, end = _clamp_short(chapters, bounds, index)
+            title = chap["tags"]["title"]
+            if end <= start:
+                warn(
+                    'Chapter "{}" is shorter than a GOP, it is merged into '
+                    "its neighbours".format(title)
+                )
+                continue
+            warn(
+                'Chapter "{}" is shorter than a GOP, it is not snapped'.format(
+                    title
+                )
+            )
+            if (start, end) == (
+                float(chap["start_time"]),
+                float(chap["end_time"]),
+            ):
+                snapped += [chap]
+                continue
+        chap = dict(chap)
+        chap["start_time"] = "{:.6f}".format(start)
+        chap["end_time"] = "{:.6f}".format(end)
+        chap["start"] = int(round(start * 1000))
+        chap["end"] = int(round(end * 1000))
+        snapped += [chap]
+    return snapped
+
+
+def keyframe_offsets(chapters, keyframes):
+    """Returns, for each chapter of CHAPTERS, how many seconds after its
+    previous keyframe it starts, i.e. how much earlier a stream copy of it
+    actually starts."""
+    offsets = []
+    for chap in chapters:
+        start = float(chap["start_time"])
+        keyframe = previous_keyframe(keyframes, start)
+        offsets += [start - keyframe if keyframe is not None else 0]
+    return offsets
+
+
+def report_chapters(chapters, keyframes, tolerance=0.001):
+    for chap, offset in zip(chapters, keyframe_offsets(chapters, keyframes)):
+        if offset > tolerance:
+            warn(
+                'Chapter "{}" starts at {} which is {:.3f}s after a keyframe, '
+                "its copy will start earlier".format(
+                    chap["tags"]["title"],
+                    sec_to_hour(math.floor(float(chap["start_time"]))),
+                    offset,
+                )
+            )
+
+
+def align_chapters(filename, chapters, mode, duration=None):
+    """Snaps (MODE "snap") or reports (MODE "report") the cuts of CHAPTERS
+    against the keyframe index of FILENAME."""
+    if mode == "off":
+        return chapters
+    keyframes = get_keyframes(filename)
+    if not keyframes:
+        # No video stream, audio packets can be cut anywhere
+        return chapters
+    if mode == "report":
+        report_chapters(chapters, keyframes)
+        return chapters
+    return snap_chapters(chapters, keyframes, duration)
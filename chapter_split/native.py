@@ -0,0 +1,658 @@
+"""Native module
+
+Slices MP3, WAV and FLAC files without ffmpeg. The input is mapped in
+memory, the chapter boundaries are moved to the closest frame (or sample)
+boundary, and each chapter is written as a byte range copy of the input
+behind headers rewritten for it."""
+import abc
+import mmap
+import os
+import struct
+from array import array
+
+COPY_CHUNK = 1 << 20
+
+
+class NativeException(Exception):
+    pass
+
+
+def _crc_table(poly, width):
+    table = []
+    top = 1 << (width - 1)
+    mask = (1 << width) - 1
+    for byte in range(256):
+        crc = byte << (width - 8)
+        for _ in range(8):
+            crc = ((crc << 1) ^ poly) if crc & top else (crc << 1)
+        table += [crc & mask]
+    return table
+
+
+_CRC8 = _crc_table(0x07, 8)
+
+
+def crc8(data):
+    """CRC-8 of FLAC frame headers."""
+    crc = 0
+    for byte in data:
+        crc = _CRC8[crc ^ byte]
+    return crc
+
+
+def crc16(data):
+    """CRC-16 (reflected 0x8005) of the LAME tag."""
+    crc = 0
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+    return crc
+
+
+class Slicer(abc.ABC):
+    """Base class of the native slicers.
+
+    A slicer maps FILENAME in memory and parses it when created, raising
+    NativeException if it cannot slice it. write() then writes the part of
+    the input between two times to a file."""
+
+    extensions = ()
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._file = open(filename, "rb")
+        try:
+            self._map = mmap.mmap(
+                self._file.fileno(), 0, access=mmap.ACCESS_READ
+            )
+        except ValueError:
+            self._file.close()
+            raise NativeException("{} is empty".format(filename))
+        try:
+            self._parse()
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @abc.abstractmethod
+    def _parse(self):
+        """Parses the mapped input, raising NativeException if it can not
+        be sliced."""
+
+    @abc.abstractmethod
+    def _slice(self, start, end, tags):
+        """Returns the (header, first, last, trailer) of the output: the
+        chapter going from START to END is the FIRST to LAST byte range of
+        the input."""
+
+    def write(self, outfile, start, end, tags=None):
+        """Writes the part of the input going from START to END, in
+        seconds, to OUTFILE. TAGS may give its "title" and "track"."""
+        header, first, last, trailer = self._slice(start, end, tags or {})
+        with open(outfile, "wb") as f:
+            f.write(header)
+            for pos in range(first, last, COPY_CHUNK):
+                f.write(self._map[pos : min(pos + COPY_CHUNK, last)])
+            f.write(trailer)
+
+
+class WavSlicer(Slicer):
+    """Slicer of RIFF/WAVE files of PCM samples."""
+
+    extensions = (".wav",)
+
+    def _parse(self):
+        m = self._map
+        if m[0:4] != b"RIFF" or m[8:12] != b"WAVE":
+            raise NativeException("not a RIFF/WAVE file")
+        pos = 12
+        self._fmt = None
+        self._data = None
+        while pos + 8 <= len(m):
+            chunk_id = m[pos : pos + 4]
+            (size,) = struct.unpack_from("<I", m, pos + 4)
+            body = pos + 8
+            if chunk_id == b"fmt ":
+                self._fmt = m[body : body + size]
+            elif chunk_id == b"data":
+                self._data = (body, min(size, len(m) - body))
+                break
+            pos = body + size + (size & 1)
+        if self._fmt is None or self._data is None or len(self._fmt) < 16:
+            raise NativeException("no format or data chunk")
+        tag, _, self._rate, _, self._block_align = struct.unpack_from(
+            "<HHIIH", self._fmt
+        )
+        if tag not in (1, 3, 0xFFFE) or not self._rate:
+            raise NativeException("not a PCM WAVE file")
+        if not self._block_align:
+            raise NativeException("invalid block alignment")
+
+    def _slice(self, start, end, tags):
+        offset, size = self._data
+        align = self._block_align
+        nb_samples = size // align
+        first = min(nb_samples, max(0, int(round(start * self._rate))))
+        last = min(nb_samples, max(first, int(round(end * self._rate))))
+        length = (last - first) * align
+        header = b"fmt " + struct.pack("<I", len(self._fmt)) + self._fmt
+        if len(self._fmt) & 1:
+            header += b"\0"
+        if tags.get("title"):
+            header += _riff_info(tags)
+        header += b"data" + struct.pack("<I", length)
+        riff_size = 4 + len(header) + length + (length & 1)
+        header = b"RIFF" + struct.pack("<I", riff_size) + b"WAVE" + header
+        trailer = b"\0" if length & 1 else b""
+        return header, offset + first * align, offset + last * align, trailer
+
+
+def _riff_info(tags):
+    info = b"INFO"
+    for chunk_id, key in ((b"INAM", "title"), (b"IPRT", "track")):
+        if tags.get(key):
+            value = tags[key].encode("utf-8") + b"\0"
+            info += chunk_id + struct.pack("<I", len(value)) + value
+            if len(value) & 1:
+                info += b"\0"
+    return b"LIST" + struct.pack("<I", len(info)) + info
+
+
+# Bitrates in kbit/s by (MPEG 1, layer) and (MPEG 2 or 2.5, layer)
+_MP3_BITRATES = {
+    (True, 1): "0 32 64 96 128 160 192 224 256 288 320 352 384 416 448",
+    (True, 2): "0 32 48 56 64 80 96 112 128 160 192 224 256 320 384",
+    (True, 3): "0 32 40 48 56 64 80 96 112 128 160 192 224 256 320",
+    (False, 1): "0 32 48 56 64 80 96 112 128 144 160 176 192 224 256",
+    (False, 2): "0 8 16 24 32 40 48 56 64 80 96 112 128 144 160",
+    (False, 3): "0 8 16 24 32 40 48 56 64 80 96 112 128 144 160",
+}
+_MP3_BITRATES = {
+    key: [int(bitrate) for bitrate in bitrates.split()]
+    for key, bitrates in _MP3_BITRATES.items()
+}
+
+# Sample rates by version bits: MPEG 2.5, reserved, MPEG 2, MPEG 1
+_MP3_RATES = (
+    (11025, 12000, 8000),
+    None,
+    (22050, 24000, 16000),
+    (44100, 48000, 32000),
+)
+
+
+def mp3_frame_info(header):
+    """Returns the (length, samples, sample rate) of the MPEG audio frame
+    starting with the 32 bits HEADER, or None if it is not a valid one."""
+    if header >> 21 != 0x7FF:
+        return None
+    version = (header >> 19) & 3
+    layer = 4 - ((header >> 17) & 3)
+    bitrate_index = (header >> 12) & 15
+    rate_index = (header >> 10) & 3
+    padding = (header >> 9) & 1
+    if version == 1 or layer == 4 or bitrate_index in (0, 15):
+        # Reserved values, or free format which can not be indexed
+        return None
+    if rate_index == 3:
+        return None
+    mpeg1 = version == 3
+    bitrate = _MP3_BITRATES[(mpeg1, layer)][bitrate_index] * 1000
+    rate = _MP3_RATES[version][rate_index]
+    if layer == 1:
+        return (12 * bitrate // rate + padding) * 4, 384, rate
+    samples = 1152 if mpeg1 or layer == 2 else 576
+    return samples // 8 * bitrate // rate + padding, samples, rate
+
+
+def _syncsafe(value):
+    return bytes(
+        [
+            (value >> 21) & 127,
+            (value >> 14) & 127,
+            (value >> 7) & 127,
+            value & 127,
+        ]
+    )
+
+
+def _unsyncsafe(data):
+    return (data[0] << 21) | (data[1] << 14) | (data[2] << 7) | data[3]
+
+
+def id3_text_frame(frame_id, text, version=4):
+    """Returns an ID3v2.VERSION text frame."""
+    if version == 4:
+        data = b"\x03" + text.encode("utf-8")
+        size = _syncsafe(len(data))
+    else:
+        data = b"\x01" + text.encode("utf-16")
+        size = struct.pack(">I", len(data))
+    return frame_id + size + b"\0\0" + data
+
+
+# Frames which do not describe a single chapter
+_ID3_DROPPED = {b"CHAP", b"CTOC", b"TIT2", b"TRCK", b"TLEN"}
+
+
+class Mp3Slicer(Slicer):
+    """Slicer of MPEG audio files.
+
+    The ID3v2 tag of the input is kept, without its chapter frames, with
+    the title and track of the chapter. The Xing/Info frame of VBR files is
+    rewritten with the frame and byte counts of the chapter, and its LAME
+    extension with the matching encoder delay and padding."""
+
+    extensions = (".mp3", ".mp2", ".mpga")
+
+    def _parse(self):
+        m = self._map
+        pos = 0
+        self._id3_version = 4
+        self._id3_frames = []
+        if m[0:3] == b"ID3" and len(m) >= 10:
+            pos = 10 + _unsyncsafe(m[6:10])
+            if m[5] & 0x10:
+                pos += 10  # footer
+            self._parse_id3(m[3], m[5], m[10:pos])
+        self._xing = None
+        offsets = array("Q")
+        rate = None
+        infos = {}
+        size = len(m)
+        while pos + 4 <= size:
+            (header,) = struct.unpack_from(">I", m, pos)
+            key = header >> 9
+            info = infos.get(key)
+            if info is None:
+                info = infos[key] = mp3_frame_info(header)
+            if info is None or pos + info[0] > size:
+                next_pos = self._resync(pos + 1, infos)
+                if next_pos is None:
+                    break
+                pos = next_pos
+                continue
+            length, samples, frame_rate = info
+            if rate is None:
+                rate = frame_rate
+                self._samples = samples
+                if self._is_vbr_header(pos, header):
+                    pos += length
+                    continue
+            elif frame_rate != rate or samples != self._samples:
+                raise NativeException("the sample rate changes")
+            offsets.append(pos)
+            pos += length
+        if not offsets:
+            raise NativeException("no MPEG audio frame found")
+        self._rate = rate
+        self._offsets = offsets
+
+    def _parse_id3(self, version, flags, data):
+        if version not in (3, 4) or flags & 0xC0:
+            # Unsynchronised tags and extended headers are not kept
+            return
+        self._id3_version = version
+        pos = 0
+        while pos + 10 <= len(data) and data[pos] != 0:
+            if version == 4:
+                size = _unsyncsafe(data[pos + 4 : pos + 8])
+            else:
+                (size,) = struct.unpack_from(">I", data, pos + 4)
+            frame = data[pos : pos + 10 + size]
+            if frame[0:4] not in _ID3_DROPPED:
+                self._id3_frames += [frame]
+            pos += 10 + size
+
+    def _resync(self, pos, infos):
+        """Returns the position of the next frame followed by another one,
+        or None at the end of the audio data."""
+        m = self._map
+        while True:
+            pos = m.find(b"\xff", pos)
+            if pos < 0 or pos + 4 > len(m):
+                return None
+            (header,) = struct.unpack_from(">I", m, pos)
+            info = mp3_frame_info(header)
+            if info is not None:
+                following = pos + info[0]
+                if following == len(m):
+                    return pos
+                if following + 4 <= len(m):
+                    (header,) = struct.unpack_from(">I", m, following)
+                    if mp3_frame_info(header) is not None:
+                        return pos
+            pos += 1
+
+    def _is_vbr_header(self, pos, header):
+        """Tells whether the frame at POS is a Xing/Info or VBRI frame. The
+        former is kept to be rewritten, the latter is dropped."""
+        m = self._map
+        mpeg1 = (header >> 19) & 3 == 3
+        mono = (header >> 6) & 3 == 3
+        side = (17 if mono else 32) if mpeg1 else (9 if mono else 17)
+        tag = pos + 4 + side + (0 if header & 0x10000 else 2)
+        if m[tag : tag + 4] in (b"Xing", b"Info"):
+            length = mp3_frame_info(header)[0]
+            self._xing = (pos, length, tag - pos)
+            return True
+        return m[pos + 36 : pos + 40] == b"VBRI"
+
+    def _frame_end(self, index):
+        offset = self._offsets[index]
+        (header,) = struct.unpack_from(">I", self._map, offset)
+        return offset + mp3_frame_info(header)[0]
+
+    def _byte_range(self, first, last):
+        """Returns the byte range of the frames FIRST to LAST, excluded."""
+        if first == last:
+            offset = self._frame_end(first - 1) if first else 0
+            return offset, offset
+        return self._offsets[first], self._frame_end(last - 1)
+
+    def _slice(self, start, end, tags):
+        nb_frames = len(self._offsets)
+        first = int(round(start * self._rate / self._samples))
+        last = end * self._rate / self._samples
+        # A cut in the last frame is at the end of the file
+        last = nb_frames if last > nb_frames - 1 else int(round(last))
+        first = min(nb_frames, max(0, first))
+        last = min(nb_frames, max(first, last))
+        header = self._id3_tag(tags)
+        if self._xing is not None:
+            header += self._xing_frame(first, last)
+        return (header,) + self._byte_range(first, last) + (b"",)
+
+    def _id3_tag(self, tags):
+        frames = b"".join(self._id3_frames)
+        for frame_id, key in ((b"TIT2", "title"), (b"TRCK", "track")):
+            if tags.get(key):
+                version = self._id3_version
+                frames += id3_text_frame(frame_id, tags[key], version)
+        if not frames:
+            return b""
+        version = bytes([self._id3_version, 0])
+        return b"ID3" + version + b"\0" + _syncsafe(len(frames)) + frames
+
+    def _xing_frame(self, first, last):
+        start, length, tag = self._xing
+        frame = bytearray(self._map[start : start + length])
+        nb_frames = last - first
+        first_offset, last_offset = self._byte_range(first, last)
+        nb_bytes = length + last_offset - first_offset
+        (flags,) = struct.unpack_from(">I", frame, tag + 4)
+        pos = tag + 8
+        if flags & 1:
+            struct.pack_into(">I", frame, pos, nb_frames)
+            pos += 4
+        if flags & 2:
+            struct.pack_into(">I", frame, pos, nb_bytes)
+            pos += 4
+        if flags & 4:
+            for i in range(100):
+                index = first + nb_frames * i // 100
+                offset = self._offsets[index] if index < last else last_offset
+                offset += length - first_offset
+                frame[pos + i] = min(255, offset * 256 // nb_bytes)
+            pos += 100
+        if flags & 8:
+            pos += 4
+        if frame[pos : pos + 4] in (b"LAME", b"Lavf", b"Lavc"):
+            self._rewrite_lame(frame, pos, first, last, nb_bytes)
+        return bytes(frame)
+
+    def _rewrite_lame(self, frame, pos, first, last, nb_bytes):
+        if pos + 36 > len(frame):
+            return
+        delay_padding = int.from_bytes(frame[pos + 21 : pos + 24], "big")
+        delay, padding = delay_padding >> 12, delay_padding & 0xFFF
+        if first > 0:
+            delay = 0
+        if last < len(self._offsets):
+            padding = 0
+        frame[pos + 21 : pos + 24] = ((delay << 12) | padding).to_bytes(
+            3, "big"
+        )
+        struct.pack_into(">I", frame, pos + 28, nb_bytes)
+        struct.pack_into(">H", frame, pos + 34, crc16(frame[: pos + 34]))
+
+
+class FlacFrame:
+    __slots__ = ("offset", "sample", "size")
+
+    def __init__(self, offset, sample, size):
+        self.offset = offset
+        self.sample = sample
+        self.size = size
+
+
+# Metadata blocks kept in the output, besides STREAMINFO and VORBIS_COMMENT
+_FLAC_KEPT = {2, 6}  # APPLICATION, PICTURE
+
+
+class FlacSlicer(Slicer):
+    """Slicer of native FLAC files.
+
+    Frames are located by bisecting the input on the sample numbers of the
+    frame headers, so only the frames around the cuts are read. The frames
+    are copied untouched, so that their numbers do not start at zero, as
+    in any cut FLAC stream; STREAMINFO gets the sample count of the chapter
+    and no MD5 signature."""
+
+    extensions = (".flac",)
+
+    def _parse(self):
+        m = self._map
+        pos = 0
+        if m[0:3] == b"ID3" and len(m) >= 10:
+            pos = 10 + _unsyncsafe(m[6:10])
+        if m[pos : pos + 4] != b"fLaC":
+            raise NativeException("not a FLAC file")
+        pos += 4
+        self._blocks = []
+        last = False
+        while not last:
+            if pos + 4 > len(m):
+                raise NativeException("truncated metadata")
+            last = bool(m[pos] & 0x80)
+            block_type = m[pos] & 0x7F
+            size = int.from_bytes(m[pos + 1 : pos + 4], "big")
+            self._blocks += [(block_type, m[pos + 4 : pos + 4 + size])]
+            pos += 4 + size
+        if not self._blocks or self._blocks[0][0] != 0:
+            raise NativeException("no STREAMINFO block")
+        info = self._blocks[0][1]
+        self._blocksize = struct.unpack_from(">H", info, 2)[0]
+        self._rate = (info[10] << 12) | (info[11] << 4) | (info[12] >> 4)
+        if not self._rate:
+            raise NativeException("invalid sample rate")
+        self._audio = pos
+        first = self._frame_at(pos, check=False)
+        if first is None or first.offset != pos:
+            raise NativeException("no FLAC frame found")
+        # Frame headers must agree with the first one on these
+        self._codes = (m[pos + 1], m[pos + 2] & 0x0F, m[pos + 3] & 0x0F)
+
+    def _frame_at(self, pos, check=True):
+        """Returns the first valid frame starting at or after POS."""
+        m = self._map
+        size = len(m)
+        while True:
+            pos = m.find(b"\xff", pos)
+            if pos < 0 or pos + 6 > size:
+                return None
+            frame = self._parse_frame(pos, check)
+            if frame is not None:
+                return frame
+            pos += 1
+
+    def _parse_frame(self, pos, check):
+        m = self._map
+        b1, b2, b3 = m[pos + 1], m[pos + 2], m[pos + 3]
+        if b1 & 0xFE != 0xF8 or b3 & 1:
+            return None
+        if check and self._codes != (b1, b2 & 0x0F, b3 & 0x0F):
+            return None
+        size_code, rate_code = b2 >> 4, b2 & 0x0F
+        if size_code == 0 or rate_code == 15 or b3 >> 4 > 10:
+            return None
+        p = pos + 4
+        c = m[p]
+        if c < 0x80:
+            number, extra = c, 0
+        elif c < 0xC0:
+            return None
+        else:
+            extra = 1
+            while extra < 7 and c & (0x40 >> extra):
+                extra += 1
+            if extra == 7:
+                return None
+            number = c & (0x3F >> extra)
+        if p + 1 + extra + 4 > len(m):
+            return None
+        for k in range(1, extra + 1):
+            byte = m[p + k]
+            if byte & 0xC0 != 0x80:
+                return None
+            number = (number << 6) | (byte & 0x3F)
+        p += 1 + extra
+        if size_code == 6:
+            size = m[p] + 1
+            p += 1
+        elif size_code == 7:
+            size = struct.unpack_from(">H", m, p)[0] + 1
+            p += 2
+        elif size_code == 1:
+            size = 192
+        elif size_code < 6:
+            size = 576 << (size_code - 2)
+        else:
+            size = 256 << (size_code - 8)
+        if rate_code == 12:
+            p += 1
+        elif rate_code in (13, 14):
+            p += 2
+        if p >= len(m) or crc8(m[pos:p]) != m[p]:
+            return None
+        sample = number if b1 & 1 else number * self._blocksize
+        return FlacFrame(pos, sample, size)
+
+    def _next_frame(self, frame):
+        """Returns the frame following FRAME, or None."""
+        pos = frame.offset + 1
+        while True:
+            following = self._frame_at(pos)
+            if following is None:
+                return None
+            if following.sample == frame.sample + frame.size:
+                return following
+            pos = following.offset + 1
+
+    def _boundary(self, sample):
+        """Returns the (offset, sample) of the frame boundary closest to
+        SAMPLE."""
+        lo, hi = self._audio, len(self._map)
+        while hi - lo > 1 << 16:
+            mid = (lo + hi) // 2
+            frame = self._frame_at(mid)
+            if frame is None or frame.sample > sample:
+                hi = mid
+            else:
+                lo = frame.offset
+        frame = self._frame_at(lo)
+        while True:
+            following = self._next_frame(frame)
+            if following is None or following.sample > sample:
+                break
+            frame = following
+        if following is None:
+            # A cut in the last frame is at the end of the file
+            return len(self._map), frame.sample + frame.size
+        end = (following.offset, following.sample)
+        if sample - frame.sample <= end[1] - sample:
+            return frame.offset, frame.sample
+        return end
+
+    def _slice(self, start, end, tags):
+        first, first_sample = self._boundary(int(round(start * self._rate)))
+        last, last_sample = self._boundary(int(round(end * self._rate)))
+        if last < first:
+            last, last_sample = first, first_sample
+        info = bytearray(self._blocks[0][1])
+        total = last_sample - first_sample
+        info[13] = (info[13] & 0xF0) | ((total >> 32) & 0x0F)
+        struct.pack_into(">I", info, 14, total & 0xFFFFFFFF)
+        info[18:34] = bytes(16)
+        blocks = [(0, bytes(info))]
+        comment = None
+        for block_type, data in self._blocks[1:]:
+            if block_type == 4:
+                comment = data
+            elif block_type in _FLAC_KEPT:
+                blocks += [(block_type, data)]
+        blocks.insert(1, (4, vorbis_comment(comment, tags)))
+        header = b"fLaC"
+        for i, (block_type, data) in enumerate(blocks):
+            if i == len(blocks) - 1:
+                block_type |= 0x80
+            header += bytes([block_type]) + len(data).to_bytes(3, "big")
+            header += data
+        return header, first, last, b""
+
+
+def vorbis_comment(data, tags):
+    """Returns the VORBIS_COMMENT block DATA, or a new one if None, with
+    the title and track number of TAGS."""
+    vendor = b"chaps"
+    comments = []
+    if data:
+        (length,) = struct.unpack_from("<I", data, 0)
+        vendor = data[4 : 4 + length]
+        pos = 4 + length
+        (count,) = struct.unpack_from("<I", data, pos)
+        pos += 4
+        for _ in range(count):
+            (length,) = struct.unpack_from("<I", data, pos)
+            comments += [data[pos + 4 : pos + 4 + length]]
+            pos += 4 + length
+    for name, key in ((b"TITLE", "title"), (b"TRACKNUMBER", "track")):
+        if tags.get(key):
+            comments = [
+                c for c in comments if c.split(b"=")[0].upper() != name
+            ]
+            comments += [name + b"=" + tags[key].encode("utf-8")]
+    out = struct.pack("<I", len(vendor)) + vendor
+    out += struct.pack("<I", len(comments))
+    for comment in comments:
+        out += struct.pack("<I", len(comment)) + comment
+    return out
+
+
+SLICERS = {
+    "mp3": Mp3Slicer,
+    "wav": WavSlicer,
+    "flac": FlacSlicer,
+}
+
+
+def get_slicer(fmt, outfile):
+    """Returns the slicer class able to cut the input described by FMT,
+    ffprobe's format infos, into OUTFILE, or None."""
+    slicer = SLICERS.get(fmt.get("format_name"))
+    if slicer is None:
+        return None
+    if os.path.splitext(outfile)[1].lower() not in slicer.extensions:
+        return None
+    return slicer
@@ -1,6 +1,7 @@
 "Options module"
 import argparse
 import sys
+import threading
 
 from multiprocessing import cpu_count
 
@@ -9,6 +10,10 @@ from .version import __version__, __commit__, __tag__
 
 ARGS = None
 
+_LOCAL = threading.local()
+
+_OPTION_ACTIONS = None
+
 
 def _commasep_intlist(string):
     lst = string.split(",")
@@ -34,6 +39,20 @@ def _positive_int(val):
     return integer
 
 
+def _threads(val):
+    if val == "auto":
+        return val
+    try:
+        integer = int(val)
+    except ValueError:
+        msg = "'{}' is neither an integer nor 'auto'".format(val)
+        raise argparse.ArgumentTypeError(msg)
+    if integer < 1:
+        msg = "number of threads should be positive"
+        raise argparse.ArgumentTypeError(msg)
+    return integer
+
+
 def _filetype(mode):
     def checker(string):
         try:
@@ -54,15 +73,19 @@ def get_version():
         return "%(prog)s {} (commit {})".format(__version__, __commit__)
 
 
-def parse_args():
+def make_parser():
     parser = argparse.ArgumentParser(
-        description="Cut audio/video file on chapters using ffmpeg."
+        description="Cut audio/video file on chapters using ffmpeg.",
+        epilog="""chaps --serve starts the daemon running the commands given
+        to chaps --submit, see "DAEMON".""",
     )
     parser.add_argument(
-        "file",
+        "files",
         metavar="FILE",
-        type=_filetype("r"),
-        help="The name of the input file.",
+        nargs="+",
+        help="""The name of the input file. Several files, directories or
+        glob patterns may be given, directories standing for the media files
+        they contain. "-" reads the standard input, with --chapter-file.""",
     )
 
     parser.add_argument(
@@ -98,13 +121,103 @@ def parse_args():
         help="Indicate to ffmpeg that the stream is not to be re-encoded.",
     )
 
+    parser.add_argument(
+        "-S",
+        "--single-pass",
+        action="store_true",
+        default=False,
+        dest="singlepass",
+        help="""With --copy, extract every chapter with a single ffmpeg
+        process instead of one process per chapter.""",
+    )
+
+    parser.add_argument(
+        "--no-native",
+        action="store_false",
+        default=True,
+        dest="nativeslice",
+        help="""Always use ffmpeg and ffprobe. By default, with --copy,
+        the chapters of MP3, WAV and FLAC files are copied directly when
+        they are written in the same format, and --print-chapters reads the
+        chapters of MP4, Matroska and MP3 files directly.""",
+    )
+
+    parser.add_argument(
+        "--smart-render",
+        action="store_true",
+        default=False,
+        dest="smartrender",
+        help="""Re-encode only the partial GOPs at the start and at the end
+        of each chapter and stream copy the ones in between, then join them.
+        The cuts are frame accurate at nearly the speed of --copy. Only
+        H.264 and HEVC videos are smart rendered, the chapters of other
+        videos are re-encoded whole.""",
+    )
+
+    parser.add_argument(
+        "--seek",
+        action="store",
+        choices=["auto", "input", "accurate", "output"],
+        default="auto",
+        dest="seek",
+        metavar="MODE",
+        help="""Where ffmpeg seeks to the chapter start: "input" seeks in the
+        input to the closest keyframe, "accurate" seeks in the input then
+        decodes up to the exact position, "output" decodes everything from
+        the start of the file. [Default: "auto", i.e. "accurate" when
+        re-encoding and "output" with --copy]""",
+    )
+
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        default=False,
+        dest="resume",
+        help="""Keep a journal of the extracted chapters next to the outputs
+        and skip the chapters whose output is already complete.""",
+    )
+
+    parser.add_argument(
+        "--archive",
+        action="store",
+        default=None,
+        dest="archive",
+        metavar="FILE",
+        help="""Add the chapters to the tar or zip archive FILE, in the order
+        they are finished, instead of leaving them in place. Entries are
+        named by the output template and each chapter is removed once
+        archived. "-" writes the archive to the standard output.""",
+    )
+
+    parser.add_argument(
+        "--archive-format",
+        action="store",
+        choices=["tar", "zip"],
+        default=None,
+        dest="archiveformat",
+        metavar="FORMAT",
+        help="""Format of the --archive, "tar" or "zip". [Default: guessed
+        from the extension of FILE, "tar" otherwise, compressed when FILE
+        ends with .gz, .bz2 or .xz]""",
+    )
+
     parser.add_argument(
         "-D",
         "--dry-run",
         action="store_true",
         default=False,
         dest="dryrun",
-        help="Do not write anything to disk.",
+        help="""Do not write anything to disk, print the plan of the split
+        as JSON instead, see "DRY RUN".""",
+    )
+
+    parser.add_argument(
+        "--no-space-check",
+        action="store_false",
+        default=True,
+        dest="spacecheck",
+        help="""Do not refuse to split when the outputs would not fit on
+        disk, according to the bitrate of the inputs.""",
     )
 
     parser.add_argument(
@@ -139,6 +252,17 @@ def parse_args():
         help="""Use FILE to get chapters.""",
     )
 
+    parser.add_argument(
+        "--input-format",
+        action="store",
+        metavar="FORMAT",
+        default=None,
+        dest="inputformat",
+        help="""Format of the standard input, given to ffmpeg with -f when
+        it can not guess it. It is also the %%(ext)s of the outputs, which
+        is "mkv" by default.""",
+    )
+
     parser.add_argument(
         "-j",
         "--jobs",
@@ -150,7 +274,67 @@ def parse_args():
         metavar="JOBS",
         type=_positive_int,
         help="""Number of jobs to use, if no value is given, the number of jobs
-        will be equal of the number of cores availables""",
+        will be equal of the number of cores availables. The jobs are shared by
+        the chapters of every given file""",
+    )
+
+    parser.add_argument(
+        "--threads",
+        action="store",
+        default="auto",
+        dest="threads",
+        metavar="THREADS",
+        type=_threads,
+        help="""Number of threads of each ffmpeg process when re-encoding.
+        With "auto", the available cores are shared among the running jobs,
+        and ffmpeg chooses alone when there is a single job.
+        [Default: "auto"]""",
+    )
+
+    parser.add_argument(
+        "--schedule",
+        action="store",
+        choices=["longest", "file"],
+        default="longest",
+        dest="schedule",
+        metavar="POLICY",
+        help="""Order in which chapters are given to the jobs: "longest"
+        starts the chapters with the highest estimated cost (duration times
+        bitrate) first, "file" keeps the file order. [Default: "longest"]""",
+    )
+
+    parser.add_argument(
+        "--engine",
+        action="store",
+        choices=["pool", "async"],
+        default="pool",
+        dest="engine",
+        metavar="ENGINE",
+        help="""How ffmpeg processes are orchestrated: "pool" starts them from
+        a pool of worker processes, "async" starts them all from a single
+        asyncio event loop. [Default: "pool"]""",
+    )
+
+    parser.add_argument(
+        "--no-probe-cache",
+        action="store_false",
+        default=True,
+        dest="probecache",
+        help="""Do not use the persistent cache of ffprobe results, always
+        probe the input file.""",
+    )
+
+    parser.add_argument(
+        "--keyframes",
+        choices=["off", "snap", "report"],
+        default="off",
+        metavar="MODE",
+        dest="keyframes",
+        help="""With --copy, check the chapter cuts against the keyframes of
+        the video stream. "snap" moves each cut to the nearest keyframe so
+        that the copied chapters neither overlap nor start with frozen
+        frames, "report" only warns about the cuts that are not on a
+        keyframe. "off" (default) cuts at the chapter times.""",
     )
 
     verbosity = parser.add_argument_group("verbosity")
@@ -191,7 +375,72 @@ def parse_args():
         help="Print progress bar",
     )
 
-    args = parser.parse_args()
+    verbosity.add_argument(
+        "--trace",
+        action="store",
+        default=None,
+        dest="trace",
+        metavar="FILE",
+        help="""Record the phases of the run and the life of each chapter
+        job and ffmpeg process in FILE, in the Chrome trace event format
+        loaded by chrome://tracing and Perfetto.""",
+    )
+
+    verbosity.add_argument(
+        "--report",
+        action="store",
+        default=None,
+        dest="report",
+        metavar="FILE",
+        help="""Write the statistics of every extracted chapter to FILE, as
+        CSV when it ends with .csv and as JSON otherwise: wall time, speed,
+        frame rate and bitrate reported by ffmpeg, output size, CPU time
+        and peak memory of the process.""",
+    )
+
+    verbosity.add_argument(
+        "--profile",
+        nargs="?",
+        action="store",
+        const="-",
+        default=None,
+        dest="profile",
+        metavar="FILE",
+        help="""Profile chaps with cProfile and print the most expensive
+        calls, or write the statistics to FILE for pstats. The --jobs
+        workers and ffmpeg are not profiled.""",
+    )
+
+    return parser
+
+
+def option_actions():
+    """Returns the argparse action of every option by its long name, the
+    dashes being replaced by underscores, e.g. "no_native". The map is
+    made once per process and shared, it must not be modified."""
+    global _OPTION_ACTIONS
+    if _OPTION_ACTIONS is None:
+        actions = {}
+        for action in make_parser()._actions:
+            names = [s for s in action.option_strings if s.startswith("--")]
+            if names and action.dest not in ("help", "version"):
+                actions[names[0][2:].replace("-", "_")] = action
+        _OPTION_ACTIONS = actions
+    return _OPTION_ACTIONS
+
+
+def default_args():
+    """Returns the options of a run given no option nor file."""
+    args = argparse.Namespace(files=[])
+    for action in option_actions().values():
+        setattr(args, action.dest, action.default)
+    return args
+
+
+def parse_args(argv=None):
+    """Parses ARGV, the command line arguments by default, and keeps the
+    result for get_args()."""
+    args = make_parser().parse_args(argv)
 
     if args.quiet and args.verbose:
         warn("Warning, -q and -v are mutual exclusive arguments")
@@ -201,11 +450,38 @@ def parse_args():
         warn("Warning, no need to pass more than 3 v's")
         args.verbose = 3
 
+    set_args(args)
+    return args
+
+
+def set_args(args):
+    """Sets the options read by get_args()."""
     global ARGS
     ARGS = args
 
-    return args
+
+def set_thread_args(args):
+    """Sets the options read by get_args() in the current thread only,
+    None giving it back the ones of the process."""
+    _LOCAL.args = args
 
 
 def get_args():
-    return ARGS
+    return getattr(_LOCAL, "args", None) or ARGS
+
+
+def bind_args(func, args=None):
+    """Returns FUNC running with ARGS, by default the options of the
+    calling thread, as the options of the thread it is called in."""
+    if args is None:
+        args = get_args()
+
+    def call(*fargs, **kwargs):
+        previous = getattr(_LOCAL, "args", None)
+        set_thread_args(args)
+        try:
+            return func(*fargs, **kwargs)
+        finally:
+            set_thread_args(previous)
+
+    return call
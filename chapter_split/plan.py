@@ -0,0 +1,166 @@
+"""Plan module
+
+Estimates what a split costs before anything runs: the size of each
+output, from the bitrate of its input, the CPU time it takes and the free
+space the outputs need on each filesystem. --dry-run prints the plan of
+the split as JSON, and a split which would not fit on disk is refused
+before it starts."""
+import os
+import shutil
+
+from .archive import STDOUT
+
+from .scheduler import chapter_duration
+
+
+# CPU seconds spent per second of 1080p video re-encoded to each codec with
+# the default settings of its ffmpeg encoder, decoding included
+ENCODE_SPEED = {
+    "mpeg2video": 0.3,
+    "mpeg4": 0.3,
+    "theora": 0.5,
+    "h264": 1.0,
+    "vp8": 1.5,
+    "vp9": 3.0,
+    "hevc": 4.0,
+    "av1": 8.0,
+}
+DEFAULT_ENCODE_SPEED = 1.0
+REFERENCE_PIXELS = 1920 * 1080
+
+# The video codec ffmpeg encodes each output format to by default
+OUTPUT_CODECS = {
+    ".mp4": "h264",
+    ".m4v": "h264",
+    ".mkv": "h264",
+    ".mov": "h264",
+    ".flv": "h264",
+    ".webm": "vp9",
+    ".ogv": "theora",
+    ".avi": "mpeg4",
+    ".mpg": "mpeg2video",
+    ".ts": "mpeg2video",
+}
+
+# CPU seconds per second of chapter for files without video, re-encoding
+# their audio, and for stream copies, which only remux packets
+AUDIO_SPEED = 0.02
+COPY_SPEED = 0.001
+
+
+class PlanException(Exception):
+    pass
+
+
+def format_size(size):
+    return "{:.1f} MiB".format(size / (1 << 20))
+
+
+def estimate_size(chap, fmt):
+    """Returns the estimated size, in bytes, of the output of CHAP: its
+    duration times the bitrate of the file FMT. Returns None when either
+    is unknown."""
+    if chap.get("end_time") is None:
+        return None
+    try:
+        bit_rate = float(fmt["bit_rate"])
+    except (KeyError, TypeError, ValueError):
+        return None
+    return int(chapter_duration(chap) * bit_rate / 8)
+
+
+def encode_speed(codec, stream):
+    """Returns the CPU seconds needed to re-encode a second of the video
+    STREAM, as given by ffprobe, to CODEC. A file without video stream, or
+    whose only picture is its cover, has its audio re-encoded."""
+    if stream is None or stream.get("disposition", {}).get("attached_pic"):
+        return AUDIO_SPEED
+    speed = ENCODE_SPEED.get(codec, DEFAULT_ENCODE_SPEED)
+    try:
+        pixels = int(stream["width"]) * int(stream["height"])
+    except (KeyError, TypeError, ValueError):
+        return speed
+    return speed * pixels / REFERENCE_PIXELS
+
+
+def estimate_cpu(duration, encoded, codec, stream):
+    """Returns the estimated CPU time, in seconds, of extracting a chapter
+    of DURATION seconds, ENCODED of them being re-encoded to CODEC, from a
+    file of video STREAM. Returns None when the duration is unknown."""
+    if duration is None:
+        return None
+    copied = duration - encoded
+    return copied * COPY_SPEED + encoded * encode_speed(codec, stream)
+
+
+def disk_needs(outputs, sizes, njobs, archive=None, temporaries=False):
+    """Returns the bytes needed in each directory to write OUTPUTS, of
+    estimated SIZES, with NJOBS jobs at a time. With an ARCHIVE, only the
+    outputs being extracted are on disk alongside the archive. With
+    TEMPORARIES, each output being extracted is first written as segments
+    about as large as itself."""
+    needs = {}
+
+    def need(path, size):
+        directory = os.path.dirname(os.path.abspath(path))
+        needs[directory] = needs.get(directory, 0) + size
+
+    sizes = [size or 0 for size in sizes]
+    largest = sorted(range(len(outputs)), key=lambda i: -sizes[i])[:njobs]
+    if archive is None:
+        for output, size in zip(outputs, sizes):
+            need(output, size)
+    else:
+        if archive != STDOUT:
+            need(archive, sum(sizes))
+        for index in largest:
+            need(outputs[index], sizes[index])
+    if temporaries:
+        for index in largest:
+            need(outputs[index], sizes[index])
+    return needs
+
+
+def _existing(path):
+    """Returns PATH or its closest existing parent."""
+    while not os.path.exists(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+    return path
+
+
+def filesystems(needs):
+    """Returns, for every filesystem of the directories of NEEDS, as given
+    by disk_needs(), the bytes it requires and has free, as a dict giving
+    the first of these directories as "path"."""
+    found = {}
+    for directory, size in sorted(needs.items()):
+        existing = _existing(directory)
+        device = os.stat(existing).st_dev
+        if device not in found:
+            found[device] = {
+                "path": directory,
+                "required": 0,
+                "free": shutil.disk_usage(existing).free,
+            }
+        found[device]["required"] += size
+    for filesystem in found.values():
+        filesystem["enough"] = filesystem["required"] <= filesystem["free"]
+    return list(found.values())
+
+
+def check_space(found):
+    """Raises a PlanException if one of the filesystems FOUND, as given by
+    filesystems(), is too small."""
+    for filesystem in found:
+        if not filesystem["enough"]:
+            raise PlanException(
+                "the outputs need about {} on the filesystem of {}, only {} "
+                "are free".format(
+                    format_size(filesystem["required"]),
+                    filesystem["path"],
+                    format_size(filesystem["free"]),
+                )
+            )
@@ -0,0 +1,591 @@
+"""Readers module
+
+Native readers of the chapter tables of MP4/M4B, Matroska and ID3v2
+tagged files. A reader returns the chapters of a file in the structure
+ffprobe uses, an empty list when the file has none, or None when it can
+not read the file, ffprobe being used then."""
+import os
+import struct
+
+from .verbosity import vvprint
+
+READERS = {}
+
+
+class ReaderException(Exception):
+    pass
+
+
+def register_reader(*extensions):
+    """Registers the decorated function as the chapter reader of the files
+    with one of EXTENSIONS."""
+
+    def register(reader):
+        for extension in extensions:
+            READERS[extension] = reader
+        return reader
+
+    return register
+
+
+def make_chapter(index, start, end, title):
+    """Returns the ffprobe structure of the chapter INDEX going from START
+    to END, in seconds."""
+    return {
+        "id": index,
+        "time_base": "1/1000",
+        "start": int(round(start * 1000)),
+        "start_time": "{:.6f}".format(start),
+        "end": int(round(end * 1000)),
+        "end_time": "{:.6f}".format(end),
+        "tags": {"title": title},
+    }
+
+
+def make_chapters(starts, titles, duration, ends=None, ids=None):
+    """Returns the chapters starting at STARTS, each one ending where the
+    next one starts and the last one at DURATION, unless ENDS are given.
+    The chapters are numbered from 0 unless their IDS are given."""
+    if ends is None:
+        if starts and duration is None:
+            raise ReaderException("unknown duration")
+        ends = list(starts[1:]) + [duration]
+    if ids is None:
+        ids = range(len(starts))
+    return [
+        make_chapter(i, start, max(start, end), title)
+        for i, start, end, title in zip(ids, starts, ends, titles)
+    ]
+
+
+def read_chapters(filename):
+    """Returns the chapters of FILENAME read by its native reader, or None
+    if there is no reader for it or it failed."""
+    reader = READERS.get(os.path.splitext(filename)[1].lower())
+    if reader is None:
+        return None
+    try:
+        with open(filename, "rb") as f:
+            return reader(f)
+    except (
+        ReaderException,
+        OSError,
+        struct.error,
+        ValueError,
+        IndexError,
+    ) as e:
+        vvprint(
+            "[chaps] Can not read the chapters of {}: {}".format(filename, e)
+        )
+        return None
+
+
+def _decode_text(data):
+    if data[:2] in (b"\xfe\xff", b"\xff\xfe"):
+        return data.decode("utf-16", "replace")
+    return data.decode("utf-8", "replace")
+
+
+# MP4 / QuickTime
+
+
+def _boxes(data, start=0, end=None):
+    """Yields the (type, body start, body end) of the boxes of DATA between
+    START and END."""
+    end = len(data) if end is None else end
+    pos = start
+    while pos + 8 <= end:
+        size, kind = struct.unpack_from(">I4s", data, pos)
+        header = 8
+        if size == 1:
+            if pos + 16 > end:
+                return
+            (size,) = struct.unpack_from(">Q", data, pos + 8)
+            header = 16
+        elif size == 0:
+            size = end - pos
+        if size < header or pos + size > end:
+            return
+        yield kind, pos + header, pos + size
+        pos += size
+
+
+def _box(data, path, start=0, end=None):
+    """Returns the (body start, body end) of the first box found along
+    PATH, a list of box types, or None."""
+    for kind, body, box_end in _boxes(data, start, end):
+        if kind == path[0]:
+            if len(path) == 1:
+                return body, box_end
+            return _box(data, path[1:], body, box_end)
+    return None
+
+
+def _read_moov(f):
+    """Returns the body of the moov box of F, skipping over the others."""
+    pos = 0
+    while True:
+        f.seek(pos)
+        header = f.read(16)
+        if len(header) < 8:
+            return None
+        size, kind = struct.unpack_from(">I4s", header)
+        header_size = 8
+        if size == 1 and len(header) == 16:
+            (size,) = struct.unpack_from(">Q", header, 8)
+            header_size = 16
+        elif size == 0:
+            size = os.fstat(f.fileno()).st_size - pos
+        if size < header_size:
+            raise ReaderException("invalid box size")
+        if kind == b"moov":
+            f.seek(pos + header_size)
+            data = f.read(size - header_size)
+            if len(data) < size - header_size:
+                raise ReaderException("truncated moov box")
+            return data
+        pos += size
+
+
+def _full_box_time(data, body, offset_v0, offset_v1):
+    """Returns the (timescale, duration) of a mvhd or mdhd full box."""
+    if data[body] == 1:
+        return struct.unpack_from(">IQ", data, body + offset_v1)
+    return struct.unpack_from(">II", data, body + offset_v0)
+
+
+def _chpl_chapters(data, duration):
+    box = _box(data, [b"udta", b"chpl"])
+    if box is None:
+        return None
+    pos = box[0]
+    version = data[pos]
+    pos += 8 if version else 4
+    count = data[pos]
+    pos += 1
+    starts = []
+    titles = []
+    for _ in range(count):
+        (start,) = struct.unpack_from(">Q", data, pos)
+        length = data[pos + 8]
+        title = data[pos + 9 : pos + 9 + length]
+        starts += [start / 10000000]
+        titles += [_decode_text(title)]
+        pos += 9 + length
+    return make_chapters(starts, titles, duration)
+
+
+def _sample_table(data, stbl):
+    """Returns the (offset, size, time, duration) of the samples of the
+    sample table box STBL, times being in the track timescale."""
+    start, end = stbl
+
+    def body(kind):
+        box = _box(data, [kind], start, end)
+        if box is None:
+            raise ReaderException("no {} box".format(kind.decode()))
+        return box[0]
+
+    pos = body(b"stts")
+    (count,) = struct.unpack_from(">I", data, pos + 4)
+    times = []
+    time = 0
+    for i in range(count):
+        nb, delta = struct.unpack_from(">II", data, pos + 8 + 8 * i)
+        for _ in range(nb):
+            times += [(time, delta)]
+            time += delta
+    pos = body(b"stsz")
+    size, count = struct.unpack_from(">II", data, pos + 4)
+    if size:
+        sizes = [size] * count
+    else:
+        fmt = ">{}I".format(count)
+        sizes = list(struct.unpack_from(fmt, data, pos + 12))
+    pos = body(b"stsc")
+    (count,) = struct.unpack_from(">I", data, pos + 4)
+    runs = [
+        struct.unpack_from(">II", data, pos + 8 + 12 * i)
+        for i in range(count)
+    ]
+    box = _box(data, [b"stco"], start, end)
+    if box is not None:
+        (count,) = struct.unpack_from(">I", data, box[0] + 4)
+        chunks = struct.unpack_from(">{}I".format(count), data, box[0] + 8)
+    else:
+        pos = body(b"co64")
+        (count,) = struct.unpack_from(">I", data, pos + 4)
+        chunks = struct.unpack_from(">{}Q".format(count), data, pos + 8)
+    samples = []
+    for i, offset in enumerate(chunks):
+        per_chunk = 0
+        for first_chunk, nb in runs:
+            if first_chunk > i + 1:
+                break
+            per_chunk = nb
+        for _ in range(per_chunk):
+            if len(samples) == len(sizes):
+                break
+            samples += [(offset, sizes[len(samples)])]
+            offset += sizes[len(samples) - 1]
+    return [s + t for s, t in zip(samples, times)]
+
+
+def _track_chapters(f, data):
+    """Returns the chapters of the QuickTime chapter track, or None."""
+    tracks = {}
+    chapter_ids = []
+    for kind, body, end in _boxes(data):
+        if kind != b"trak":
+            continue
+        tkhd = _box(data, [b"tkhd"], body, end)
+        if tkhd is None:
+            continue
+        offset = 20 if data[tkhd[0]] == 1 else 12
+        (track_id,) = struct.unpack_from(">I", data, tkhd[0] + offset)
+        tracks[track_id] = (body, end)
+        chap = _box(data, [b"tref", b"chap"], body, end)
+        if chap is not None:
+            count = (chap[1] - chap[0]) // 4
+            chapter_ids += struct.unpack_from(
+                ">{}I".format(count), data, chap[0]
+            )
+    chapter_ids = [i for i in chapter_ids if i in tracks]
+    if not chapter_ids:
+        return None
+    body, end = tracks[chapter_ids[0]]
+    mdhd = _box(data, [b"mdia", b"mdhd"], body, end)
+    stbl = _box(data, [b"mdia", b"minf", b"stbl"], body, end)
+    if mdhd is None or stbl is None:
+        raise ReaderException("invalid chapter track")
+    timescale, _ = _full_box_time(data, mdhd[0], 12, 20)
+    starts, ends, titles = [], [], []
+    for offset, size, time, duration in _sample_table(data, stbl):
+        f.seek(offset)
+        sample = f.read(size)
+        (length,) = struct.unpack_from(">H", sample)
+        titles += [_decode_text(sample[2 : 2 + length])]
+        starts += [time / timescale]
+        ends += [(time + duration) / timescale]
+    return make_chapters(starts, titles, None, ends)
+
+
+@register_reader(".mp4", ".m4a", ".m4b", ".m4v", ".mov")
+def read_mp4_chapters(f):
+    """Reads the QuickTime chapter track of an MP4 file, or its Nero chpl
+    box when it has none."""
+    data = _read_moov(f)
+    if data is None:
+        raise ReaderException("no moov box")
+    mvhd = _box(data, [b"mvhd"])
+    duration = None
+    if mvhd is not None:
+        timescale, length = _full_box_time(data, mvhd[0], 12, 20)
+        if timescale:
+            duration = length / timescale
+    chapters = _track_chapters(f, data)
+    if chapters is None:
+        chapters = _chpl_chapters(data, duration)
+    return chapters or []
+
+
+# Matroska
+
+MKV_EBML = 0x1A45DFA3
+MKV_SEGMENT = 0x18538067
+MKV_SEEKHEAD = 0x114D9B74
+MKV_SEEK = 0x4DBB
+MKV_SEEKID = 0x53AB
+MKV_SEEKPOSITION = 0x53AC
+MKV_INFO = 0x1549A966
+MKV_TIMECODESCALE = 0x2AD7B1
+MKV_DURATION = 0x4489
+MKV_CLUSTER = 0x1F43B675
+MKV_CHAPTERS = 0x1043A770
+MKV_EDITIONENTRY = 0x45B9
+MKV_EDITIONFLAGDEFAULT = 0x45DB
+MKV_CHAPTERATOM = 0xB6
+MKV_CHAPTERUID = 0x73C4
+MKV_CHAPTERTIMESTART = 0x91
+MKV_CHAPTERTIMEEND = 0x92
+MKV_CHAPTERFLAGHIDDEN = 0x98
+MKV_CHAPTERDISPLAY = 0x80
+MKV_CHAPSTRING = 0x85
+
+
+def _vint(data, pos, marker=False):
+    """Returns the (value, length) of the EBML variable length integer of
+    DATA at POS, keeping its length MARKER for element IDs. The value of
+    an unknown size is None."""
+    if pos >= len(data):
+        raise ReaderException("truncated EBML element")
+    first = data[pos]
+    length = 1
+    while length <= 8 and not first & (0x100 >> length):
+        length += 1
+    if length > 8 or pos + length > len(data):
+        raise ReaderException("invalid EBML integer")
+    value = first if marker else first & (0xFF >> length)
+    for byte in data[pos + 1 : pos + length]:
+        value = (value << 8) | byte
+    if not marker and value == (1 << (7 * length)) - 1:
+        value = None
+    return value, length
+
+
+def _element(data, pos):
+    """Returns the (id, body start, size) of the EBML element of DATA at
+    POS."""
+    element_id, id_length = _vint(data, pos, marker=True)
+    size, size_length = _vint(data, pos + id_length)
+    return element_id, pos + id_length + size_length, size
+
+
+def _elements(data, start=0, end=None):
+    end = len(data) if end is None else end
+    pos = start
+    while pos < end:
+        element_id, body, size = _element(data, pos)
+        if size is None or body + size > end:
+            raise ReaderException("invalid EBML element size")
+        yield element_id, body, body + size
+        pos = body + size
+
+
+def _uint(data, start, end):
+    return int.from_bytes(data[start:end], "big")
+
+
+def _peek(f, pos):
+    f.seek(pos)
+    return f.read(12)
+
+
+def _read_body(f, body, size):
+    f.seek(body)
+    data = f.read(size)
+    if len(data) != size:
+        raise ReaderException("truncated element")
+    return data
+
+
+def _chapter_id(uid):
+    """Returns the id ffprobe gives to the chapter of UID, which it reads
+    as a signed 64 bits integer."""
+    return uid - (1 << 64) if uid >= 1 << 63 else uid
+
+
+def _matroska_chapters(data, duration):
+    editions = [
+        (body, end)
+        for element_id, body, end in _elements(data)
+        if element_id == MKV_EDITIONENTRY
+    ]
+    if not editions:
+        return []
+    edition = editions[0]
+    for body, end in editions:
+        for element_id, start, stop in _elements(data, body, end):
+            if element_id == MKV_EDITIONFLAGDEFAULT and _uint(
+                data, start, stop
+            ):
+                edition = (body, end)
+    atoms = []
+    for element_id, body, end in _elements(data, *edition):
+        if element_id != MKV_CHAPTERATOM:
+            continue
+        start = stop = None
+        # ffmpeg writes the UIDs 1 to N, which are used when one is missing
+        uid = len(atoms) + 1
+        title = ""
+        hidden = False
+        for child_id, child, child_end in _elements(data, body, end):
+            if child_id == MKV_CHAPTERTIMESTART:
+                start = _uint(data, child, child_end) / 1e9
+            elif child_id == MKV_CHAPTERTIMEEND:
+                stop = _uint(data, child, child_end) / 1e9
+            elif child_id == MKV_CHAPTERUID:
+                uid = _uint(data, child, child_end) or uid
+            elif child_id == MKV_CHAPTERFLAGHIDDEN:
+                hidden = bool(_uint(data, child, child_end))
+            elif child_id == MKV_CHAPTERDISPLAY and not title:
+                for display_id, s, e in _elements(data, child, child_end):
+                    if display_id == MKV_CHAPSTRING:
+                        title = data[s:e].decode("utf-8", "replace")
+                        break
+        if start is not None and not hidden:
+            atoms += [(start, stop, title, _chapter_id(uid))]
+    atoms.sort(key=lambda atom: atom[0])
+    starts = [atom[0] for atom in atoms]
+    ends = []
+    for i, (start, stop, _, _) in enumerate(atoms):
+        if stop is None:
+            stop = starts[i + 1] if i + 1 < len(atoms) else duration
+        if stop is None:
+            raise ReaderException("unknown duration")
+        ends += [stop]
+    return make_chapters(
+        starts,
+        [atom[2] for atom in atoms],
+        None,
+        ends,
+        [atom[3] for atom in atoms],
+    )
+
+
+@register_reader(".mkv", ".mka", ".mk3d", ".webm")
+def read_matroska_chapters(f):
+    """Reads the Chapters element of a Matroska file, from the default
+    edition, or the first one. Hidden chapters are skipped, and the
+    chapters are numbered by their ChapterUID, as ffprobe does."""
+    header = _peek(f, 0)
+    element_id, body, size = _element(header, 0)
+    if element_id != MKV_EBML or size is None:
+        raise ReaderException("not an EBML file")
+    pos = body + size
+    element_id, body, size = _element(_peek(f, pos), 0)
+    if element_id != MKV_SEGMENT:
+        raise ReaderException("no segment")
+    segment = pos + body
+    file_size = os.fstat(f.fileno()).st_size
+    end = file_size if size is None else min(file_size, segment + size)
+    found = {}
+    seeks = {}
+    pos = segment
+    while pos < end:
+        element_id, body, size = _element(_peek(f, pos), 0)
+        if size is None or element_id == MKV_CLUSTER:
+            break
+        if element_id in (MKV_INFO, MKV_CHAPTERS):
+            found[element_id] = _read_body(f, pos + body, size)
+        elif element_id == MKV_SEEKHEAD:
+            seekhead = _read_body(f, pos + body, size)
+            for seek_id, seek, seek_end in _elements(seekhead):
+                if seek_id != MKV_SEEK:
+                    continue
+                target = position = None
+                for child_id, s, e in _elements(seekhead, seek, seek_end):
+                    if child_id == MKV_SEEKID:
+                        target = _uint(seekhead, s, e)
+                    elif child_id == MKV_SEEKPOSITION:
+                        position = _uint(seekhead, s, e)
+                if target is not None and position is not None:
+                    seeks.setdefault(target, segment + position)
+        pos += body + size
+    for element_id in (MKV_INFO, MKV_CHAPTERS):
+        if element_id not in found and element_id in seeks:
+            pos = seeks[element_id]
+            found_id, body, size = _element(_peek(f, pos), 0)
+            if found_id == element_id and size is not None:
+                found[element_id] = _read_body(f, pos + body, size)
+    scale = 1000000
+    duration = None
+    info = found.get(MKV_INFO, b"")
+    for element_id, body, body_end in _elements(info):
+        if element_id == MKV_TIMECODESCALE:
+            scale = _uint(info, body, body_end)
+        elif element_id == MKV_DURATION:
+            fmt = ">f" if body_end - body == 4 else ">d"
+            (duration,) = struct.unpack_from(fmt, info, body)
+    if duration is not None:
+        duration = duration * scale / 1e9
+    if MKV_CHAPTERS not in found:
+        return []
+    return _matroska_chapters(found[MKV_CHAPTERS], duration)
+
+
+# ID3v2
+
+
+def _unsynchronise(data):
+    return data.replace(b"\xff\x00", b"\xff")
+
+
+def _id3_frames(data, version):
+    """Yields the (id, body) of the ID3v2.VERSION frames of DATA."""
+    pos = 0
+    while pos + 10 <= len(data) and data[pos] != 0:
+        frame_id = data[pos : pos + 4]
+        if version == 4:
+            size = _syncsafe(data[pos + 4 : pos + 8])
+        else:
+            (size,) = struct.unpack_from(">I", data, pos + 4)
+        flags = data[pos + 9]
+        body = data[pos + 10 : pos + 10 + size]
+        if version == 4 and flags & 0x02:
+            body = _unsynchronise(body)
+        if version == 4 and flags & 0x01:
+            body = body[4:]  # data length indicator
+        yield frame_id, body
+        pos += 10 + size
+
+
+def _syncsafe(data):
+    return (data[0] << 21) | (data[1] << 14) | (data[2] << 7) | data[3]
+
+
+def _id3_text(body):
+    encoding = body[0]
+    data = body[1:]
+    if encoding == 0:
+        return data.decode("latin-1").rstrip("\0")
+    if encoding == 1:
+        return data.decode("utf-16", "replace").rstrip("\0")
+    if encoding == 2:
+        return data.decode("utf-16-be", "replace").rstrip("\0")
+    return data.decode("utf-8", "replace").rstrip("\0")
+
+
+@register_reader(".mp3", ".mp2", ".aac")
+def read_id3_chapters(f):
+    """Reads the CHAP frames of the ID3v2 tag at the start of a file, in
+    the order of the top level table of contents if there is one. The
+    chapters are numbered in the order of their frames, as ffprobe does."""
+    header = f.read(10)
+    if len(header) < 10 or header[:3] != b"ID3":
+        return []
+    version, flags = header[3], header[5]
+    if version not in (3, 4):
+        raise ReaderException("ID3v2.{} is not supported".format(version))
+    data = f.read(_syncsafe(header[6:10]))
+    if version == 3 and flags & 0x80:
+        data = _unsynchronise(data)
+    if flags & 0x40:
+        if version == 3:
+            (size,) = struct.unpack_from(">I", data)
+            data = data[4 + size :]
+        else:
+            data = data[_syncsafe(data[:4]) :]
+    chapters = {}
+    nb_frames = 0
+    order = None
+    for frame_id, body in _id3_frames(data, version):
+        element_id, _, rest = body.partition(b"\0")
+        if frame_id == b"CHAP" and len(rest) >= 16:
+            start, end = struct.unpack_from(">II", rest)
+            title = ""
+            for sub_id, sub in _id3_frames(rest[16:], version):
+                if sub_id == b"TIT2" and sub:
+                    title = _id3_text(sub)
+            chapters[element_id] = (
+                start / 1000,
+                end / 1000,
+                title,
+                nb_frames,
+            )
+            nb_frames += 1
+        elif frame_id == b"CTOC" and len(rest) >= 2 and order is None:
+            toc_flags, count = rest[0], rest[1]
+            if toc_flags & 0x02:  # top level
+                order = rest[2:].split(b"\0")[:count]
+    if order is not None and all(e in chapters for e in order):
+        atoms = [chapters[e] for e in order]
+    else:
+        atoms = sorted(chapters.values())
+    return make_chapters(
+        [a[0] for a in atoms],
+        [a[2] for a in atoms],
+        None,
+        [a[1] for a in atoms],
+        [a[3] for a in atoms],
+    )
@@ -0,0 +1,185 @@
+"""Report module
+
+Gathers, for every extracted chapter, the statistics of the processes
+which made it: the wall time, ffmpeg's last -progress report and the
+resource usage of the process, so that they can be written as a JSON or
+CSV report."""
+import csv
+import json
+import os
+import resource
+import sys
+import time
+
+from .verbosity import vprint
+
+REPORT_FIELDS = [
+    "file",
+    "chapter",
+    "title",
+    "output",
+    "engine",
+    "duration",
+    "wall",
+    "speed",
+    "fps",
+    "bitrate",
+    "size",
+    "user",
+    "system",
+    "maxrss",
+]
+
+
+def _parse_float(value, suffix=""):
+    if suffix and value.endswith(suffix):
+        value = value[: -len(suffix)]
+    try:
+        return float(value)
+    except ValueError:
+        # ffmpeg reports "N/A" until it knows
+        return None
+
+
+class ProgressStats:
+    """Keeps the last speed, frame rate and bitrate reported by ffmpeg's
+    -progress option."""
+
+    def __init__(self):
+        self.speed = None
+        self.fps = None
+        self.bitrate = None
+
+    def feed(self, key, value):
+        if key == "speed":
+            self.speed = _parse_float(value.strip(), "x")
+        elif key == "fps":
+            self.fps = _parse_float(value)
+        elif key == "bitrate":
+            self.bitrate = _parse_float(value.strip(), "kbits/s")
+
+
+def wait_rusage(p):
+    """Waits for the Popen P and returns the resource usage of the
+    process, or None where os.wait4 is not available."""
+    if not hasattr(os, "wait4"):
+        p.wait()
+        return None
+    _, status, rusage = os.wait4(p.pid, 0)
+    if os.WIFSIGNALED(status):
+        p.returncode = -os.WTERMSIG(status)
+    else:
+        p.returncode = os.WEXITSTATUS(status)
+    return rusage
+
+
+def maxrss_bytes(rusage):
+    """Returns the peak resident set size of RUSAGE in bytes, which Linux
+    gives in kilobytes."""
+    if sys.platform == "darwin":
+        return rusage.ru_maxrss
+    return rusage.ru_maxrss * 1024
+
+
+def process_stats(start, progress=None, rusage=None, duration=None):
+    """Returns the statistics of a process started at START, according to
+    time.perf_counter(), and done now. The speed is the one reported by
+    ffmpeg, or else DURATION over the wall time."""
+    wall = time.perf_counter() - start
+    stats = {"wall": wall, "speed": None, "fps": None, "bitrate": None}
+    if progress is not None:
+        stats["speed"] = progress.speed
+        stats["fps"] = progress.fps
+        stats["bitrate"] = progress.bitrate
+    if stats["speed"] is None and duration and wall:
+        stats["speed"] = duration / wall
+    stats["user"] = rusage.ru_utime if rusage else None
+    stats["system"] = rusage.ru_stime if rusage else None
+    stats["maxrss"] = maxrss_bytes(rusage) if rusage else None
+    return stats
+
+
+def self_usage():
+    return resource.getrusage(resource.RUSAGE_SELF)
+
+
+def self_stats(start, usage, duration=None):
+    """Returns the statistics of the work done by this process since START
+    and USAGE, its self_usage() at that time."""
+    stats = process_stats(start, duration=duration)
+    current = self_usage()
+    stats["user"] = current.ru_utime - usage.ru_utime
+    stats["system"] = current.ru_stime - usage.ru_stime
+    return stats
+
+
+def merge_stats(commands):
+    """Returns the statistics of a job made of the (stats, duration) pairs
+    of COMMANDS, run one after the other. Times are summed, the peak RSS
+    is the highest one and the speed is the one of the whole job. The frame
+    rate and bitrate are the ones of the last command reporting them."""
+    commands = [(s, d) for s, d in commands if s is not None]
+    if not commands:
+        return None
+    if len(commands) == 1:
+        return commands[0][0]
+    merged = {"speed": None, "fps": None, "bitrate": None}
+    for key in ("wall", "user", "system"):
+        values = [s[key] for s, _ in commands]
+        merged[key] = None if None in values else sum(values)
+    rss = [s["maxrss"] for s, _ in commands if s["maxrss"] is not None]
+    merged["maxrss"] = max(rss) if rss else None
+    # Time each command would take at its speed
+    times = [d / s["speed"] for s, d in commands if d and s["speed"]]
+    total = sum(d for s, d in commands if d and s["speed"])
+    if times and sum(times):
+        merged["speed"] = total / sum(times)
+    for key in ("fps", "bitrate"):
+        for stats, _ in commands:
+            if stats[key] is not None:
+                merged[key] = stats[key]
+    return merged
+
+
+class Report:
+    """Per chapter report written to PATH, as CSV when it ends with .csv
+    and as JSON otherwise."""
+
+    def __init__(self, path):
+        self._path = path
+        self._entries = []
+
+    def get_path(self):
+        return self._path
+
+    def add(self, job, outfile, engine, stats=None, size=None):
+        """Adds the entry of the extraction JOB, which wrote OUTFILE."""
+        chap, _, _, filename = job
+        entry = dict.fromkeys(REPORT_FIELDS)
+        entry.update(stats or {})
+        entry["file"] = filename
+        entry["chapter"] = chap["id"] + 1
+        entry["title"] = chap["tags"]["title"]
+        entry["output"] = outfile
+        entry["engine"] = engine
+        if chap.get("end_time") is not None:
+            entry["duration"] = float(chap["end_time"]) - float(
+                chap["start_time"]
+            )
+        entry["size"] = size
+        self._entries += [entry]
+
+    def get_entries(self):
+        return self._entries
+
+    def write(self):
+        if self._path.lower().endswith(".csv"):
+            with open(self._path, "w", newline="") as f:
+                writer = csv.DictWriter(f, REPORT_FIELDS)
+                writer.writeheader()
+                writer.writerows(self._entries)
+        else:
+            with open(self._path, "w") as f:
+                json.dump(self._entries, f, indent=2)
+                f.write("\n")
+        vprint("[chaps] Report written to {}".format(self._path))
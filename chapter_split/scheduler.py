@@ -0,0 +1,114 @@
+"""Scheduler module"""
+import heapq
+import itertools
+import os
+import threading
+from contextlib import contextmanager
+
+
+def chapter_duration(chap):
+    return float(chap["end_time"]) - float(chap["start_time"])
+
+
+def estimate_cost(chap, fmt):
+    """Estimates the cost of extracting CHAP as its duration times the
+    bitrate of the file, that is its size in bits."""
+    try:
+        bit_rate = float(fmt.get("bit_rate", 1))
+    except (TypeError, ValueError):
+        bit_rate = 1
+    return chapter_duration(chap) * bit_rate
+
+
+def schedule_jobs(jobs, policy="longest"):
+    """Returns the indexes of JOBS, (chap, metadata, fmt, filename) tuples,
+    in the order they should be started.
+
+    With the "longest" policy, jobs are started longest first, so that no
+    long job is left running alone at the end of the run while the other
+    workers are idle. The "file" policy keeps the file order."""
+    indexes = list(range(len(jobs)))
+    if policy == "file":
+        return indexes
+    costs = [estimate_cost(job[0], job[2]) for job in jobs]
+    return sorted(indexes, key=lambda i: -costs[i])
+
+
+def makespan_bound(costs, njobs):
+    """Returns a lower bound of the time needed to run jobs of COSTS on
+    NJOBS workers."""
+    if not costs:
+        return 0
+    return max(max(costs), sum(costs) / njobs)
+
+
+def makespan(costs, njobs):
+    """Returns the time needed to run jobs of COSTS, in the given order,
+    each one on the first available of NJOBS workers."""
+    workers = [0] * njobs
+    for cost in costs:
+        i = workers.index(min(workers))
+        workers[i] += cost
+    return max(workers) if costs else 0
+
+
+def available_cores():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def thread_budget(cores, njobs, running, waiting):
+    """Returns the number of threads to give to a job starting while
+    RUNNING jobs (itself included) are running and WAITING ones are still
+    to be started, at most NJOBS jobs running at a time.
+
+    The CORES are shared among the jobs expected to run concurrently, so
+    that the last jobs of a run get the cores left idle by the others."""
+    concurrent = max(1, min(njobs, running + waiting))
+    return max(1, cores // concurrent)
+
+
+def with_threads(cmd, threads):
+    """Returns the single output ffmpeg command CMD limited to THREADS
+    threads for decoding, filtering and encoding."""
+    i = cmd.index("-i")
+    nb = str(threads)
+    return (
+        cmd[:i]
+        + ["-threads", nb, "-filter_threads", nb]
+        + cmd[i:-1]
+        + ["-threads", nb]
+        + cmd[-1:]
+    )
+
+
+class SlotLimiter:
+    """Lets at most SLOTS threads hold a slot at a time. A freed slot goes
+    to the waiting thread of highest priority, the first one to ask for it
+    among those of the same priority."""
+
+    def __init__(self, slots):
+        self._free = slots
+        self._condition = threading.Condition()
+        self._waiting = []
+        self._counter = itertools.count()
+
+    @contextmanager
+    def slot(self, priority=0):
+        ticket = (-priority, next(self._counter))
+        with self._condition:
+            heapq.heappush(self._waiting, ticket)
+            while not self._free or self._waiting[0] != ticket:
+                self._condition.wait()
+            heapq.heappop(self._waiting)
+            self._free -= 1
+            # The next waiter may get a slot too
+            self._condition.notify_all()
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._free += 1
+                self._condition.notify_all()
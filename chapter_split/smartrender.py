@@ -0,0 +1,156 @@
+"""Smart render module
+
+The video of a smart rendered chapter is made of up to three segments:
+the partial GOP at its start and the one at its end are re-encoded, so
+that the cuts are frame accurate, and the whole GOPs in between are
+stream copied. The video segments are then joined with ffmpeg's concat
+demuxer, and the other streams are cut once for the whole chapter and
+muxed with them.
+
+Each segment has its own parameter sets, which are written in the stream
+before every keyframe, since the joined output only keeps those of the
+first segment in its header."""
+import os
+
+from .util import msec_to_hour
+
+from .journal import partial_name
+
+CONCAT_INPUT_OPTS = ["-f", "concat", "-safe", "0"]
+
+# Only the video is written to the segments
+SEGMENT_MAP = ["-map", "0:v:0"]
+
+# Options of the encoders repeating the parameter sets before keyframes,
+# by codec
+REPEAT_HEADERS = {"h264": "-x264-params", "hevc": "-x265-params"}
+
+# Encoder profiles of the profiles ffprobe gives, by codec. The edge
+# segments are only re-encoded for the codecs listed here.
+PROFILES = {
+    "h264": {
+        "Baseline": "baseline",
+        "Constrained Baseline": "baseline",
+        "Main": "main",
+        "High": "high",
+        "High 10": "high10",
+        "High 4:2:2": "high422",
+        "High 4:4:4 Predictive": "high444",
+    },
+    "hevc": {"Main": "main", "Main 10": "main10"},
+}
+
+# Extensions of the outputs written by the mov muxer, which keeps the time
+# base of the video stream only when told to
+MOV_EXTENSIONS = {".mp4", ".m4v", ".m4a", ".m4b", ".mov", ".3gp"}
+
+
+def plan_segments(start, end, keyframes, tolerance=0.001):
+    """Returns the (copy, start, end) segments, in seconds, of the chapter
+    going from START to END given the sorted KEYFRAMES of the file. COPY
+    tells whether the segment can be stream copied."""
+    inner = [k for k in keyframes if start - tolerance <= k <= end + tolerance]
+    if len(inner) < 2:
+        # Less than a whole GOP, everything is re-encoded
+        return [(False, start, end)]
+    first, last = inner[0], inner[-1]
+    segments = []
+    if first - start > tolerance:
+        segments += [(False, start, first)]
+    segments += [(True, first, last)]
+    if end - last > tolerance:
+        segments += [(False, last, end)]
+    return segments
+
+
+def video_stream(jinfos):
+    """Returns the ffprobe infos of the first video stream, or None."""
+    for stream in jinfos.get("streams", []):
+        if stream.get("codec_type") == "video":
+            return stream
+    return None
+
+
+def _level(codec, level):
+    """Returns the encoder level of the ffprobe LEVEL of CODEC, or None."""
+    if level is None or level <= 0:
+        return None
+    if codec == "h264":
+        return "{:.1f}".format(level / 10)
+    # HEVC levels are given times 30
+    return "{:g}".format(level / 30)
+
+
+def encode_options(stream, ext=None):
+    """Returns the options re-encoding the video STREAM with the same
+    codec, pixel format, profile, level and time base, so that the encoded
+    segments can be joined to the copied ones in an output of extension
+    EXT. Returns None when they can not be matched."""
+    codec = stream.get("codec_name")
+    if codec not in PROFILES:
+        return None
+    opts = ["-codec:v", codec]
+    if stream.get("pix_fmt"):
+        opts += ["-pix_fmt", stream["pix_fmt"]]
+    if stream.get("profile"):
+        profile = PROFILES[codec].get(stream["profile"])
+        if profile is None:
+            return None
+        opts += ["-profile:v", profile]
+    params = ["repeat-headers=1"]
+    level = _level(codec, stream.get("level"))
+    if level is not None and codec == "h264":
+        opts += ["-level:v", level]
+    elif level is not None:
+        params = ["level-idc={}".format(level)] + params
+    opts += [REPEAT_HEADERS[codec], ":".join(params)]
+    time_base = stream.get("time_base", "")
+    if ext in MOV_EXTENSIONS and time_base.startswith("1/"):
+        opts += ["-video_track_timescale", time_base[2:]]
+    return opts
+
+
+def segment_options(segment, stream=None, ext=None):
+    """Returns the (input_opts, output_opts) pair extracting the video of
+    SEGMENT.
+
+    Copied segments start on a keyframe, so the fast input seek is exact
+    for them. Re-encoded ones use the encode_options() of the video STREAM,
+    so that they can be concatenated with the copied ones."""
+    copy, start, end = segment
+    ss = msec_to_hour(int(round(start * 1000)))
+    opts = ["-t", "{:.3f}".format(end - start)] + SEGMENT_MAP
+    if copy:
+        opts += ["-codec", "copy", "-bsf:v", "dump_extra"]
+        return ["-noaccurate_seek", "-ss", ss], opts
+    return ["-accurate_seek", "-ss", ss], opts + encode_options(stream, ext)
+
+
+def join_options(start, end):
+    """Returns the (input_opts, output_opts) pair muxing the joined video
+    segments, the first input, with the streams other than the video of
+    the source, the second input, cut once from START to END."""
+    ss = msec_to_hour(int(round(start * 1000)))
+    input_opts = ["-ss", ss, "-t", "{:.3f}".format(end - start)]
+    opts = ["-map", "0:v", "-map", "1", "-map", "-1:v", "-map_metadata", "1"]
+    return input_opts, opts + ["-codec", "copy"]
+
+
+def segment_name(outfile, index):
+    """Returns the temporary name of the INDEXth segment of OUTFILE."""
+    stem, ext = os.path.splitext(outfile)
+    return partial_name("{}.{:d}{}".format(stem, index, ext))
+
+
+def concat_list_name(outfile):
+    stem, _ = os.path.splitext(partial_name(outfile))
+    return stem + ".concat"
+
+
+def write_concat_list(path, segments):
+    """Writes the concat demuxer script joining the SEGMENTS files. They
+    are given relatively to the script, which is in the same directory."""
+    with open(path, "w") as f:
+        for segment in segments:
+            name = os.path.basename(segment).replace("'", "'\\''")
+            f.write("file '{}'\n".format(name))
@@ -1,5 +1,10 @@
 import os
 import math
+import shutil
+import signal
+import sys
+import threading
+import time
 
 
 class StatusException(Exception):
@@ -70,11 +75,16 @@ class Progress(Element):
 
 
 class Piecewise_Progress(Element):
+    """Progress bar made of NB_PIECES pieces, each one having its own
+    progress between 0 and 1 (True standing for 1). Pieces are given a
+    share of the bar proportional to their WEIGHTS, if any."""
+
     def __init__(
         self,
         nb_pieces=0,
         value=[],
         *,
+        weights=None,
         width=0,
         fit=Element.MAXIMIZED,
         name=None
@@ -82,25 +92,58 @@ class Piecewise_Progress(Element):
         super().__init__(value, width=width, fit=fit, name=name)
         self._nb_pieces = nb_pieces
         self._value = [False for i in range(nb_pieces)]
+        if weights is None or sum(weights) <= 0:
+            weights = [1 for i in range(nb_pieces)]
+        if len(weights) != nb_pieces:
+            raise StatusException("There must be one weight per piece")
+        total = sum(weights)
+        self._bounds = []
+        acc = 0
+        for w in weights:
+            self._bounds += [(acc / total, (acc + w) / total)]
+            acc += w
 
     def set_value(self, id, value):
-        if not isinstance(value, bool):
-            raise StatusException("Value must be boolean")
+        if isinstance(value, bool):
+            pass
+        elif isinstance(value, (int, float)):
+            value = min(max(value, 0), 1)
+        else:
+            raise StatusException("Value must be boolean or a number")
         self._value[id] = value
 
     def set_all_values(self, value):
         for i in range(len(self._value)):
             self._value[i - 1] = value
 
+    def get_progress(self):
+        """Returns the overall progress, weighted by the pieces' weights."""
+        return sum(
+            (end - start) * float(v)
+            for v, (start, end) in zip(self._value, self._bounds)
+        )
+
+    def get_nb_done(self):
+        return len([v for v in self._value if v is True or v == 1])
+
     def __str__(self):
         w = self._width - 2
-        s = "["
-        for i in range(w):
-            p = i / w
-            k = math.floor(p * self._nb_pieces)
-            s += "#" if self._value[k] else "-"
-        s += "]"
-        return s
+
+        def cells(position):
+            # Number of cells whose center is before POSITION
+            return min(max(math.ceil(position * w - 0.5), 0), w)
+
+        parts = ["["]
+        for k, (start, end) in enumerate(self._bounds):
+            first = cells(start)
+            last = w if k == self._nb_pieces - 1 else cells(end)
+            done = cells(start + (end - start) * float(self._value[k]))
+            done = min(max(done, first), last)
+            parts += ["#" * (done - first), "-" * (last - done)]
+        if not self._bounds:
+            parts += ["-" * w]
+        parts += ["]"]
+        return "".join(parts)
 
 
 class Text(Element):
@@ -172,7 +215,7 @@ class Status:
         if width is not None:
             self._width = width
         else:
-            self._width, _ = os.get_terminal_size()
+            self._width = shutil.get_terminal_size().columns
         self._line = ""
         self._dynamic_width = dynamic_width
 
@@ -195,9 +238,16 @@ class Status:
     def get_elements(self):
         return self._elements
 
+    def set_width(self, width):
+        self._width = width
+        self._dynamic_width = False
+
+    def get_width(self):
+        return self._width
+
     def _update_width(self):
         if self._dynamic_width:
-            self._width, _ = os.get_terminal_size()
+            self._width = shutil.get_terminal_size().columns
 
     def build_line(self):
         self._update_width()
@@ -220,3 +270,84 @@ class Status:
     def __str__(self):
         self.build_line()
         return self._line
+
+
+class Renderer:
+    """Writes successive states of a Status on STREAM.
+
+    On a terminal, the line is redrawn in place at most once every
+    INTERVAL seconds, and only when it changed. The terminal width is
+    cached and only queried again after a SIGWINCH. When STREAM is not a
+    terminal, complete lines of WIDTH characters are written instead, at
+    most once every LOG_INTERVAL seconds."""
+
+    def __init__(
+        self, stream=None, interval=0.1, log_interval=10, width=80, tty=None
+    ):
+        self._stream = stream if stream is not None else sys.stdout
+        if tty is None:
+            try:
+                tty = self._stream.isatty()
+            except (AttributeError, ValueError):
+                tty = False
+        self._tty = tty
+        self._interval = interval if tty else log_interval
+        self._width = None if tty else width
+        self._last_time = None
+        self._last_line = None
+        self._previous_handler = None
+        if tty and hasattr(signal, "SIGWINCH"):
+            try:
+                self._previous_handler = signal.signal(
+                    signal.SIGWINCH, self._on_resize
+                )
+            except ValueError:
+                # Signal handlers can only be set from the main thread
+                pass
+
+    def _on_resize(self, signum, frame):
+        self._width = None
+        if callable(self._previous_handler):
+            self._previous_handler(signum, frame)
+
+    def is_tty(self):
+        return self._tty
+
+    def get_width(self):
+        if self._width is None:
+            self._width = shutil.get_terminal_size().columns
+        return self._width
+
+    def update(self, status, force=False):
+        now = time.monotonic()
+        if (
+            not force
+            and self._last_time is not None
+            and now - self._last_time < self._interval
+        ):
+            return
+        status.set_width(self.get_width())
+        line = str(status)
+        if line == self._last_line:
+            return
+        self._last_time = now
+        self._last_line = line
+        if self._tty:
+            self._stream.write("{}\r".format(line))
+        else:
+            self._stream.write("{}\n".format(line))
+        self._stream.flush()
+
+    def finish(self, status):
+        self.update(status, force=True)
+        if self._tty:
+            self._stream.write("\n")
+            self._stream.flush()
+        self._last_time = None
+        self._last_line = None
+
+    def close(self):
+        if self._previous_handler is not None:
+            if threading.current_thread() is threading.main_thread():
+                signal.signal(signal.SIGWINCH, self._previous_handler)
+            self._previous_handler = None
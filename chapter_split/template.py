@@ -0,0 +1,156 @@
+"""Output template module
+
+Compiles the -o template once into its literal parts and fields, which
+are then expanded for every chapter without scanning the template again.
+Fields take a printf conversion, as in youtube-dl, e.g.
+%(chapter-index)03d. Sequences which are not a known field are kept as
+they are."""
+import functools
+import os
+import re
+from pathlib import Path
+
+from .util import sec_to_hour, sanitize_filename
+
+_FIELD_RE = re.compile(
+    r"%\((?P<name>[a-z-]+)\)(?P<flags>[-#0 +]*\d*(?:\.\d+)?)"
+    r"(?P<conversion>[sdiouxXeEfFgG])"
+)
+
+# Fields only given as strings
+STRING_FIELDS = {"chapter-title", "title", "ext"}
+
+# Fields given as numbers, or as strings with the "s" conversion
+NUMBER_FIELDS = {
+    "chapter-id",
+    "chapter-index",
+    "chapter-start",
+    "chapter-duration",
+}
+
+# Value of a field which is not known, such as the duration of the last
+# chapter read from the standard input
+NOT_AVAILABLE = "NA"
+
+
+class TemplateException(Exception):
+    pass
+
+
+@functools.lru_cache(maxsize=256)
+def _file_fields(filename, title):
+    path = Path(filename)
+    return {
+        "title": path.stem if title is None else title,
+        "ext": path.suffix[1:],
+    }
+
+
+def _number(name, chapter):
+    if name == "chapter-id":
+        return chapter["id"]
+    if name == "chapter-index":
+        return chapter["id"] + 1
+    if name == "chapter-start":
+        return float(chapter["start_time"])
+    end = chapter.get("end_time")
+    if end is None:
+        return None
+    return float(end) - float(chapter["start_time"])
+
+
+def _string(name, chapter, file_fields):
+    if name in file_fields:
+        return file_fields[name]
+    if name == "chapter-title":
+        return chapter["tags"]["title"]
+    value = _number(name, chapter)
+    if value is None:
+        return NOT_AVAILABLE
+    if name in ("chapter-start", "chapter-duration"):
+        return sec_to_hour(value)
+    return str(value)
+
+
+class OutputTemplate:
+    """Output filename template, compiled from TEMPLATE."""
+
+    def __init__(self, template):
+        self.template = template
+        # Literal strings and (name, printf specification) fields, the
+        # specification being None for a plain %(name)s
+        self._parts = []
+        position = 0
+        for matched in _FIELD_RE.finditer(template):
+            name, conversion = matched.group("name", "conversion")
+            if name not in STRING_FIELDS and name not in NUMBER_FIELDS:
+                continue
+            if conversion != "s" and name in STRING_FIELDS:
+                raise TemplateException(
+                    '"{}" can not be used in the output template, '
+                    "%({})s is a string".format(matched.group(0), name)
+                )
+            if matched.start() > position:
+                self._parts += [template[position : matched.start()]]
+            spec = "%" + matched.group("flags") + conversion
+            self._parts += [(name, None if spec == "%s" else spec)]
+            position = matched.end()
+        if position < len(template):
+            self._parts += [template[position:]]
+        self._file_fields = any(
+            part[0] in ("title", "ext")
+            for part in self._parts
+            if isinstance(part, tuple)
+        )
+
+    def expand(self, chapter, metadata, fmt):
+        """Returns the filename of CHAPTER, of the file of METADATA and
+        format FMT, before sanitization."""
+        file_fields = {}
+        if self._file_fields:
+            file_fields = _file_fields(fmt["filename"], metadata.get("title"))
+        parts = []
+        for part in self._parts:
+            if isinstance(part, str):
+                parts += [part]
+                continue
+            name, spec = part
+            if spec is None or spec[-1] == "s":
+                value = _string(name, chapter, file_fields)
+                parts += [value if spec is None else spec % value]
+            else:
+                value = _number(name, chapter)
+                parts += [NOT_AVAILABLE if value is None else spec % value]
+        return "".join(parts)
+
+    def format(self, chapter, metadata, fmt, restricted=False):
+        """Returns the sanitized filename of CHAPTER."""
+        name = self.expand(chapter, metadata, fmt)
+        return sanitize_filename(name, restricted)
+
+
+@functools.lru_cache(maxsize=16)
+def compile_template(template):
+    """Returns the OutputTemplate of TEMPLATE, which is only compiled
+    once."""
+    return OutputTemplate(template)
+
+
+def gen_filename(template, chapter, metadata, fmt):
+    """Returns the filename TEMPLATE gives to CHAPTER, before
+    sanitization."""
+    return compile_template(template).expand(chapter, metadata, fmt)
+
+
+def find_collisions(names):
+    """Returns the indexes of the NAMES which are the same path, by the
+    first of these names."""
+    paths = {}
+    for index, name in enumerate(names):
+        path = os.path.normcase(os.path.abspath(name))
+        paths.setdefault(path, []).append(index)
+    return {
+        names[indexes[0]]: indexes
+        for indexes in paths.values()
+        if len(indexes) > 1
+    }
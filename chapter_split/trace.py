@@ -0,0 +1,207 @@
+"""Trace module
+
+Records timestamped spans of the phases of a run and of each chapter job
+in the Chrome trace event format, which chrome://tracing and Perfetto
+load. Events are appended to the trace file as soon as they end, by the
+main process and by the pool workers alike, so that the trace of an
+interrupted run can still be loaded.
+
+Every function is a no-op when no trace was started."""
+import cProfile
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+_TRACER = None
+
+
+def now():
+    """Returns the current time, in microseconds, of a clock shared by
+    every process of the run."""
+    return time.perf_counter() * 1000000
+
+
+class Tracer:
+    """Writes trace events to PATH.
+
+    The file is opened in append mode and each event is written with a
+    single write, so that the forked workers share it safely. The events
+    form a JSON array which is only terminated by close(), the trace event
+    format allowing it to be left open."""
+
+    def __init__(self, path, attach=False):
+        flags = os.O_WRONLY | os.O_CREAT | os.O_APPEND
+        if not attach:
+            flags |= os.O_TRUNC
+        self._fd = os.open(path, flags, 0o666)
+        self._path = path
+        # Only the process which started the trace closes the array
+        self._pid = None if attach else os.getpid()
+        self._named = set()
+        if not attach:
+            os.write(self._fd, b"[\n")
+
+    def get_path(self):
+        return self._path
+
+    def _write(self, event, last=False):
+        data = json.dumps(event) + ("\n]\n" if last else ",\n")
+        os.write(self._fd, data.encode("utf-8"))
+
+    def event(self, event):
+        pid = os.getpid()
+        if pid not in self._named:
+            self._named.add(pid)
+            name = "chaps" if pid == self._pid else "chaps worker"
+            self._write(
+                {
+                    "name": "process_name",
+                    "ph": "M",
+                    "pid": pid,
+                    "args": {"name": name},
+                }
+            )
+        event.setdefault("pid", pid)
+        event.setdefault("tid", threading.get_ident())
+        self._write(event)
+
+    def close(self):
+        """Terminates the trace. The workers only close their copy of the
+        file."""
+        if os.getpid() == self._pid:
+            event = {"name": "end", "ph": "i", "ts": now(), "s": "g"}
+            event["pid"] = self._pid
+            self._write(event, last=True)
+        os.close(self._fd)
+
+
+def start_trace(path):
+    global _TRACER
+    _TRACER = Tracer(path)
+
+
+def attach_trace(path):
+    """Appends the events of this process to the trace started at PATH by
+    another one, which is how spawned workers trace."""
+    global _TRACER
+    _TRACER = Tracer(path, attach=True)
+
+
+def get_trace_path():
+    return _TRACER.get_path() if _TRACER is not None else None
+
+
+def stop_trace():
+    global _TRACER
+    if _TRACER is not None:
+        _TRACER.close()
+        _TRACER = None
+
+
+def is_tracing():
+    return _TRACER is not None
+
+
+def complete(name, start, end=None, cat="phase", tid=None, **args):
+    """Records the NAME span going from START to END, now by default."""
+    if _TRACER is None:
+        return
+    if end is None:
+        end = now()
+    event = {"name": name, "cat": cat, "ph": "X", "ts": start}
+    event["dur"] = end - start
+    if tid is not None:
+        event["tid"] = tid
+    if args:
+        event["args"] = args
+    _TRACER.event(event)
+
+
+def instant(name, cat="phase", tid=None, **args):
+    """Records the NAME instant event."""
+    if _TRACER is None:
+        return
+    event = {"name": name, "cat": cat, "ph": "i", "ts": now(), "s": "t"}
+    if tid is not None:
+        event["tid"] = tid
+    if args:
+        event["args"] = args
+    _TRACER.event(event)
+
+
+@contextmanager
+def span(name, cat="phase", tid=None, **args):
+    """Records the NAME span lasting as long as the context."""
+    if _TRACER is None:
+        yield
+        return
+    start = now()
+    try:
+        yield
+    finally:
+        complete(name, start, cat=cat, tid=tid, **args)
+
+
+class CommandTrace:
+    """Spans of the life of an external command: "spawn" until the process
+    is created, "startup" until its first progress report, "encode" until
+    its output is closed and "exit" until it is waited for. The spans are
+    recorded on TID, the current thread by default."""
+
+    def __init__(self, output, tid=None):
+        self._enabled = _TRACER is not None
+        self._output = output
+        self._tid = tid
+        self._last = now() if self._enabled else None
+        self._phase = "spawn"
+
+    def _next(self, phase):
+        if not self._enabled:
+            return
+        end = now()
+        complete(
+            self._phase,
+            self._last,
+            end,
+            cat="ffmpeg",
+            tid=self._tid,
+            output=self._output,
+        )
+        self._last = end
+        self._phase = phase
+
+    def spawned(self):
+        self._next("startup")
+
+    def progress(self):
+        if self._phase == "startup":
+            self._next("encode")
+            instant("first progress", "ffmpeg", self._tid, output=self._output)
+
+    def closed(self):
+        self._next("exit")
+
+    def exited(self):
+        self._next(None)
+
+
+def start_profile():
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+
+def stop_profile(profiler, path):
+    """Stops PROFILER and writes its statistics to PATH, which pstats
+    loads, or prints the most expensive calls on the standard error when
+    PATH is "-"."""
+    profiler.disable()
+    if path != "-":
+        profiler.dump_stats(path)
+        return
+    stats = pstats.Stats(profiler, stream=sys.stderr)
+    stats.sort_stats("cumulative").print_stats(30)
@@ -1,12 +1,25 @@
 """Utility module"""
+import io
 import math
 import re
 import itertools
 import sys
-from pathlib import Path
 from shlex import quote
 
 
+class FFmpegException(Exception):
+    def __init__(self, cmd, returncode, message):
+        # Keep every argument in self.args so that the exception can be
+        # pickled back from pool workers.
+        super().__init__(cmd, returncode, message)
+        self.cmd = cmd
+        self.returncode = returncode
+        self.message = message
+
+    def __str__(self):
+        return self.message
+
+
 def search_all(pat, content):
     reg = re.compile(pat, re.MULTILINE)
     found = []
@@ -31,6 +44,9 @@ def search_iter(pat, content):
         yield matched.group(0)
 
 
+# Input name standing for the standard input
+STDIN = "-"
+
 ACCENT_CHARS = dict(
     zip(
         "ÂÃÄÀÁÅÆÇÈÉÊËÌÍÎÏÐÑÒÓÔÕÖŐØŒÙÚÛÜŰÝÞßàáâãäåæçèéêëìíîïðñòóôõöőøœùúûüűýþÿ",
@@ -70,7 +86,44 @@ def msec_to_hour(MSEC):
     SEC = SEC % 60
     PSEC = math.floor(SEC)
     PMSEC = math.floor((SEC - PSEC) * 1000)
-    return "{:02d}:{:02d}:{:02d}.{:d}".format(HOUR, MIN, PSEC, PMSEC)
+    return "{:02d}:{:02d}:{:02d}.{:03d}".format(HOUR, MIN, PSEC, PMSEC)
+
+
+def _replace_insane(char, restricted):
+    if restricted and char in ACCENT_CHARS:
+        return ACCENT_CHARS[char]
+    if char == "?" or ord(char) < 32 or ord(char) == 127:
+        return ""
+    elif char == '"':
+        return "" if restricted else "'"
+    elif char == ":":
+        return "_-" if restricted else " -"
+    elif char in "\\/|*<>":
+        return "_"
+    if restricted and (char in "!&'()[]{}$;`^,#" or char.isspace()):
+        return "_"
+    if restricted and ord(char) > 127:
+        return "_"
+    return char
+
+
+class _SanitizeTable(dict):
+    """str.translate() table of the replacements of sanitize_filename(),
+    each character being looked up once and then kept."""
+
+    def __init__(self, restricted):
+        super().__init__()
+        self._restricted = restricted
+
+    def __missing__(self, code):
+        replacement = _replace_insane(chr(code), self._restricted)
+        self[code] = replacement
+        return replacement
+
+
+_SANITIZE_TABLES = {False: _SanitizeTable(False), True: _SanitizeTable(True)}
+_TIMESTAMP_RE = re.compile(r"[0-9]+(?::[0-9]+)+")
+_UNDERSCORES_RE = re.compile(r"__+")
 
 
 def sanitize_filename(s, restricted=False, is_id=False):
@@ -79,32 +132,13 @@ def sanitize_filename(s, restricted=False, is_id=False):
     Set is_id if this is not an arbitrary string, but an ID that should be kept
     if possible.
     """
-
-    def replace_insane(char):
-        if restricted and char in ACCENT_CHARS:
-            return ACCENT_CHARS[char]
-        if char == "?" or ord(char) < 32 or ord(char) == 127:
-            return ""
-        elif char == '"':
-            return "" if restricted else "'"
-        elif char == ":":
-            return "_-" if restricted else " -"
-        elif char in "\\/|*<>":
-            return "_"
-        if restricted and (char in "!&'()[]{}$;`^,#" or char.isspace()):
-            return "_"
-        if restricted and ord(char) > 127:
-            return "_"
-        return char
-
     # Handle timestamps
-    s = re.sub(
-        r"[0-9]+(?::[0-9]+)+", lambda m: m.group(0).replace(":", "_"), s
-    )
-    result = "".join(map(replace_insane, s))
+    if ":" in s:
+        s = _TIMESTAMP_RE.sub(lambda m: m.group(0).replace(":", "_"), s)
+    result = s.translate(_SANITIZE_TABLES[bool(restricted)])
     if not is_id:
-        while "__" in result:
-            result = result.replace("__", "_")
+        if "__" in result:
+            result = _UNDERSCORES_RE.sub("_", result)
         result = result.strip("_")
         # Common case of "Foreign band name - English song title"
         if restricted and result.startswith("-_"):
@@ -117,21 +151,6 @@ def sanitize_filename(s, restricted=False, is_id=False):
     return result
 
 
-def gen_filename(template, chapter, metadata, fmt):
-    filename = template
-    filename = filename.replace("%(chapter-title)s", chapter["tags"]["title"])
-    filename = filename.replace("%(chapter-id)s", str(chapter["id"]))
-    filename = filename.replace("%(chapter-index)s", str(chapter["id"] + 1))
-    if "title" in metadata:
-        filename = filename.replace("%(title)s", metadata["title"])
-    else:
-        file_title = Path(fmt["filename"]).stem
-        filename = filename.replace("%(title)s", file_title)
-    extention = Path(fmt["filename"]).suffix[1:]  # remove dot
-    filename = filename.replace("%(ext)s", extention)
-    return filename
-
-
 def get_filesystem_encoding():
     encoding = sys.getfilesystemencoding()
     return encoding if encoding is not None else "utf-8"
@@ -163,6 +182,39 @@ def yes_no_p(message, default="N"):
             return False
 
 
+_DURATION_RE = re.compile(
+    r"(?:(?:(?:(?P<days>[0-9]+):)?(?P<hours>[0-9]+):)?(?P<mins>[0-9]+):)?(?P<secs>[0-9]+)(?P<ms>\.[0-9]+)?Z?$"  # noqa
+)
+_ISO_DURATION_RE = re.compile(
+    r"""(?ix)(?:P?
+        (?:
+            [0-9]+\s*y(?:ears?)?\s*
+        )?
+        (?:
+            [0-9]+\s*m(?:onths?)?\s*
+        )?
+        (?:
+            [0-9]+\s*w(?:eeks?)?\s*
+        )?
+        (?:
+            (?P<days>[0-9]+)\s*d(?:ays?)?\s*
+        )?
+        T)?
+        (?:
+            (?P<hours>[0-9]+)\s*h(?:ours?)?\s*
+        )?
+        (?:
+            (?P<mins>[0-9]+)\s*m(?:in(?:ute)?s?)?\s*
+        )?
+        (?:
+            (?P<secs>[0-9]+)(?P<ms>\.[0-9]+)?\s*s(?:ec(?:ond)?s?)?\s*
+        )?Z?$"""
+)
+_HOURS_MINS_RE = re.compile(
+    r"(?i)(?:(?P<hours>[0-9.]+)\s*(?:hours?)|(?P<mins>[0-9.]+)\s*(?:mins?\.?|minutes?)\s*)Z?$"  # noqa
+)
+
+
 def parse_duration(s):
     if not isinstance(s, str):
         return None
@@ -170,46 +222,15 @@ def parse_duration(s):
     s = s.strip()
 
     days, hours, mins, secs, ms = [None] * 5
-    m = re.match(
-        r"(?:(?:(?:(?P<days>[0-9]+):)?(?P<hours>[0-9]+):)?(?P<mins>[0-9]+):)?(?P<secs>[0-9]+)(?P<ms>\.[0-9]+)?Z?$",  # noqa
-        s,
-    )
+    m = _DURATION_RE.match(s)
     if m:
         days, hours, mins, secs, ms = m.groups()
     else:
-        m = re.match(
-            r"""(?ix)(?:P?
-                (?:
-                    [0-9]+\s*y(?:ears?)?\s*
-                )?
-                (?:
-                    [0-9]+\s*m(?:onths?)?\s*
-                )?
-                (?:
-                    [0-9]+\s*w(?:eeks?)?\s*
-                )?
-                (?:
-                    (?P<days>[0-9]+)\s*d(?:ays?)?\s*
-                )?
-                T)?
-                (?:
-                    (?P<hours>[0-9]+)\s*h(?:ours?)?\s*
-                )?
-                (?:
-                    (?P<mins>[0-9]+)\s*m(?:in(?:ute)?s?)?\s*
-                )?
-                (?:
-                    (?P<secs>[0-9]+)(?P<ms>\.[0-9]+)?\s*s(?:ec(?:ond)?s?)?\s*
-                )?Z?$""",
-            s,
-        )
+        m = _ISO_DURATION_RE.match(s)
         if m:
             days, hours, mins, secs, ms = m.groups()
         else:
-            m = re.match(
-                r"(?i)(?:(?P<hours>[0-9.]+)\s*(?:hours?)|(?P<mins>[0-9.]+)\s*(?:mins?\.?|minutes?)\s*)Z?$",  # noqa
-                s,
-            )
+            m = _HOURS_MINS_RE.match(s)
             if m:
                 hours, mins = m.groups()
             else:
@@ -229,50 +250,89 @@ def parse_duration(s):
     return duration
 
 
-def extract_chapters_txt(description, duration):
-    if not description:
-        return None
-    chapter_lines = search_all(r"^.*(((\d|)\d:|)\d|)\d:\d\d.*$", description,)
-    if not chapter_lines:
+def parse_progress_line(line):
+    """Returns the (key, value) pair of a line written by ffmpeg's
+    -progress option."""
+    key, _, value = line.strip().partition("=")
+    return key, value
+
+
+# Time point of a line of a chapter file, e.g. 1:23:45 or 4:56
+_TIME_POINT_RE = re.compile(r"(?:(?:\d?\d:)?\d)?\d:\d\d")
+_LINK_RE = re.compile(r"<a[^>]+>[^<]+</a>")
+_SPACES_RE = re.compile(r"\s+")
+
+
+def _timed_lines(lines):
+    """Yields the (line without its time points, start time) of the LINES
+    giving a time point."""
+    search = _TIME_POINT_RE.search
+    for line in lines:
+        if ":" not in line:
+            continue
+        if line.endswith("\n"):
+            line = line[:-1]
+        matched = search(line)
+        if matched is None:
+            continue
+        # The first time point is removed as found, the others by sub()
+        name = line[: matched.start()]
+        rest = line[matched.end() :]
+        if ":" in rest:
+            rest = _TIME_POINT_RE.sub("", rest)
+        yield name + rest, parse_duration(matched.group(0))
+
+
+def _txt_chapter(line, start_time, end_time, _id):
+    title = _LINK_RE.sub("", line).strip(" \t-")
+    title = _SPACES_RE.sub(" ", title)
+    end = math.ceil(1000 * end_time) if end_time is not None else None
+    return {
+        "start_time": start_time,
+        "start": math.ceil(1000 * start_time),
+        "end_time": end_time,
+        "end": end,
+        "id": _id,
+        "tags": {"title": title},
+    }
+
+
+def read_chapters_txt(lines, duration):
+    """Returns the chapters described by LINES, e.g. a file opened in text
+    mode, as extract_chapters_txt() does. The lines are read one at a time
+    and only as far as the chapters go, so that a long chapter file is
+    never held in memory."""
+    timed = _timed_lines(lines)
+    following = next(timed, None)
+    if following is None:
         return None
-    for idx, chap in enumerate(chapter_lines):
-        time_point = re.search(r"(((\d|)\d:|)\d|)\d:\d\d", chap).group(0)
-        chap_name = re.sub(r"(((\d|)\d:|)\d|)\d:\d\d", "", chap)
-        chapter_lines[idx] = (chap_name, time_point)
     chapters = []
-    _id = 0
-    for next_num, (chapter_line, time_point) in enumerate(
-        chapter_lines, start=1
-    ):
-        start_time = parse_duration(time_point)
+    while following is not None:
+        (line, start_time), following = following, next(timed, None)
         if start_time is None:
             continue
-        if start_time > duration:
+        if duration is not None and start_time > duration:
             break
-        end_time = (
-            duration
-            if next_num == len(chapter_lines)
-            else parse_duration(chapter_lines[next_num][1])
-        )
-        if end_time is None:
-            continue
-        if end_time > duration:
+        if following is None:
+            end_time = duration
+        else:
+            end_time = following[1]
+            if end_time is None:
+                continue
+        if duration is not None and end_time > duration:
             end_time = duration
-        if start_time > end_time:
+        if end_time is not None and start_time > end_time:
             break
-        chapter_title = re.sub(r"<a[^>]+>[^<]+</a>", "", chapter_line).strip(
-            " \t-"
-        )
-        chapter_title = re.sub(r"\s+", " ", chapter_title)
         chapters.append(
-            {
-                "start_time": start_time,
-                "start": math.ceil(1000 * start_time),
-                "end_time": end_time,
-                "end": math.ceil(1000 * end_time),
-                "id": _id,
-                "tags": {"title": chapter_title},
-            }
+            _txt_chapter(line, start_time, end_time, len(chapters))
         )
-        _id += 1
     return chapters
+
+
+def extract_chapters_txt(description, duration):
+    """Returns the chapters described by the lines of DESCRIPTION giving a
+    timestamp. A DURATION of None means that the length of the media is
+    unknown, the last chapter then has no end."""
+    if not description:
+        return None
+    return read_chapters_txt(io.StringIO(description), duration)
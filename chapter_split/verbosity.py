@@ -62,6 +62,10 @@ def set_level(level, debug=False):
         logger.setLevel(level)
 
 
+def get_level():
+    return logger.level
+
+
 vprint = logger.vprint
 vvprint = logger.vvprint
 vvvprint = logger.vvvprint
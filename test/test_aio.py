@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+
+from __future__ import unicode_literals
+
+# Allow direct execution
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chapter_split import aio
+from chapter_split.util import FFmpegException
+
+
+def fake_ffmpeg(script):
+    """Returns a command running SCRIPT, standing for ffmpeg."""
+    return ["sh", "-c", script, "out.mkv"]
+
+
+PROGRESS = fake_ffmpeg(
+    "printf 'out_time=00:00:05.000000\\nprogress=continue\\n"
+    "out_time=00:00:10.000000\\nprogress=end\\n'"
+)
+
+
+class TestAio(unittest.TestCase):
+    def test_run_ffmpeg(self):
+        fractions = []
+        stats = aio.run(aio.run_ffmpeg(PROGRESS, 20, fractions.append))
+        self.assertEqual(fractions, [0.25, 0.5])
+        self.assertTrue(stats["wall"] >= 0)
+        if hasattr(os, "wait4"):
+            # The process is reaped with its resource usage
+            self.assertIsNotNone(stats["user"])
+            self.assertGreater(stats["maxrss"], 0)
+
+    def test_run_ffmpeg_failure(self):
+        cmd = fake_ffmpeg("echo 'Invalid data' >&2; exit 3")
+        with self.assertRaises(FFmpegException) as context:
+            aio.run(aio.run_ffmpeg(cmd))
+        self.assertIn("Invalid data", str(context.exception))
+
+    def test_split(self):
+        events = []
+        running = []
+
+        def prepare(index, cmd, nb_running, waiting):
+            running.append(nb_running)
+            return cmd
+
+        aio.run(
+            aio.split(
+                [(PROGRESS, 10)] * 4,
+                njobs=2,
+                on_start=lambda i: events.append(("start", i)),
+                on_progress=lambda i, f: events.append(("progress", i, f)),
+                on_done=lambda i, stats: events.append(("done", i)),
+                order=[3, 2, 1, 0],
+                prepare=prepare,
+            )
+        )
+        starts = [event[1] for event in events if event[0] == "start"]
+        self.assertEqual(starts[:2], [3, 2])
+        self.assertEqual(sorted(starts), [0, 1, 2, 3])
+        self.assertIn(("progress", 1, 1.0), events)
+        self.assertEqual(len([e for e in events if e[0] == "done"]), 4)
+        self.assertTrue(max(running) <= 2)
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == "__main__":
+    main()
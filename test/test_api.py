@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+
+from __future__ import unicode_literals
+
+# Allow direct execution
+import multiprocessing
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chapter_split import SplitOptions, ffmpeg, plan, split
+from chapter_split.options import get_args, set_args, option_actions
+
+
+def make_infos(nb_chapters):
+    chapters = []
+    for i in range(nb_chapters):
+        chapters += [
+            {
+                "id": i,
+                "time_base": "1/1000",
+                "start": i * 10000,
+                "start_time": "{:.6f}".format(i * 10),
+                "end": (i + 1) * 10000,
+                "end_time": "{:.6f}".format((i + 1) * 10),
+                "tags": {"title": "Part {}".format(i + 1)},
+            }
+        ]
+    fmt = {
+        "filename": "book.mkv",
+        "duration": "{:.6f}".format(nb_chapters * 10),
+        "tags": {"title": "Book"},
+    }
+    return {"chapters": chapters, "format": fmt, "streams": []}
+
+
+class TestApi(unittest.TestCase):
+    def test_options(self):
+        options = SplitOptions(copy=True, jobs=4, no_native=True)
+        args = options.get_args()
+        self.assertTrue(args.codeccopy)
+        self.assertEqual(args.njobs, 4)
+        self.assertFalse(args.nativeslice)
+        self.assertTrue(options.get("no_native"))
+        self.assertEqual(options.get("seek"), "auto")
+        self.assertIsNone(args.startmethod)
+        with self.assertRaises(TypeError):
+            SplitOptions(bogus=1)
+        copied = SplitOptions.from_args(args)
+        self.assertEqual(copied.get_args(), args)
+        # The parser is only made once
+        self.assertIs(option_actions(), option_actions())
+
+    def test_split_spawn(self):
+        # The workers only get the options through the pool initializer
+        options = SplitOptions(
+            start_method="spawn",
+            jobs=2,
+            output="%(chapter-index)s.%(ext)s",
+            no_probe_cache=True,
+        )
+        set_args(options.get_args())
+        jobs = ffmpeg.make_jobs("book.mkv", make_infos(3))
+        sources, refs = ffmpeg.get_job_sources(jobs)
+        initargs = (None, None, sources, get_args(), 0, None)
+        context = multiprocessing.get_context("spawn")
+        with context.Pool(1, ffmpeg.init_child, initargs) as pool:
+            args = pool.apply(get_args)
+            chap, _, _, filename = pool.apply(ffmpeg.source_job, refs[2])
+        self.assertEqual(args.outtmpl, "%(chapter-index)s.%(ext)s")
+        self.assertEqual(args.startmethod, "spawn")
+        self.assertEqual(filename, "book.mkv")
+        self.assertEqual(chap.start_hour, "00:00:20.000")
+
+    def test_only_chapters(self):
+        options = SplitOptions(dry_run=True, only_chapters=[2])
+        outputs = split(["book.mkv"], options, infos=[make_infos(3)])
+        self.assertEqual(outputs, ["Book-Part 2.mkv"])
+
+    def test_plan(self):
+        infos = make_infos(3)
+        infos["format"]["bit_rate"] = "80000"
+        options = SplitOptions(jobs=2, no_probe_cache=True)
+        plan_ = plan("book.mkv", options, infos=infos)
+        self.assertEqual(
+            [entry["output"] for entry in plan_["chapters"]],
+            ["Book-Part 1.mkv", "Book-Part 2.mkv", "Book-Part 3.mkv"],
+        )
+        self.assertEqual(plan_["size"], 300000)
+        self.assertEqual(plan_["unknown_sizes"], 0)
+        self.assertEqual(len(plan_["commands"]), 3)
+        self.assertEqual(sorted(plan_["order"]), [0, 1, 2])
+        self.assertEqual(plan_["jobs"], 2)
+        self.assertTrue(all(fs["enough"] for fs in plan_["disk"]))
+        self.assertFalse(os.path.exists("Book-Part 1.mkv"))
+        # Three audio chapters of 10s re-encoded on two jobs
+        self.assertAlmostEqual(plan_["cpu_seconds"], 0.6)
+        self.assertAlmostEqual(plan_["makespan_seconds"], 0.4)
+
+    def test_plan_single_pass(self):
+        infos = make_infos(3)
+        infos["streams"] = [
+            {"codec_type": "video", "width": 1920, "height": 1080}
+        ]
+        options = SplitOptions(
+            jobs=2, copy=True, single_pass=True, no_probe_cache=True
+        )
+        plan_ = plan("book.mkv", options, infos=infos)
+        self.assertEqual(len(plan_["commands"]), 1)
+        self.assertEqual(plan_["order"], [0, 1, 2])
+        # A single process copies every chapter
+        self.assertAlmostEqual(plan_["cpu_seconds"], 0.03)
+        self.assertAlmostEqual(plan_["makespan_seconds"], 0.03)
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == "__main__":
+    main()
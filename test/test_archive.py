@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+
+from __future__ import unicode_literals
+
+# Allow direct execution
+import os
+import sys
+import tarfile
+import tempfile
+import unittest
+import zipfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chapter_split.archive import Archive, archive_format
+
+
+class TestArchive(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.tmpdir.name, name)
+
+    def fill(self, archive):
+        for name in ("b", "a"):
+            filename = self.path(".{}.part.mp3".format(name))
+            with open(filename, "wb") as f:
+                f.write(name.encode("ascii") * 10)
+            archive.add(filename, "book/{}.mp3".format(name))
+            self.assertFalse(os.path.exists(filename))
+
+    def test_archive_format(self):
+        self.assertEqual(archive_format("-"), ("tar", ""))
+        self.assertEqual(archive_format("out.ZIP"), ("zip", ""))
+        self.assertEqual(archive_format("out.tar.xz"), ("tar", "xz"))
+        self.assertEqual(archive_format("out.tgz"), ("tar", "gz"))
+        self.assertEqual(archive_format("out.gz", "zip"), ("zip", ""))
+        self.assertEqual(archive_format("-", "zip"), ("zip", ""))
+
+    def test_tar(self):
+        with Archive(self.path("out.tar.gz")) as archive:
+            self.fill(archive)
+        with tarfile.open(self.path("out.tar.gz")) as tar:
+            self.assertEqual(tar.getnames(), ["book/b.mp3", "book/a.mp3"])
+            self.assertEqual(tar.extractfile("book/a.mp3").read(), b"a" * 10)
+
+    def test_zip(self):
+        with Archive(self.path("out.zip")) as archive:
+            self.fill(archive)
+        with zipfile.ZipFile(self.path("out.zip")) as z:
+            self.assertEqual(z.namelist(), ["book/b.mp3", "book/a.mp3"])
+            self.assertEqual(z.read("book/b.mp3"), b"b" * 10)
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+
+from __future__ import unicode_literals
+
+# Allow direct execution
+import os
+import sys
+import tempfile
+import unittest
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chapter_split import ffmpeg
+from chapter_split.batch import BatchException, expand_inputs, probe_files
+
+
+class TestBatch(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.root = self.tmpdir.name
+        os.mkdir(os.path.join(self.root, "books"))
+        for name in ("b.mp3", "a.M4B", "notes.txt", "books/c.mkv"):
+            open(os.path.join(self.root, name), "w").close()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.root, name)
+
+    def test_expand_inputs(self):
+        # Directories give the media files they directly contain
+        self.assertEqual(
+            expand_inputs([self.root]),
+            [self.path("a.M4B"), self.path("b.mp3")],
+        )
+        self.assertEqual(
+            expand_inputs([self.path("*"), self.path("b.mp3")]),
+            [
+                self.path("a.M4B"),
+                self.path("b.mp3"),
+                self.path("books/c.mkv"),
+                self.path("notes.txt"),
+            ],
+        )
+        self.assertEqual(expand_inputs(["-"]), ["-"])
+        with self.assertRaises(BatchException):
+            expand_inputs([self.path("missing.mp3")])
+
+    def test_probe_files(self):
+        files = [self.path("a.M4B"), self.path("b.mp3")]
+        with patch.object(ffmpeg, "get_infos", side_effect=str.upper):
+            self.assertEqual(
+                probe_files(files, njobs=4), [f.upper() for f in files]
+            )
+        with patch.object(ffmpeg, "get_chapter_infos", side_effect=len):
+            self.assertEqual(
+                probe_files(files, chapters_only=True),
+                [len(f) for f in files],
+            )
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+
+from __future__ import unicode_literals
+
+# Allow direct execution
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chapter_split.cache import Memo, ProbeCache
+
+
+class TestProbeCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.cachedir = os.path.join(self.tmpdir.name, "cache")
+        self.media = os.path.join(self.tmpdir.name, "media.mp3")
+        with open(self.media, "w") as f:
+            f.write("media")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_get_set(self):
+        cache = ProbeCache(self.cachedir)
+        self.assertIsNone(cache.get(self.media))
+        cache.set(self.media, {"chapters": []})
+        self.assertEqual(cache.get(self.media), {"chapters": []})
+        self.assertEqual(
+            ProbeCache(self.cachedir).get(self.media), {"chapters": []}
+        )
+
+    def test_namespaces(self):
+        cache = ProbeCache(self.cachedir)
+        cache.set(self.media, 1)
+        cache.set(self.media, 2, namespace="other")
+        self.assertEqual(cache.get(self.media), 1)
+        self.assertEqual(cache.get(self.media, namespace="other"), 2)
+
+    def test_invalidated_on_change(self):
+        cache = ProbeCache(self.cachedir)
+        cache.set(self.media, {"chapters": []})
+        with open(self.media, "w") as f:
+            f.write("modified media")
+        self.assertIsNone(cache.get(self.media))
+
+    def test_missing_file(self):
+        cache = ProbeCache(self.cachedir)
+        self.assertIsNone(cache.get(os.path.join(self.tmpdir.name, "none")))
+
+    def test_eviction(self):
+        cache = ProbeCache(self.cachedir, max_entries=2)
+        paths = []
+        for i in range(3):
+            path = os.path.join(self.tmpdir.name, "{}.mp3".format(i))
+            with open(path, "w") as f:
+                f.write(str(i))
+            cache.set(path, i)
+            paths += [path]
+        # Make the first entry the most recently used one
+        now = time.time()
+        for name in os.listdir(self.cachedir):
+            os.utime(os.path.join(self.cachedir, name), (now - 10, now - 10))
+        self.assertEqual(cache.get(paths[0]), 0)
+        cache.evict()
+        self.assertEqual(len(os.listdir(self.cachedir)), 2)
+        self.assertEqual(cache.get(paths[0]), 0)
+
+    def test_untouched(self):
+        cache = ProbeCache(self.cachedir)
+        cache.set(self.media, 1)
+        (name,) = os.listdir(self.cachedir)
+        path = os.path.join(self.cachedir, name)
+        os.utime(path, (time.time() - 10, time.time() - 10))
+        mtime = os.stat(path).st_mtime
+        self.assertEqual(cache.get(self.media, touch=False), 1)
+        self.assertEqual(os.stat(path).st_mtime, mtime)
+        cache.get(self.media)
+        self.assertGreater(os.stat(path).st_mtime, mtime)
+
+    def test_expiration(self):
+        cache = ProbeCache(self.cachedir, max_age=60)
+        cache.set(self.media, 1)
+        for name in os.listdir(self.cachedir):
+            path = os.path.join(self.cachedir, name)
+            os.utime(path, (time.time() - 120, time.time() - 120))
+        cache.evict()
+        self.assertIsNone(cache.get(self.media))
+
+    def test_clear(self):
+        cache = ProbeCache(self.cachedir)
+        cache.set(self.media, 1)
+        cache.clear()
+        self.assertEqual(os.listdir(self.cachedir), [])
+
+
+class TestMemo(unittest.TestCase):
+    def test_lru(self):
+        memo = Memo(max_entries=2)
+        memo.set("a", 1)
+        memo.set("b", 2)
+        self.assertEqual(memo.get("a"), 1)
+        # "b" is the least recently used entry
+        memo.set("c", 3)
+        self.assertNotIn("b", memo)
+        self.assertIsNone(memo.get("b"))
+        self.assertEqual((memo.get("a"), memo.get("c")), (1, 3))
+        memo.clear()
+        self.assertNotIn("a", memo)
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == "__main__":
+    main()
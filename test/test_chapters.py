@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+
+from __future__ import unicode_literals
+
+# Allow direct execution
+import os
+import pickle
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chapter_split.chapters import Chapter, ChapterTable
+from chapter_split.readers import make_chapters
+from chapter_split.util import extract_chapters_txt
+
+
+class TestChapters(unittest.TestCase):
+    def test_table(self):
+        chapters = make_chapters([0, 60.25, 200.5], ["One", "Two", "One"], 300)
+        table = ChapterTable(chapters)
+        self.assertEqual(len(table), 3)
+        for chap, expected in zip(table, chapters):
+            for key in ("id", "start", "end", "tags"):
+                self.assertEqual(chap[key], expected[key])
+            for key in ("start_time", "end_time"):
+                self.assertEqual(chap[key], float(expected[key]))
+        self.assertIs(table[0].title, table[2].title)
+        self.assertEqual(table[-1]["id"], 2)
+        self.assertEqual(table[1].start_hour, "00:01:00.250")
+        self.assertEqual(table[1].end_hour, "00:03:20.500")
+        with self.assertRaises(KeyError):
+            table[0]["time_base"]
+        self.assertEqual(table[0].get("time_base"), None)
+        with self.assertRaises(IndexError):
+            table[3]
+
+    def test_time_base(self):
+        # ffprobe gives the chapters of Matroska files in nanoseconds
+        chap = {
+            "id": 0,
+            "time_base": "1/1000000000",
+            "start": 1500000000,
+            "start_time": "1.500000",
+            "end": 62000000000,
+            "end_time": "62.000000",
+            "tags": {"title": "One"},
+        }
+        table = ChapterTable([chap])
+        self.assertEqual((table[0]["start"], table[0]["end"]), (1500, 62000))
+
+    def test_no_end(self):
+        chapters = extract_chapters_txt("0:00 Intro\n1:30 End\n", None)
+        table = ChapterTable(chapters)
+        self.assertEqual(table[1]["end"], None)
+        self.assertEqual(table[1]["end_time"], None)
+        self.assertEqual(table[1].end_hour, None)
+        self.assertEqual(table[0].end_hour, "00:01:30.000")
+
+    def test_pickle(self):
+        table = ChapterTable(make_chapters([0, 60], ["One", "Two"], 120))
+        table.start_hours()
+        copy = pickle.loads(pickle.dumps(table))
+        self.assertEqual(copy[1].to_dict(), table[1].to_dict())
+        # A chapter alone is sent without its table
+        chap = pickle.loads(pickle.dumps(table[1]))
+        self.assertIsInstance(chap, Chapter)
+        self.assertEqual(len(chap.table), 1)
+        self.assertEqual(chap.to_dict(), table[1].to_dict())
+        self.assertEqual(chap.start_hour, "00:01:00.000")
+        self.assertEqual(chap.end_hour, "00:02:00.000")
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+
+from __future__ import unicode_literals
+
+# Allow direct execution
+import contextlib
+import io
+import os
+import struct
+import sys
+import tempfile
+import threading
+import unittest
+import unittest.mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import chapter_split
+from chapter_split import daemon
+from chapter_split.options import get_args, parse_args
+
+
+def id3_file(path):
+    def frame(frame_id, body):
+        return frame_id + struct.pack(">I", len(body)) + b"\0\0" + body
+
+    def chap(element_id, start, end, title):
+        body = element_id + b"\0" + struct.pack(">IIII", start, end, 0, 0)
+        return frame(b"CHAP", body + frame(b"TIT2", b"\x03" + title))
+
+    frames = chap(b"ch0", 0, 5000, b"Intro") + chap(b"ch1", 5000, 9000, b"End")
+    size = bytes([0, 0, len(frames) >> 7, len(frames) & 127])
+    header = b"ID3\x03\0\0" + size
+    with open(path, "wb") as f:
+        f.write(header + frames + bytes(100))
+
+
+class TestDaemon(unittest.TestCase):
+    def test_prepare_request(self):
+        args = parse_args(["a.mp3", "/abs/b.mp3", "--report", "r.csv"])
+        request = daemon.prepare_request(args, "/work", priority=2)
+        options = request["options"]
+        self.assertEqual(options["files"], ["/work/a.mp3", "/abs/b.mp3"])
+        self.assertEqual(options["report"], "/work/r.csv")
+        self.assertEqual(options["outdir"], "/work")
+        self.assertEqual(options["priority"], 2)
+        self.assertIsNone(daemon.check_options(args))
+        self.assertIsNotNone(daemon.check_options(parse_args(["-"])))
+        args = parse_args(["a.mp3", "--trace", "t.json"])
+        self.assertIn("--trace", daemon.check_options(args))
+
+    def test_submit(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "sock")
+            id3_file(os.path.join(tmpdir, "book.mp3"))
+            server = daemon.Server(path, 1)
+            thread = threading.Thread(target=server.serve_forever)
+            thread.start()
+            out = io.StringIO()
+            cwd = os.getcwd()
+            os.chdir(tmpdir)
+            try:
+                with contextlib.redirect_stdout(out):
+                    argv = ["--socket", path, "book.mp3", "-p", "-q"]
+                    status = daemon.submit(argv)
+            finally:
+                os.chdir(cwd)
+                server.shutdown()
+                server.server_close()
+                thread.join()
+        self.assertEqual(status, 0)
+        self.assertIn("Title: Intro", out.getvalue())
+        self.assertIn("[00:00:05 - 00:00:09]", out.getvalue())
+
+    def test_request_log(self):
+        responses = []
+        stream = io.StringIO()
+        previous, daemon.ch.stream = daemon.ch.stream, stream
+        # Only the handler of the daemon is kept
+        handlers, daemon.logger.handlers = daemon.logger.handlers, [daemon.ch]
+        try:
+            with tempfile.TemporaryDirectory() as tmpdir:
+                id3_file(os.path.join(tmpdir, "book.mp3"))
+                with daemon.request_logging():
+                    for flags in (["-vv"], ["-q"]):
+                        args = parse_args(["book.mp3", "-p"] + flags)
+                        request = daemon.prepare_request(args, tmpdir)
+                        responses += [daemon.run_request(request, 1)]
+        finally:
+            daemon.ch.stream = previous
+            daemon.logger.handlers = handlers
+        # What a request logs only goes to its client
+        self.assertEqual(stream.getvalue(), "")
+        self.assertNotEqual(responses[0]["log"], [])
+        self.assertEqual(responses[1]["log"], [])
+
+    def test_request_jobs(self):
+        seen = []
+
+        def process(args, out):
+            seen.append((args.njobs, get_args() is args))
+
+        args = parse_args(["/abs/a.mp3", "-j", "3"])
+        request = daemon.prepare_request(args, "/work")
+        with unittest.mock.patch.object(daemon, "process", process):
+            response = daemon.run_request(request, 2)
+        # The request keeps its -j, its jobs sharing the slots of the daemon
+        self.assertEqual(response["status"], 0)
+        self.assertEqual(seen, [(3, True)])
+
+    def test_dispatch(self):
+        argv = ["chaps", "--submit", "--socket", "/nonexistent", "serve"]
+        with unittest.mock.patch("sys.argv", argv):
+            with self.assertLogs("logger", "ERROR") as logs:
+                with self.assertRaises(SystemExit) as context:
+                    chapter_split.main()
+        self.assertEqual(context.exception.code, 1)
+        self.assertIn("can not reach the daemon", logs.output[0])
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == "__main__":
+    main()
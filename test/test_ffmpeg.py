@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+
+from __future__ import unicode_literals
+
+# Allow direct execution
+import os
+import signal
+import subprocess as sp
+import sys
+import tempfile
+import threading
+import unittest
+from io import StringIO
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chapter_split import SplitOptions, ffmpeg
+from chapter_split.cache import ProbeCache
+from chapter_split.options import get_args, set_args
+from chapter_split.readers import make_chapters
+from chapter_split.scheduler import SlotLimiter
+from chapter_split.status import Renderer
+
+
+def make_infos(titles, duration):
+    starts = [duration * i / len(titles) for i in range(len(titles))]
+    fmt = {
+        "filename": "book.mkv",
+        "duration": "{:.6f}".format(duration),
+        "tags": {"title": "Book"},
+    }
+    chapters = make_chapters(starts, titles, duration)
+    return {"chapters": chapters, "format": fmt, "streams": []}
+
+
+class TestSinglePass(unittest.TestCase):
+    def setUp(self):
+        options = SplitOptions(
+            copy=True,
+            single_pass=True,
+            only_chapters=[1, 3],
+            output="%(chapter-index)s.%(ext)s",
+            no_probe_cache=True,
+        )
+        set_args(options.get_args())
+
+    def test_build_ffmpeg_command(self):
+        cmd = ffmpeg.build_ffmpeg_command(
+            "in.mkv", [(["-t", "1"], "a.mkv"), ([], "b.mkv")], ["-f", "mp4"]
+        )
+        self.assertEqual(
+            cmd,
+            [
+                "ffmpeg",
+                "-y",
+                "-f",
+                "mp4",
+                "-i",
+                "in.mkv",
+                "-loglevel",
+                "repeat+info",
+                "-progress",
+                "/dev/stdout",
+                "-t",
+                "1",
+                "a.mkv",
+                "b.mkv",
+            ],
+        )
+
+    def test_single_pass_command(self):
+        infos = make_infos(["One", "Two", "Three"], 90)
+        jobs = ffmpeg.make_jobs("book.mkv", infos)
+        self.assertEqual(len(jobs), 2)
+        cmd, stdin = ffmpeg.single_pass_command(jobs)
+        self.assertIs(stdin, sp.DEVNULL)
+        # The input is read once, each chapter having its own output
+        self.assertEqual(cmd.count("-i"), 1)
+        self.assertEqual(cmd[cmd.index("-i") + 1], "book.mkv")
+        outputs = cmd[cmd.index("/dev/stdout") + 1 :]
+        self.assertEqual(
+            outputs,
+            ["-ss", "00:00:00.000", "-to", "00:00:30.000"]
+            + ["-codec", "copy", ".1.part.mkv"]
+            + ["-ss", "00:01:00.000", "-to", "00:01:30.000"]
+            + ["-codec", "copy", ".3.part.mkv"],
+        )
+
+    def test_single_pass_groups(self):
+        files = [
+            ("book.mkv", make_infos(["One", "Two"], 60)),
+            ("other.mkv", make_infos(["One", "Two", "Three"], 60)),
+        ]
+        jobs = ffmpeg.make_jobs("book.mkv", files[0][1])
+        jobs += ffmpeg.make_jobs("other.mkv", files[1][1])
+        groups = ffmpeg.ffmpeg_groups(files, jobs, list(range(len(jobs))))
+        self.assertEqual(
+            [(split, indexes) for split, indexes, _ in groups],
+            [
+                (ffmpeg.split_file_single_pass, [0]),
+                (ffmpeg.split_file_single_pass, [1, 2]),
+            ],
+        )
+
+
+class TestThreads(unittest.TestCase):
+    def setUp(self):
+        options = SplitOptions(jobs=3, no_probe_cache=True, quiet=True)
+        set_args(options.get_args())
+        ffmpeg.set_command_limiter(SlotLimiter(2))
+
+    def tearDown(self):
+        ffmpeg.set_command_limiter(None)
+
+    def test_split_jobs_threads(self):
+        jobs = ffmpeg.make_jobs("book.mkv", make_infos(["a", "b", "c"], 60))
+        threads = set()
+        seen = []
+
+        def extract(chap, metadata, fmt, filename, cur, tot):
+            threads.add(threading.current_thread())
+            # Each thread extracts its chapters one at a time
+            seen.append(get_args().njobs)
+            return cur - 1, {"wall": 0}
+
+        done = []
+        with patch.object(ffmpeg, "extract_chapter", side_effect=extract):
+            ffmpeg.split_jobs(jobs, lambda i, stats: done.append(i))
+        # With a command limiter, the jobs are threads sharing its slots
+        self.assertEqual(sorted(done), [0, 1, 2])
+        self.assertEqual(seen, [1, 1, 1])
+        self.assertNotIn(threading.current_thread(), threads)
+
+
+class TestProbeCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.cache = ProbeCache(os.path.join(self.tmpdir.name, "cache"))
+        self.media = os.path.join(self.tmpdir.name, "book.mkv")
+        with open(self.media, "w") as f:
+            f.write("media")
+
+    def tearDown(self):
+        ffmpeg._INFOS.clear()
+        self.tmpdir.cleanup()
+
+    def get_infos(self, **options):
+        set_args(SplitOptions(**options).get_args())
+        ffmpeg._INFOS.clear()
+        infos = make_infos(["a"], 60)
+        with patch.object(ffmpeg, "_PROBE_CACHE", self.cache):
+            with patch.object(ffmpeg, "probe_file", return_value=infos):
+                return ffmpeg.get_infos(self.media)
+
+    def test_dry_run(self):
+        # A dry run leaves the cache as it is
+        self.get_infos(dry_run=True)
+        self.assertIsNone(self.cache.get(self.media))
+        self.get_infos()
+        self.assertIsNotNone(self.cache.get(self.media))
+
+
+class TestRenderer(unittest.TestCase):
+    @unittest.skipUnless(hasattr(signal, "SIGWINCH"), "no SIGWINCH")
+    def test_close_renderer(self):
+        previous = signal.getsignal(signal.SIGWINCH)
+        ffmpeg._RENDERER = Renderer(StringIO(), tty=True)
+        ffmpeg.close_renderer()
+        self.assertIsNone(ffmpeg._RENDERER)
+        self.assertEqual(signal.getsignal(signal.SIGWINCH), previous)
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+
+from __future__ import unicode_literals
+
+# Allow direct execution
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chapter_split.journal import (
+    Journal,
+    JOURNAL_NAME,
+    partial_name,
+    command_hash,
+    get_journal,
+    clear_journals,
+)
+
+
+class TestJournal(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.outfile = os.path.join(self.tmpdir.name, "out.mp3")
+        with open(self.outfile, "w") as f:
+            f.write("chapter")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_partial_name(self):
+        self.assertEqual(partial_name("a.mp3"), ".a.part.mp3")
+        self.assertEqual(partial_name("d/a.b.mkv"), "d/.a.b.part.mkv")
+        self.assertEqual(partial_name("a"), ".a.part")
+
+    def test_command_hash(self):
+        cmd = ["ffmpeg", "-i", self.outfile, "-t", "1", "x.mp3"]
+        other = ["ffmpeg", "-i", self.outfile, "-t", "2", "x.mp3"]
+        h = command_hash(cmd, self.outfile)
+        self.assertEqual(h, command_hash(cmd[:-1] + ["y.mp3"], self.outfile))
+        self.assertNotEqual(h, command_hash(other, self.outfile))
+        with open(self.outfile, "a") as f:
+            f.write("modified")
+        self.assertNotEqual(h, command_hash(cmd, self.outfile))
+
+    def test_record(self):
+        journal = Journal(self.tmpdir.name)
+        self.assertFalse(journal.is_done(self.outfile, "hash"))
+        journal.record(self.outfile, 12.5, "hash")
+        self.assertTrue(journal.is_done(self.outfile, "hash"))
+        self.assertFalse(journal.is_done(self.outfile, "other"))
+
+        journal = Journal(self.tmpdir.name)
+        self.assertTrue(journal.is_done(self.outfile, "hash"))
+        with open(self.outfile, "a") as f:
+            f.write(" truncated")
+        self.assertFalse(journal.is_done(self.outfile, "hash"))
+        os.remove(self.outfile)
+        self.assertFalse(journal.is_done(self.outfile, "hash"))
+
+    def test_truncated_journal(self):
+        journal = Journal(self.tmpdir.name)
+        journal.record(self.outfile, 12.5, "hash")
+        with open(os.path.join(self.tmpdir.name, JOURNAL_NAME), "a") as f:
+            f.write('{"output": "other.mp3", "dura')
+        with self.assertLogs("logger", level="WARNING"):
+            journal = Journal(self.tmpdir.name)
+        self.assertTrue(journal.is_done(self.outfile, "hash"))
+
+    def test_clear_journals(self):
+        journal = get_journal(self.outfile)
+        self.assertIs(get_journal(self.outfile), journal)
+        # Another run reads the journal file again
+        Journal(self.tmpdir.name).record(self.outfile, 12.5, "hash")
+        journal = get_journal(self.outfile)
+        self.assertFalse(journal.is_done(self.outfile, "hash"))
+        clear_journals()
+        journal = get_journal(self.outfile)
+        self.assertTrue(journal.is_done(self.outfile, "hash"))
+        clear_journals()
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+
+from __future__ import unicode_literals
+
+# Allow direct execution
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chapter_split.keyframes import (
+    previous_keyframe,
+    nearest_keyframe,
+    snap_chapters,
+    keyframe_offsets,
+)
+
+
+def make_chapter(start, end, title="chapter"):
+    return {
+        "start": int(start * 1000),
+        "end": int(end * 1000),
+        "start_time": "{:.6f}".format(start),
+        "end_time": "{:.6f}".format(end),
+        "tags": {"title": title},
+    }
+
+
+class TestKeyframes(unittest.TestCase):
+    keyframes = [0.0, 2.0, 4.0, 58.0, 61.0, 120.0]
+
+    def test_lookup(self):
+        self.assertEqual(previous_keyframe(self.keyframes, 60), 58.0)
+        self.assertEqual(previous_keyframe(self.keyframes, 61), 61.0)
+        self.assertEqual(previous_keyframe([1.0], 0.5), None)
+        self.assertEqual(nearest_keyframe(self.keyframes, 60), 61.0)
+        self.assertEqual(nearest_keyframe(self.keyframes, 59), 58.0)
+        self.assertEqual(nearest_keyframe(self.keyframes, 500), 120.0)
+
+    def test_snap_chapters(self):
+        chapters = [
+            make_chapter(0, 60),
+            make_chapter(60, 100),
+            make_chapter(100, 130),
+        ]
+        snapped = snap_chapters(chapters, self.keyframes, duration=130)
+        self.assertEqual(
+            [(c["start"], c["end"]) for c in snapped],
+            [(0, 61000), (61000, 120000), (120000, 130000)],
+        )
+        self.assertEqual(snapped[1]["start_time"], "61.000000")
+        # The original chapters are left untouched
+        self.assertEqual(chapters[1]["start"], 60000)
+
+    def test_snap_short_chapter(self):
+        chapters = [make_chapter(2.2, 2.8)]
+        with self.assertLogs("logger", level="WARNING"):
+            snapped = snap_chapters(chapters, self.keyframes)
+        self.assertEqual(snapped, chapters)
+
+    def test_snap_short_neighbours(self):
+        # The middle chapter lies within the GOP starting at 2s, snapping
+        # it would overlap its neighbours
+        chapters = [
+            make_chapter(0, 2.2, "a"),
+            make_chapter(2.2, 2.8, "b"),
+            make_chapter(2.8, 60, "c"),
+        ]
+        with self.assertLogs("logger", level="WARNING") as logs:
+            snapped = snap_chapters(chapters, self.keyframes)
+        self.assertIn("merged", logs.output[0])
+        self.assertEqual(
+            [(c["tags"]["title"], c["start"], c["end"]) for c in snapped],
+            [("a", 0, 2000), ("c", 2000, 61000)],
+        )
+        # Alongside a gap, it keeps the boundary it shares
+        chapters = [make_chapter(0, 2.2, "a"), make_chapter(2.2, 2.8, "b")]
+        with self.assertLogs("logger", level="WARNING") as logs:
+            snapped = snap_chapters(chapters, self.keyframes)
+        self.assertIn("not snapped", logs.output[0])
+        self.assertEqual(
+            [(c["start"], c["end"]) for c in snapped],
+            [(0, 2000), (2000, 2800)],
+        )
+
+    def test_offsets(self):
+        chapters = [make_chapter(0, 60), make_chapter(60, 100)]
+        self.assertEqual(keyframe_offsets(chapters, self.keyframes), [0, 2])
+        self.assertEqual(snap_chapters(chapters, []), chapters)
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+
+from __future__ import unicode_literals
+
+# Allow direct execution
+import os
+import struct
+import sys
+import tempfile
+import unittest
+import wave
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chapter_split.native import (
+    Slicer,
+    WavSlicer,
+    Mp3Slicer,
+    FlacSlicer,
+    NativeException,
+    crc8,
+    crc16,
+    mp3_frame_info,
+    get_slicer,
+)
+
+# MPEG 1 layer III, 128 kbit/s, 44100 Hz, no CRC, joint stereo
+MP3_HEADER = 0xFFFB9040
+
+
+def mp3_frame(index, padding=0):
+    header = MP3_HEADER | (padding << 9)
+    length = mp3_frame_info(header)[0]
+    body = bytes([index % 256]) * (length - 4)
+    return struct.pack(">I", header) + body
+
+
+def xing_frame(nb_frames, nb_bytes):
+    frame = bytearray(mp3_frame(0))
+    tag = 4 + 32
+    frame[tag : tag + 8] = b"Info" + struct.pack(">I", 0x0F)
+    struct.pack_into(">II", frame, tag + 8, nb_frames, nb_bytes)
+    lame = tag + 8 + 4 + 4 + 100 + 4
+    frame[lame : lame + 9] = b"LAME3.100"
+    frame[lame + 21 : lame + 24] = ((576 << 12) | 1000).to_bytes(3, "big")
+    return bytes(frame)
+
+
+def flac_frame(number, blocksize=4096):
+    # Fixed blocksize 4096, 44100 Hz, stereo, 16 bits per sample
+    header = bytes([0xFF, 0xF8, 0xC9, 0x18])
+    if number < 0x80:
+        header += bytes([number])
+    else:
+        header += bytes([0xC0 | (number >> 6), 0x80 | (number & 0x3F)])
+    header += bytes([crc8(header)])
+    return header + bytes([0x55]) * 1000
+
+
+def flac_file(nb_frames):
+    info = bytearray(34)
+    struct.pack_into(">HH", info, 0, 4096, 4096)
+    total = nb_frames * 4096
+    # 44100 Hz, 2 channels, 16 bits per sample
+    info[10:14] = bytes([0x0A, 0xC4, 0x42, 0xF0 | ((total >> 32) & 0x0F)])
+    struct.pack_into(">I", info, 14, total & 0xFFFFFFFF)
+    info[18:34] = b"\x01" * 16
+    data = b"fLaC" + bytes([0]) + (34).to_bytes(3, "big") + bytes(info)
+    comment = struct.pack("<I", 4) + b"test" + struct.pack("<I", 1)
+    comment += struct.pack("<I", 10) + b"TITLE=Book"
+    data += bytes([0x84]) + len(comment).to_bytes(3, "big") + comment
+    return data + b"".join(flac_frame(i) for i in range(nb_frames))
+
+
+class TestNative(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.tmpdir.name, name)
+
+    def test_crc(self):
+        self.assertEqual(crc8(b"123456789"), 0xF4)
+        self.assertEqual(crc16(b"123456789"), 0xBB3D)
+
+    def test_get_slicer(self):
+        self.assertIs(get_slicer({"format_name": "mp3"}, "a.mp3"), Mp3Slicer)
+        self.assertIs(get_slicer({"format_name": "wav"}, "a.WAV"), WavSlicer)
+        self.assertIsNone(get_slicer({"format_name": "mp3"}, "a.m4a"))
+        self.assertIsNone(get_slicer({"format_name": "mov,mp4"}, "a.mp4"))
+
+    def test_wav(self):
+        source = self.path("in.wav")
+        with wave.open(source, "wb") as w:
+            w.setnchannels(2)
+            w.setsampwidth(2)
+            w.setframerate(1000)
+            frames = [struct.pack("<hh", i, -i) for i in range(3000)]
+            w.writeframes(b"".join(frames))
+        with WavSlicer(source) as slicer:
+            slicer.write(self.path("out.wav"), 1.0, 2.5, {"title": "Two"})
+        with wave.open(self.path("out.wav"), "rb") as w:
+            self.assertEqual(w.getnframes(), 1500)
+            self.assertEqual(w.getframerate(), 1000)
+            self.assertEqual(w.readframes(1), struct.pack("<hh", 1000, -1000))
+        with open(self.path("out.wav"), "rb") as f:
+            data = f.read()
+        self.assertIn(b"INAMTwo", data.replace(b"\x04\x00\x00\x00", b""))
+        self.assertEqual(struct.unpack_from("<I", data, 4)[0], len(data) - 8)
+
+    def test_mp3(self):
+        frames = [mp3_frame(i) for i in range(100)]
+        source = self.path("in.mp3")
+        audio = b"".join(frames)
+        xing = xing_frame(100, len(audio))
+        tag = b"TIT2" + struct.pack(">I", 5) + b"\0\0\x00Book"
+        tag += b"TPE1" + struct.pack(">I", 7) + b"\0\0\x00Author"
+        id3 = b"ID3\x03\0\0" + bytes([0, 0, 0, len(tag)]) + tag
+        with open(source, "wb") as f:
+            f.write(id3 + xing + audio + b"TAG" + bytes(125))
+        # A frame lasts 1152 / 44100 s
+        duration = 1152 / 44100
+        with Mp3Slicer(source) as slicer:
+            slicer.write(
+                self.path("out.mp3"),
+                10 * duration,
+                30.2 * duration,
+                {"title": "Two", "track": "2"},
+            )
+        with open(self.path("out.mp3"), "rb") as f:
+            data = f.read()
+        self.assertTrue(data.startswith(b"ID3\x03"))
+        self.assertIn(b"TPE1", data)
+        self.assertNotIn(b"Book", data)
+        self.assertIn("Two".encode("utf-16"), data)
+        self.assertTrue(data.endswith(b"".join(frames[10:30])))
+        start = data.index(b"Info")
+        nb_frames, nb_bytes = struct.unpack_from(">II", data, start + 8)
+        self.assertEqual(nb_frames, 20)
+        self.assertEqual(nb_bytes, len(xing) + 20 * len(frames[0]))
+        lame = start + 8 + 4 + 4 + 100 + 4
+        frame = data[start - 36 :]
+        delay_padding = int.from_bytes(data[lame + 21 : lame + 24], "big")
+        self.assertEqual(delay_padding, 0)
+        crc = struct.unpack_from(">H", data, lame + 34)[0]
+        self.assertEqual(crc, crc16(frame[: lame - start + 36 + 34]))
+
+    def test_mp3_resync(self):
+        frames = [mp3_frame(i) for i in range(10)]
+        source = self.path("in.mp3")
+        junk = b"\xff\x00junk"
+        with open(source, "wb") as f:
+            f.write(b"".join(frames[:5]) + junk + b"".join(frames[5:]))
+        # Cuts are on frames, even after a loss of sync
+        duration = 1152 / 44100
+        with Mp3Slicer(source) as slicer:
+            slicer.write(self.path("a.mp3"), 0, 5 * duration)
+            slicer.write(self.path("b.mp3"), 5 * duration, 1)
+        with open(self.path("a.mp3"), "rb") as f:
+            self.assertEqual(f.read(), b"".join(frames[:5]))
+        with open(self.path("b.mp3"), "rb") as f:
+            self.assertEqual(f.read(), b"".join(frames[5:]))
+
+    def test_flac(self):
+        source = self.path("in.flac")
+        with open(source, "wb") as f:
+            f.write(flac_file(300))
+        with FlacSlicer(source) as slicer:
+            # Frame 100 starts at 409600 / 44100 s, frame 200 at twice that
+            slicer.write(
+                self.path("out.flac"),
+                409000 / 44100,
+                820000 / 44100,
+                {"title": "Two"},
+            )
+        with open(self.path("out.flac"), "rb") as f:
+            data = f.read()
+        self.assertTrue(data.startswith(b"fLaC\x00\x00\x00\x22"))
+        total = struct.unpack_from(">I", data, 8 + 14)[0]
+        self.assertEqual(total, 100 * 4096)
+        self.assertEqual(data[8 + 18 : 8 + 34], bytes(16))
+        self.assertIn(b"TITLE=Two", data)
+        self.assertNotIn(b"TITLE=Book", data)
+        frames = b"".join(flac_frame(i) for i in range(100, 200))
+        self.assertTrue(data.endswith(frames))
+
+    def test_invalid(self):
+        with open(self.path("in.wav"), "wb") as f:
+            f.write(b"RIFF\0\0\0\0WAVEjunk")
+        with self.assertRaises(NativeException):
+            WavSlicer(self.path("in.wav"))
+        with open(self.path("in.flac"), "wb") as f:
+            f.write(b"OggS" + bytes(100))
+        with self.assertRaises(NativeException):
+            FlacSlicer(self.path("in.flac"))
+
+    def test_abstract(self):
+        # Incomplete slicers fail before opening anything
+        class IncompleteSlicer(Slicer):
+            def _parse(self):
+                pass
+
+        for slicer in (Slicer, IncompleteSlicer):
+            with self.assertRaises(TypeError):
+                slicer(self.path("missing.wav"))
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+
+from __future__ import unicode_literals
+
+# Allow direct execution
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chapter_split.plan import (
+    PlanException,
+    check_space,
+    disk_needs,
+    encode_speed,
+    estimate_cpu,
+    estimate_size,
+    filesystems,
+)
+from chapter_split.readers import make_chapters
+
+
+class TestPlan(unittest.TestCase):
+    def test_estimate_size(self):
+        chapters = make_chapters([0, 60], ["One", "Two"], 100)
+        fmt = {"bit_rate": "128000"}
+        self.assertEqual(estimate_size(chapters[0], fmt), 960000)
+        self.assertEqual(estimate_size(chapters[1], fmt), 640000)
+        self.assertEqual(estimate_size(chapters[0], {}), None)
+        chapters[1]["end"] = chapters[1]["end_time"] = None
+        self.assertEqual(estimate_size(chapters[1], fmt), None)
+
+    def test_estimate_cpu(self):
+        hd = {"codec_name": "h264", "width": 1920, "height": 1080}
+        sd = {"codec_name": "h264", "width": 960, "height": 540}
+        self.assertEqual(encode_speed("h264", hd), 1.0)
+        self.assertEqual(encode_speed("hevc", hd), 4.0)
+        self.assertEqual(encode_speed("h264", sd), 0.25)
+        self.assertEqual(encode_speed("h264", None), 0.02)
+        cover = {"codec_name": "mjpeg", "disposition": {"attached_pic": 1}}
+        self.assertEqual(encode_speed("mjpeg", cover), 0.02)
+        self.assertEqual(estimate_cpu(100, 100, "h264", hd), 100)
+        self.assertAlmostEqual(estimate_cpu(100, 0, "h264", hd), 0.1)
+        # Smart rendering only re-encodes the ends of the chapter
+        self.assertAlmostEqual(estimate_cpu(100, 4, "h264", hd), 4.096)
+        self.assertIsNone(estimate_cpu(None, 0, "h264", hd))
+
+    def test_disk_needs(self):
+        outputs = ["/out/a", "/out/b", "/out/c"]
+        sizes = [10, 30, None]
+        self.assertEqual(disk_needs(outputs, sizes, 2), {"/out": 40})
+        # The archive gets every chapter, only those being extracted are
+        # beside it
+        self.assertEqual(
+            disk_needs(outputs, sizes, 1, archive="/arch/a.tar"),
+            {"/arch": 40, "/out": 30},
+        )
+        self.assertEqual(
+            disk_needs(outputs, sizes, 1, archive="-"), {"/out": 30}
+        )
+        self.assertEqual(
+            disk_needs(outputs, sizes, 2, temporaries=True), {"/out": 80}
+        )
+
+    def test_check_space(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            missing = os.path.join(tmpdir, "not", "yet")
+            found = filesystems({tmpdir: 1, missing: 2})
+            self.assertEqual(len(found), 1)
+            self.assertEqual(found[0]["path"], tmpdir)
+            self.assertEqual(found[0]["required"], 3)
+            self.assertTrue(found[0]["enough"])
+            check_space(found)
+            found = filesystems({tmpdir: 1 << 60})
+            self.assertFalse(found[0]["enough"])
+            with self.assertRaises(PlanException):
+                check_space(found)
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == "__main__":
+    main()
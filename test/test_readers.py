@@ -0,0 +1,261 @@
+#!/usr/bin/env python
+
+from __future__ import unicode_literals
+
+# Allow direct execution
+import json
+import os
+import shutil
+import struct
+import subprocess as sp
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chapter_split.readers import read_chapters
+
+
+def box(kind, *bodies):
+    body = b"".join(bodies)
+    return struct.pack(">I", 8 + len(body)) + kind + body
+
+
+def full_box(kind, *fields):
+    return box(kind, b"\0\0\0\0", *fields)
+
+
+def ebml(element_id, *bodies):
+    body = b"".join(bodies)
+    size = b"\x01" + len(body).to_bytes(7, "big")
+    length = (element_id.bit_length() + 7) // 8
+    return element_id.to_bytes(length, "big") + size + body
+
+
+def ebml_uint(element_id, value):
+    return ebml(element_id, value.to_bytes(8, "big"))
+
+
+def id3_frame(frame_id, body):
+    size = len(body)
+    syncsafe = bytes([size >> 21, (size >> 14) & 127, (size >> 7) & 127])
+    return frame_id + syncsafe + bytes([size & 127]) + b"\0\0" + body
+
+
+def titles(chapters):
+    return [c["tags"]["title"] for c in chapters]
+
+
+def bounds(chapters):
+    return [(c["start"], c["end"]) for c in chapters]
+
+
+class TestReaders(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def write(self, name, data):
+        path = os.path.join(self.tmpdir.name, name)
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+
+    def test_mp4_chpl(self):
+        header = struct.pack(">III", 0, 0, 1000) + struct.pack(">I", 300000)
+        entries = b""
+        for start, title in ((0, b"One"), (60, b"Two"), (200.5, b"Three")):
+            entries += struct.pack(">QB", int(start * 10000000), len(title))
+            entries += title
+        chpl = box(b"chpl", b"\x01\0\0\0", b"\0\0\0\0", b"\x03", entries)
+        moov = box(b"moov", full_box(b"mvhd", header), box(b"udta", chpl))
+        data = box(b"ftyp", b"M4B ") + box(b"mdat", bytes(1000)) + moov
+        chapters = read_chapters(self.write("book.m4b", data))
+        self.assertEqual(titles(chapters), ["One", "Two", "Three"])
+        self.assertEqual(
+            bounds(chapters), [(0, 60000), (60000, 200500), (200500, 300000)]
+        )
+        self.assertEqual(chapters[1]["id"], 1)
+        self.assertEqual(chapters[1]["start_time"], "60.000000")
+
+    def test_mp4_chapter_track(self):
+        ftyp = box(b"ftyp", b"M4A ")
+        samples = [
+            struct.pack(">H", len(title)) + title
+            for title in (b"One", "Dos – 2".encode("utf-8"))
+        ]
+        mdat = box(b"mdat", *samples)
+        offset = len(ftyp) + 8
+        stbl = box(
+            b"stbl",
+            full_box(b"stts", struct.pack(">III", 1, 2, 30000)),
+            full_box(
+                b"stsz",
+                struct.pack(">II", 0, 2),
+                struct.pack(">II", *map(len, samples)),
+            ),
+            full_box(b"stsc", struct.pack(">IIII", 1, 1, 2, 1)),
+            full_box(b"stco", struct.pack(">II", 1, offset)),
+        )
+        chapter_track = box(
+            b"trak",
+            full_box(b"tkhd", struct.pack(">III", 0, 0, 2)),
+            box(
+                b"mdia",
+                full_box(b"mdhd", struct.pack(">IIII", 0, 0, 1000, 60000)),
+                box(b"minf", stbl),
+            ),
+        )
+        audio_track = box(
+            b"trak",
+            full_box(b"tkhd", struct.pack(">III", 0, 0, 1)),
+            box(b"tref", box(b"chap", struct.pack(">I", 2))),
+        )
+        moov = box(b"moov", audio_track, chapter_track)
+        chapters = read_chapters(self.write("a.m4a", ftyp + mdat + moov))
+        self.assertEqual(titles(chapters), ["One", "Dos – 2"])
+        self.assertEqual(bounds(chapters), [(0, 30000), (30000, 60000)])
+
+    def test_mp4_without_chapters(self):
+        header = struct.pack(">IIII", 0, 0, 1000, 1000)
+        data = box(b"ftyp", b"isom") + box(b"moov", full_box(b"mvhd", header))
+        self.assertEqual(read_chapters(self.write("a.mp4", data)), [])
+        self.assertIsNone(read_chapters(self.write("b.mp4", b"junk")))
+
+    def test_matroska(self):
+        def atom(start, title, end=None, uid=None):
+            children = ebml_uint(0x91, start)
+            if end is not None:
+                children += ebml_uint(0x92, end)
+            if uid is not None:
+                children += ebml_uint(0x73C4, uid)
+            children += ebml(0x80, ebml(0x85, title.encode("utf-8")))
+            return ebml(0xB6, children)
+
+        info = ebml(
+            0x1549A966,
+            ebml_uint(0x2AD7B1, 1000000),
+            ebml(0x4489, struct.pack(">d", 300000.0)),
+        )
+        hidden = ebml(0xB6, ebml_uint(0x91, 0), ebml_uint(0x98, 1))
+        chapters = ebml(
+            0x1043A770,
+            ebml(
+                0x45B9,
+                atom(60 * 10 ** 9, "Two"),
+                atom(0, "One", 60 * 10 ** 9, 2 ** 64 - 5),
+                hidden,
+            ),
+        )
+        cluster = ebml(0x1F43B675, bytes(5000))
+        seekhead_size = len(ebml(0x114D9B74, ebml(0x4DBB, bytes(32))))
+        position = seekhead_size + len(info) + len(cluster)
+        seek = ebml(
+            0x4DBB,
+            ebml(0x53AB, (0x1043A770).to_bytes(4, "big")),
+            ebml_uint(0x53AC, position),
+        )
+        seekhead = ebml(0x114D9B74, seek)
+        self.assertEqual(len(seekhead), seekhead_size)
+        segment = ebml(0x18538067, seekhead, info, cluster, chapters)
+        data = ebml(0x1A45DFA3, ebml(0x4282, b"matroska")) + segment
+        chapters = read_chapters(self.write("a.mkv", data))
+        self.assertEqual(titles(chapters), ["One", "Two"])
+        self.assertEqual(bounds(chapters), [(0, 60000), (60000, 300000)])
+        # Numbered by their UIDs, read as signed integers as ffprobe does,
+        # or by their position when they have none
+        self.assertEqual([c["id"] for c in chapters], [-5, 1])
+
+    def test_id3(self):
+        def chap(element_id, start, end, title):
+            body = element_id + b"\0" + struct.pack(">IIII", start, end, 0, 0)
+            tit2 = id3_frame(b"TIT2", b"\x03" + title.encode("utf-8"))
+            return id3_frame(b"CHAP", body + tit2)
+
+        ctoc = id3_frame(b"CTOC", b"toc\0\x03\x02ch1\0ch0\0")
+        frames = ctoc + chap(b"ch0", 5000, 9000, "Later") + chap(
+            b"ch1", 0, 5000, "Intro"
+        )
+        size = len(frames)
+        header = b"ID3\x04\0\0" + bytes(
+            [size >> 21, (size >> 14) & 127, (size >> 7) & 127, size & 127]
+        )
+        path = self.write("a.mp3", header + frames + bytes(100))
+        chapters = read_chapters(path)
+        self.assertEqual(titles(chapters), ["Intro", "Later"])
+        self.assertEqual(bounds(chapters), [(0, 5000), (5000, 9000)])
+        # Numbered in the order of their frames
+        self.assertEqual([c["id"] for c in chapters], [1, 0])
+        self.assertEqual(read_chapters(self.write("b.mp3", bytes(100))), [])
+
+    def test_unsupported(self):
+        self.assertIsNone(read_chapters(self.write("a.ogg", b"OggS")))
+        self.assertIsNone(read_chapters(self.write("a.mkv", b"junk" * 4)))
+
+    def test_truncated(self):
+        # Truncated files are left to ffprobe
+        for data in (b"", b"\x1a\x45\xdf\xa3", b"\x1a\x45\xdf\xa3\x84"):
+            self.assertIsNone(read_chapters(self.write("a.mkv", data)))
+        for data in (b"", b"\0\0\0\x10moov", b"\0\0\0\x0cmoov\0"):
+            self.assertIsNone(read_chapters(self.write("a.mp4", data)))
+
+
+METADATA = """;FFMETADATA1
+[CHAPTER]
+TIMEBASE=1/1000
+START=0
+END=2000
+title=One
+[CHAPTER]
+TIMEBASE=1/1000
+START=2000
+END=6000
+title=Two
+"""
+
+
+@unittest.skipUnless(
+    shutil.which("ffmpeg") and shutil.which("ffprobe"), "no ffmpeg"
+)
+class TestReadersFFprobe(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.metadata = os.path.join(self.tmpdir.name, "chapters.txt")
+        with open(self.metadata, "w") as f:
+            f.write(METADATA)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_ids(self):
+        # The native chapters are numbered as ffprobe numbers them
+        for name, codec in [
+            ("a.mka", "pcm_s16le"),
+            ("a.m4a", "aac"),
+            ("a.mp3", "mp2"),
+        ]:
+            with self.subTest(name=name):
+                path = os.path.join(self.tmpdir.name, name)
+                cmd = ["ffmpeg", "-v", "error", "-y", "-f", "lavfi"]
+                cmd += ["-i", "sine=duration=6", "-i", self.metadata]
+                cmd += ["-map", "0", "-map_chapters", "1"]
+                sp.check_call(cmd + ["-codec:a", codec, path])
+                cmd = ["ffprobe", "-v", "error", "-of", "json"]
+                output = sp.check_output(cmd + ["-show_chapters", path])
+                expected = json.loads(output.decode())["chapters"]
+                chapters = read_chapters(path)
+                self.assertEqual(
+                    [(c["id"], c["tags"]["title"]) for c in chapters],
+                    [(c["id"], c["tags"]["title"]) for c in expected],
+                )
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == "__main__":
+    main()
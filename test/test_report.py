@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+
+from __future__ import unicode_literals
+
+# Allow direct execution
+import csv
+import json
+import os
+import subprocess as sp
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chapter_split.report import (
+    Report,
+    ProgressStats,
+    wait_rusage,
+    merge_stats,
+)
+
+
+def make_stats(wall, speed, maxrss=None):
+    return {
+        "wall": wall,
+        "speed": speed,
+        "fps": None,
+        "bitrate": 128.0,
+        "user": wall / 2,
+        "system": 0.0,
+        "maxrss": maxrss,
+    }
+
+
+class TestReport(unittest.TestCase):
+    def test_progress_stats(self):
+        progress = ProgressStats()
+        for line in ("fps=N/A", "bitrate=N/A", "speed=N/A"):
+            progress.feed(*line.split("="))
+        self.assertIsNone(progress.speed)
+        for line in ("fps=24.5", "bitrate= 128.3kbits/s", "speed=12.1x"):
+            progress.feed(*line.split("="))
+        self.assertEqual(progress.fps, 24.5)
+        self.assertEqual(progress.bitrate, 128.3)
+        self.assertEqual(progress.speed, 12.1)
+
+    def test_wait_rusage(self):
+        code = "import sys; sum(range(100000)); sys.exit(3)"
+        p = sp.Popen([sys.executable, "-c", code])
+        rusage = wait_rusage(p)
+        self.assertEqual(p.returncode, 3)
+        if hasattr(os, "wait4"):
+            self.assertGreater(rusage.ru_maxrss, 0)
+
+    def test_merge_stats(self):
+        self.assertIsNone(merge_stats([(None, 10)]))
+        single = make_stats(1, 10)
+        self.assertIs(merge_stats([(single, 10), (None, 1)]), single)
+        # 10 s at 2x then 20 s at 20x, and a join which reports nothing
+        merged = merge_stats(
+            [
+                (make_stats(5, 2, 100), 10),
+                (make_stats(1, 20, 300), 20),
+                (make_stats(0.5, None, 200), None),
+            ]
+        )
+        self.assertEqual(merged["wall"], 6.5)
+        self.assertEqual(merged["user"], 3.25)
+        self.assertEqual(merged["maxrss"], 300)
+        self.assertEqual(merged["speed"], 30 / 6)
+        self.assertEqual(merged["bitrate"], 128.0)
+        self.assertIsNone(merged["fps"])
+
+    def test_write(self):
+        chap = {
+            "id": 1,
+            "start_time": "60.000000",
+            "end_time": "90.000000",
+            "tags": {"title": "Two"},
+        }
+        job = (chap, {}, {}, "in.mkv")
+        with tempfile.TemporaryDirectory() as tmpdir:
+            for name in ("report.json", "report.csv"):
+                report = Report(os.path.join(tmpdir, name))
+                report.add(job, "Two.mkv", "ffmpeg", make_stats(3, 10), 42)
+                report.add(job, "Two.mkv", "native", size=7)
+                report.write()
+            with open(os.path.join(tmpdir, "report.json")) as f:
+                entries = json.load(f)
+            with open(os.path.join(tmpdir, "report.csv")) as f:
+                rows = list(csv.DictReader(f))
+        self.assertEqual(entries[0]["chapter"], 2)
+        self.assertEqual(entries[0]["duration"], 30.0)
+        self.assertEqual(entries[0]["size"], 42)
+        self.assertEqual(entries[0]["speed"], 10)
+        self.assertIsNone(entries[1]["wall"])
+        self.assertEqual(rows[0]["title"], "Two")
+        self.assertEqual(rows[0]["wall"], "3")
+        self.assertEqual(rows[1]["engine"], "native")
+        self.assertEqual(rows[1]["wall"], "")
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+
+from __future__ import unicode_literals
+
+# Allow direct execution
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import chapter_split.scheduler as scheduler
+
+
+def make_job(start, end, bit_rate="1000"):
+    chap = {"start_time": str(start), "end_time": str(end)}
+    return (chap, {}, {"bit_rate": bit_rate}, "file.mp3")
+
+
+class TestScheduler(unittest.TestCase):
+    def test_estimate_cost(self):
+        chap, _, fmt, _ = make_job(10, 70)
+        self.assertEqual(scheduler.estimate_cost(chap, fmt), 60000)
+        self.assertEqual(scheduler.estimate_cost(chap, {}), 60)
+        self.assertEqual(
+            scheduler.estimate_cost(chap, {"bit_rate": "N/A"}), 60
+        )
+
+    def test_schedule_jobs(self):
+        jobs = [
+            make_job(0, 10),
+            make_job(10, 20, bit_rate="4000"),
+            make_job(20, 50),
+            make_job(50, 60),
+        ]
+        self.assertEqual(scheduler.schedule_jobs(jobs), [1, 2, 0, 3])
+        self.assertEqual(
+            scheduler.schedule_jobs(jobs, policy="file"), [0, 1, 2, 3]
+        )
+        self.assertEqual(scheduler.schedule_jobs([]), [])
+
+    def test_makespan(self):
+        costs = [1, 1, 1, 1, 4]
+        self.assertEqual(scheduler.makespan_bound(costs, 2), 4)
+        self.assertEqual(scheduler.makespan(costs, 2), 6)
+        self.assertEqual(scheduler.makespan(sorted(costs)[::-1], 2), 4)
+        self.assertEqual(scheduler.makespan([], 2), 0)
+        self.assertEqual(scheduler.makespan_bound([], 2), 0)
+
+    def test_thread_budget(self):
+        # Start of a run: 16 waiting jobs
+        self.assertEqual(scheduler.thread_budget(32, 4, 1, 15), 8)
+        # End of a run: the last job gets the cores of finished ones
+        self.assertEqual(scheduler.thread_budget(32, 4, 2, 0), 16)
+        self.assertEqual(scheduler.thread_budget(32, 4, 1, 0), 32)
+        self.assertEqual(scheduler.thread_budget(2, 8, 8, 10), 1)
+
+    def test_with_threads(self):
+        cmd = ["ffmpeg", "-y", "-ss", "1", "-i", "in.mp3", "-t", "2", "o.mp3"]
+        self.assertEqual(
+            scheduler.with_threads(cmd, 4),
+            [
+                "ffmpeg",
+                "-y",
+                "-ss",
+                "1",
+                "-threads",
+                "4",
+                "-filter_threads",
+                "4",
+                "-i",
+                "in.mp3",
+                "-t",
+                "2",
+                "-threads",
+                "4",
+                "o.mp3",
+            ],
+        )
+
+    def test_slot_limiter(self):
+        limiter = scheduler.SlotLimiter(1)
+        order = []
+        threads = []
+
+        def run(name, priority):
+            with limiter.slot(priority):
+                order.append(name)
+
+        with limiter.slot():
+            for name, priority in (("low", 0), ("high", 5), ("low2", 0)):
+                thread = threading.Thread(target=run, args=(name, priority))
+                thread.start()
+                threads += [thread]
+                # Let the thread wait for the slot
+                time.sleep(0.05)
+        for thread in threads:
+            thread.join()
+        self.assertEqual(order, ["high", "low", "low2"])
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == "__main__":
+    main()
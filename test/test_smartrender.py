@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+
+from __future__ import unicode_literals
+
+# Allow direct execution
+import json
+import os
+import shutil
+import subprocess as sp
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chapter_split import SplitOptions, split
+from chapter_split.smartrender import (
+    encode_options,
+    join_options,
+    plan_segments,
+    segment_options,
+    segment_name,
+    video_stream,
+    write_concat_list,
+)
+
+
+class TestSmartRender(unittest.TestCase):
+    keyframes = [0.0, 2.0, 4.0, 58.0, 61.0, 120.0]
+
+    def test_plan_segments(self):
+        self.assertEqual(
+            plan_segments(1.0, 100.0, self.keyframes),
+            [(False, 1.0, 2.0), (True, 2.0, 61.0), (False, 61.0, 100.0)],
+        )
+        # Cuts on keyframes are not re-encoded
+        self.assertEqual(
+            plan_segments(2.0, 61.0, self.keyframes), [(True, 2.0, 61.0)]
+        )
+        self.assertEqual(
+            plan_segments(0.0, 3.0, self.keyframes),
+            [(True, 0.0, 2.0), (False, 2.0, 3.0)],
+        )
+        # Less than a GOP
+        self.assertEqual(
+            plan_segments(5.0, 50.0, self.keyframes), [(False, 5.0, 50.0)]
+        )
+        self.assertEqual(plan_segments(5.0, 50.0, []), [(False, 5.0, 50.0)])
+
+    def test_segment_options(self):
+        stream = {"codec_type": "video", "codec_name": "h264"}
+        self.assertEqual(video_stream({"streams": [stream]}), stream)
+        self.assertEqual(video_stream({}), None)
+        # Only the video is written to the segments, with its parameter
+        # sets before every keyframe
+        self.assertEqual(
+            segment_options((True, 2.0, 61.0)),
+            (
+                ["-noaccurate_seek", "-ss", "00:00:02.000"],
+                ["-t", "59.000", "-map", "0:v:0", "-codec", "copy"]
+                + ["-bsf:v", "dump_extra"],
+            ),
+        )
+        input_opts, opts = segment_options((False, 1.5, 2.0), stream)
+        self.assertEqual(input_opts, ["-accurate_seek", "-ss", "00:00:01.500"])
+        self.assertEqual(
+            opts,
+            ["-t", "0.500", "-map", "0:v:0", "-codec:v", "h264"]
+            + ["-x264-params", "repeat-headers=1"],
+        )
+        # The other streams are cut once for the whole chapter
+        self.assertEqual(
+            join_options(1.5, 100.0),
+            (
+                ["-ss", "00:00:01.500", "-t", "98.500"],
+                ["-map", "0:v", "-map", "1", "-map", "-1:v"]
+                + ["-map_metadata", "1", "-codec", "copy"],
+            ),
+        )
+
+    def test_encode_options(self):
+        stream = {
+            "codec_type": "video",
+            "codec_name": "h264",
+            "pix_fmt": "yuv420p",
+            "profile": "High",
+            "level": 40,
+            "time_base": "1/15360",
+        }
+        self.assertEqual(
+            encode_options(stream, ".mp4"),
+            ["-codec:v", "h264", "-pix_fmt", "yuv420p"]
+            + ["-profile:v", "high", "-level:v", "4.0"]
+            + ["-x264-params", "repeat-headers=1"]
+            + ["-video_track_timescale", "15360"],
+        )
+        # Matroska always has a millisecond time base
+        self.assertNotIn("-video_track_timescale", encode_options(stream))
+        _, opts = segment_options((False, 1.5, 2.0), stream, ".m4v")
+        self.assertEqual(opts[:4], ["-t", "0.500", "-map", "0:v:0"])
+        self.assertIn("-video_track_timescale", opts)
+        hevc = {"codec_name": "hevc", "profile": "Main 10", "level": 120}
+        self.assertEqual(
+            encode_options(hevc),
+            ["-codec:v", "hevc", "-profile:v", "main10"]
+            + ["-x265-params", "level-idc=4:repeat-headers=1"],
+        )
+        # Streams which can not be matched are not smart rendered
+        self.assertEqual(encode_options({"codec_name": "vp9"}), None)
+        stream["profile"] = "High 4:4:4 Intra"
+        self.assertEqual(encode_options(stream), None)
+
+    def test_concat_list(self):
+        self.assertEqual(segment_name("d/a.mkv", 1), "d/.a.1.part.mkv")
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "list")
+            write_concat_list(path, [os.path.join(tmpdir, "it's.mkv"), "b"])
+            with open(path) as f:
+                self.assertEqual(f.read(), "file 'it'\\''s.mkv'\nfile 'b'\n")
+
+
+# Chapters of the rendered source, the second one cut inside GOPs
+METADATA = """;FFMETADATA1
+[CHAPTER]
+TIMEBASE=1/1000
+START=0
+END=2300
+title=One
+[CHAPTER]
+TIMEBASE=1/1000
+START=2300
+END=7700
+title=Two
+[CHAPTER]
+TIMEBASE=1/1000
+START=7700
+END=10000
+title=Three
+"""
+
+
+def ffprobe(filename, *options):
+    cmd = ["ffprobe", "-v", "error", "-of", "json"] + list(options)
+    return json.loads(sp.check_output(cmd + [filename]).decode())
+
+
+@unittest.skipUnless(
+    shutil.which("ffmpeg") and shutil.which("ffprobe"), "no ffmpeg"
+)
+class TestSmartRenderOutput(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.source = os.path.join(self.tmpdir.name, "source.mkv")
+        metadata = os.path.join(self.tmpdir.name, "chapters.txt")
+        with open(metadata, "w") as f:
+            f.write(METADATA)
+        # 25 fps with a keyframe every second
+        cmd = ["ffmpeg", "-v", "error", "-y"]
+        video = "testsrc=duration=10:size=160x120:rate=25"
+        cmd += ["-f", "lavfi", "-i", video, "-f", "lavfi"]
+        cmd += ["-i", "sine=duration=10", "-i", metadata]
+        cmd += ["-map", "0", "-map", "1", "-map_chapters", "2"]
+        cmd += ["-codec:v", "libx264", "-g", "25", "-pix_fmt", "yuv420p"]
+        cmd += ["-codec:a", "aac", self.source]
+        if sp.call(cmd, stdin=sp.DEVNULL) != 0:
+            self.skipTest("ffmpeg can not encode H.264 and AAC")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_smart_render(self):
+        options = SplitOptions(
+            smart_render=True,
+            only_chapters=[2],
+            output=os.path.join(self.tmpdir.name, "%(chapter-title)s.mkv"),
+            no_probe_cache=True,
+            quiet=True,
+        )
+        split(self.source, options)
+        output = os.path.join(self.tmpdir.name, "Two.mkv")
+        video = ffprobe(
+            output,
+            "-count_frames",
+            "-select_streams",
+            "v:0",
+            "-show_entries",
+            "stream=nb_read_frames",
+        )
+        # 5.4 s at 25 fps, each frame once
+        self.assertEqual(int(video["streams"][0]["nb_read_frames"]), 135)
+        streams = ffprobe(output, "-show_streams", "-show_format")
+        self.assertEqual(
+            sorted(stream["codec_type"] for stream in streams["streams"]),
+            ["audio", "video"],
+        )
+        # The audio is muxed once, not once per segment
+        duration = float(streams["format"]["duration"])
+        self.assertAlmostEqual(duration, 5.4, delta=0.1)
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+
+from __future__ import unicode_literals
+
+# Allow direct execution
+import os
+import signal
+import sys
+import unittest
+from io import StringIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chapter_split.status import (
+    Piecewise_Progress,
+    Progress,
+    Renderer,
+    Status,
+    StatusException,
+    Text,
+)
+
+
+class TestPiecewiseProgress(unittest.TestCase):
+    def make(self, weights=None, nb_pieces=2):
+        p = Piecewise_Progress(nb_pieces=nb_pieces, weights=weights)
+        p.set_width(12)
+        return p
+
+    def test_boolean_pieces(self):
+        p = self.make()
+        self.assertEqual(str(p), "[----------]")
+        p.set_value(1, True)
+        self.assertEqual(str(p), "[-----#####]")
+        self.assertEqual(p.get_nb_done(), 1)
+        self.assertAlmostEqual(p.get_progress(), 0.5)
+
+    def test_fractions(self):
+        p = self.make()
+        p.set_value(0, 0.4)
+        p.set_value(1, 1.5)
+        self.assertEqual(str(p), "[##---#####]")
+        self.assertEqual(p.get_nb_done(), 1)
+        self.assertAlmostEqual(p.get_progress(), 0.7)
+
+    def test_weights(self):
+        p = self.make(weights=[1, 4])
+        p.set_value(0, True)
+        self.assertEqual(str(p), "[##--------]")
+        self.assertAlmostEqual(p.get_progress(), 0.2)
+        p.set_value(1, 0.5)
+        self.assertEqual(str(p), "[######----]")
+        self.assertAlmostEqual(p.get_progress(), 0.6)
+
+    def test_errors(self):
+        p = self.make()
+        with self.assertRaises(StatusException):
+            p.set_value(0, "done")
+        with self.assertRaises(StatusException):
+            self.make(weights=[1, 2, 3])
+
+
+class TestRenderer(unittest.TestCase):
+    def make_status(self):
+        text = Text(name="text")
+        text.set_fmt("{value:3d}%", value=0)
+        status = Status(width=20, separator=" ")
+        status = status + text + Progress(name="bar")
+        return status
+
+    def test_not_a_tty(self):
+        stream = StringIO()
+        renderer = Renderer(stream, log_interval=0, width=20)
+        self.assertFalse(renderer.is_tty())
+        status = self.make_status()
+        renderer.update(status)
+        renderer.update(status)
+        status.text.value = 50
+        status.bar.set_value(0.5)
+        renderer.update(status)
+        renderer.finish(status)
+        self.assertEqual(
+            stream.getvalue(),
+            "  0% [-------------]\n 50% [######-------]\n",
+        )
+
+    def test_throttling(self):
+        stream = StringIO()
+        renderer = Renderer(stream, interval=3600, width=20, tty=True)
+        renderer._width = 20
+        status = self.make_status()
+        renderer.update(status)
+        status.text.value = 50
+        renderer.update(status)
+        self.assertEqual(stream.getvalue(), "  0% [-------------]\r")
+        renderer.finish(status)
+        self.assertEqual(
+            stream.getvalue(),
+            "  0% [-------------]\r 50% [-------------]\r\n",
+        )
+        renderer.close()
+
+    @unittest.skipUnless(hasattr(signal, "SIGWINCH"), "no SIGWINCH")
+    def test_close(self):
+        previous = signal.getsignal(signal.SIGWINCH)
+        renderer = Renderer(StringIO(), tty=True)
+        self.assertNotEqual(signal.getsignal(signal.SIGWINCH), previous)
+        renderer.close()
+        self.assertEqual(signal.getsignal(signal.SIGWINCH), previous)
+
+    def test_no_terminal(self):
+        # Building a status out of a terminal must not fail
+        status = Status(separator=" ", dynamic_width=True)
+        status += Progress(name="bar")
+        self.assertTrue(str(status).startswith("["))
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+
+from __future__ import unicode_literals
+
+# Allow direct execution
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chapter_split.template import (
+    compile_template,
+    find_collisions,
+    TemplateException,
+)
+
+chapter = {
+    "tags": {"title": "Two: the %(ext)s"},
+    "id": 1,
+    "start_time": "61.500000",
+    "end_time": "200.000000",
+}
+metadata = {"title": "Book"}
+fmt = {"filename": "dir/book.m4b"}
+
+
+class TestTemplate(unittest.TestCase):
+    def test_expand(self):
+        ltest = [
+            (
+                "%(title)s-%(chapter-title)s.%(ext)s",
+                "Book-Two: the %(ext)s.m4b",
+            ),
+            ("%(chapter-index)03d-%(chapter-id)s", "002-1"),
+            ("%(chapter-start)s %(chapter-start)d", "00:01:01 61"),
+            ("%(chapter-duration).1f", "138.5"),
+            ("%(chapter-duration)s", "00:02:18"),
+            ("%(title).2s %(unknown)s 100%", "Bo %(unknown)s 100%"),
+            ("plain", "plain"),
+        ]
+        for template, exp in ltest:
+            self.assertEqual(
+                compile_template(template).expand(chapter, metadata, fmt), exp
+            )
+        self.assertEqual(
+            compile_template("%(title)s.%(ext)s").expand(chapter, {}, fmt),
+            "book.m4b",
+        )
+
+    def test_not_available(self):
+        last = dict(chapter, end_time=None)
+        template = compile_template(
+            "%(chapter-duration)s %(chapter-duration)d"
+        )
+        self.assertEqual(template.expand(last, metadata, fmt), "NA NA")
+
+    def test_format(self):
+        template = compile_template("%(chapter-index)s %(chapter-title)s")
+        self.assertEqual(
+            template.format(chapter, metadata, fmt), "2 Two - the %(ext)s"
+        )
+        self.assertEqual(
+            template.format(chapter, metadata, fmt, restricted=True),
+            "2_Two_-_the_%_ext_s",
+        )
+
+    def test_string_field(self):
+        with self.assertRaises(TemplateException):
+            compile_template("%(chapter-title)03d")
+
+    def test_find_collisions(self):
+        names = ["a.mp3", "b.mp3", "./a.mp3", "c.mp3", "b.mp3"]
+        self.assertEqual(
+            find_collisions(names), {"a.mp3": [0, 2], "b.mp3": [1, 4]}
+        )
+        self.assertEqual(find_collisions(["a.mp3", "b.mp3"]), {})
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+
+from __future__ import unicode_literals
+
+# Allow direct execution
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chapter_split import trace
+
+
+class TestTrace(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "trace.json")
+
+    def tearDown(self):
+        trace.stop_trace()
+        self.tmpdir.cleanup()
+
+    def test_disabled(self):
+        self.assertFalse(trace.is_tracing())
+        with trace.span("probe"):
+            pass
+        trace.complete("probe", trace.now())
+        command_trace = trace.CommandTrace("out.mkv")
+        command_trace.spawned()
+        command_trace.exited()
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_trace(self):
+        trace.start_trace(self.path)
+        with trace.span("split", chapters=2):
+            command_trace = trace.CommandTrace("out.mkv", tid=1)
+            command_trace.spawned()
+            command_trace.progress()
+            command_trace.progress()
+            command_trace.closed()
+            command_trace.exited()
+        trace.stop_trace()
+        with open(self.path) as f:
+            events = json.load(f)
+        names = [event["name"] for event in events]
+        self.assertEqual(
+            names,
+            [
+                "process_name",
+                "spawn",
+                "startup",
+                "first progress",
+                "encode",
+                "exit",
+                "split",
+                "end",
+            ],
+        )
+        spans = [event for event in events if event["ph"] == "X"]
+        for event in spans[:-1]:
+            self.assertEqual(event["tid"], 1)
+            self.assertEqual(event["args"], {"output": "out.mkv"})
+        for before, after in zip(spans[:-2], spans[1:-1]):
+            end = before["ts"] + before["dur"]
+            self.assertAlmostEqual(end, after["ts"])
+        split = spans[-1]
+        self.assertEqual(split["args"], {"chapters": 2})
+        self.assertLessEqual(split["ts"], spans[0]["ts"])
+        self.assertGreaterEqual(
+            split["ts"] + split["dur"], spans[-2]["ts"] + spans[-2]["dur"]
+        )
+
+    def test_unterminated(self):
+        trace.start_trace(self.path)
+        trace.instant("started")
+        # The trace of an interrupted run is left open
+        with open(self.path) as f:
+            text = f.read()
+        events = json.loads(text.rstrip().rstrip(",") + "]")
+        self.assertEqual(events[-1]["name"], "started")
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == "__main__":
+    main()
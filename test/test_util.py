@@ -3,7 +3,10 @@
 from __future__ import unicode_literals
 
 # Allow direct execution
+import math
 import os
+import random
+import re
 import sys
 import unittest
 from unittest.mock import patch
@@ -13,6 +16,7 @@ from io import StringIO
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 import chapter_split.util as util
+from chapter_split.template import gen_filename
 
 comment_1 = """Cello collection of Studio ghibli with Calcifer in fireplace.
 ---------------------------------------------------------------------------------------------------------
@@ -111,6 +115,8 @@ class TestJson(unittest.TestCase):
         self.assertEqual(util.msec_to_hour(1524), "00:00:01.524")
         self.assertEqual(util.msec_to_hour(67546), "00:01:07.546")
         self.assertEqual(util.msec_to_hour(98479), "00:01:38.478")
+        self.assertEqual(util.msec_to_hour(1050), "00:00:01.050")
+        self.assertEqual(util.msec_to_hour(60000), "00:01:00.000")
 
     def test_sanitize_filename(self):
         ltest = [
@@ -245,12 +251,12 @@ class TestJson(unittest.TestCase):
         for (template, exp) in ltest:
             print(
                 'Testing\
-                util.gen_filename("{}", chapter, metadata, fmt)'.format(
+                gen_filename("{}", chapter, metadata, fmt)'.format(
                     template
                 )
             )
             self.assertEqual(
-                util.gen_filename(template, chapter, metadata, fmt), exp
+                gen_filename(template, chapter, metadata, fmt), exp
             )
 
     def test_gen_filename_no_title(self):
@@ -277,12 +283,12 @@ class TestJson(unittest.TestCase):
         for (template, exp) in ltest:
             print(
                 'Testing\
-                util.gen_filename("{}", chapter, metadata, fmt)'.format(
+                gen_filename("{}", chapter, metadata, fmt)'.format(
                     template
                 )
             )
             self.assertEqual(
-                util.gen_filename(template, chapter, metadata, fmt), exp
+                gen_filename(template, chapter, metadata, fmt), exp
             )
 
     def test_get_filesystem_encoding(self):
@@ -334,6 +340,113 @@ class TestJson(unittest.TestCase):
             )
             self.assertEqual(util.parse_duration(duration), exp)
 
+    def test_extract_chapters_txt(self):
+        text = "0:00 Intro\n1:30 - Middle\n10:00 End\n"
+        chapters = util.extract_chapters_txt(text, 300.0)
+        self.assertEqual(
+            [(c["tags"]["title"], c["start"], c["end"]) for c in chapters],
+            [("Intro", 0, 90000), ("Middle", 90000, 300000)],
+        )
+        # Unknown duration, as when reading the standard input
+        chapters = util.extract_chapters_txt(text, None)
+        self.assertEqual(
+            [(c["start"], c["end"]) for c in chapters],
+            [(0, 90000), (90000, 600000), (600000, None)],
+        )
+        self.assertEqual(chapters[2]["end_time"], None)
+
+    def test_read_chapters_txt(self):
+        # read_chapters_txt() should give the chapters of the regex based
+        # parser it replaced on any input
+        rand = random.Random(42)
+        pieces = ["Intro", " - ", "\t", "<a href='#'>1:00</a>", "\r", ""]
+        texts = [comment_1, "", "\n", "no time\n", "1:00\n\n0:30 x"]
+        for _ in range(300):
+            lines = []
+            for _ in range(rand.randint(0, 12)):
+                points = [
+                    "{}:{:02d}".format(rand.randint(0, 9), s)
+                    for s in rand.sample(range(60), 2)
+                ]
+                points += ["1:02:03", "01:02:03", "12:345", "1:2"]
+                line = rand.sample(pieces + points, rand.randint(0, 4))
+                lines += ["".join(line)]
+            texts += ["\n".join(lines)]
+        for text in texts:
+            for duration in (None, 0.0, 90.0, 3000.0, 40000.0):
+                self.assertEqual(
+                    util.read_chapters_txt(StringIO(text), duration),
+                    _extract_chapters_txt_reference(text, duration),
+                )
+                self.assertEqual(
+                    util.extract_chapters_txt(text, duration),
+                    _extract_chapters_txt_reference(text, duration),
+                )
+
+    def test_read_chapters_txt_stops_early(self):
+        # The lines after the end of the media are not read
+        def lines():
+            yield "0:00 One\n"
+            yield "1:00 Two\n"
+            yield "2:00 Three\n"
+            raise AssertionError("read too far")
+
+        chapters = util.read_chapters_txt(lines(), 30.0)
+        self.assertEqual([c["end"] for c in chapters], [30000])
+
+
+def _extract_chapters_txt_reference(description, duration):
+    """The implementation of extract_chapters_txt() before
+    read_chapters_txt()."""
+    if not description:
+        return None
+    chapter_lines = util.search_all(
+        r"^.*(((\d|)\d:|)\d|)\d:\d\d.*$", description
+    )
+    if not chapter_lines:
+        return None
+    for idx, chap in enumerate(chapter_lines):
+        time_point = re.search(r"(((\d|)\d:|)\d|)\d:\d\d", chap).group(0)
+        chap_name = re.sub(r"(((\d|)\d:|)\d|)\d:\d\d", "", chap)
+        chapter_lines[idx] = (chap_name, time_point)
+    chapters = []
+    _id = 0
+    for next_num, (chapter_line, time_point) in enumerate(
+        chapter_lines, start=1
+    ):
+        start_time = util.parse_duration(time_point)
+        if start_time is None:
+            continue
+        if duration is not None and start_time > duration:
+            break
+        if next_num == len(chapter_lines):
+            end_time = duration
+        else:
+            end_time = util.parse_duration(chapter_lines[next_num][1])
+            if end_time is None:
+                continue
+        if duration is not None and end_time > duration:
+            end_time = duration
+        if end_time is not None and start_time > end_time:
+            break
+        chapter_title = re.sub(r"<a[^>]+>[^<]+</a>", "", chapter_line).strip(
+            " \t-"
+        )
+        chapter_title = re.sub(r"\s+", " ", chapter_title)
+        end = math.ceil(1000 * end_time) if end_time is not None else None
+        chapters.append(
+            {
+                "start_time": start_time,
+                "start": math.ceil(1000 * start_time),
+                "end_time": end_time,
+                "end": end,
+                "id": _id,
+                "tags": {"title": chapter_title},
+            }
+        )
+        _id += 1
+    return chapters
+
 
 def main():
     unittest.main()